@@ -1,58 +1,270 @@
-from openai.types.shared import Reasoning
-from agents import Runner, Agent, ModelSettings, SQLiteSession
-from agents.mcp import MCPServerStreamableHttp
-from agents.extensions.memory import EncryptedSession
-from openai.types.responses import ResponseTextDeltaEvent
-from aiomqtt import Client
+from service_status import StartupTimer
+startup = StartupTimer("assistant")
+
+with startup.phase("import"):
+    from agents import Runner, Agent, ModelSettings, RunConfig
+    from agents.mcp import MCPServerStreamableHttp
+    from openai.types.responses import ResponseTextDeltaEvent
+    from aiomqtt import Client, Will
 import asyncio
-from nltk.tokenize import sent_tokenize
+import contextlib
+import os
+
+from sentence_streamer import SentenceStreamer
+from session_memory import BufferedSession, HistoryPolicy, MemoryStore
+from speculation import ReplyOutput, Speculation, SpeculationStats
+from tracing import Tracer, unwrap_text, wrap_text
 
 broker = "localhost"
 port = 1883
+# The single microphone setup uses "assistant/instruction" and "assistant/reply",
+# other devices "assistant/<device>/instruction" and "assistant/<device>/reply"
 topic_instruction = "assistant/instruction"
+topic_device_instruction = "assistant/+/instruction"
+# Partial transcripts while the user is still speaking
+topic_instruction_partial = "assistant/instruction/partial"
+topic_device_instruction_partial = "assistant/+/instruction/partial"
+PARTIAL_SUFFIX = "/partial"
 topic_reply = "assistant/reply"
+topic_device_reply = "assistant/{session}/reply"
+# Published on "<reply topic>/cancel" when a newer instruction replaces the current reply
+CANCEL_SUFFIX = "/cancel"
+# Session of the single microphone setup; other devices use their device name
+DEFAULT_SESSION = os.environ.get("ASSISTANT_DEFAULT_SESSION", "user-1")
+# Conversation memory of all sessions. The stored items are encrypted with ASSISTANT_MEMORY_KEY,
+# set it to an empty string to store them in plain text
+MEMORY_DB = os.environ.get("ASSISTANT_MEMORY_DB", "memory.db")
+MEMORY_KEY = os.environ.get("ASSISTANT_MEMORY_KEY", "secret-key")
+# Items older than this are left out of the conversation, 0 keeps them forever
+MEMORY_TTL_S = float(os.environ.get("ASSISTANT_MEMORY_TTL", "120"))
+# Tokens of conversation history sent with an instruction, older turns are summarized
+HISTORY_TOKENS = int(os.environ.get("ASSISTANT_HISTORY_TOKENS", "3000"))
+# What partial transcripts are used for: "off", "warm" (warm up the MCP server) or
+# "run" (also start the agent run speculatively once a partial is stable)
+SPECULATION = os.environ.get("ASSISTANT_SPECULATION", "warm")
+SPECULATION_STABLE_S = float(os.environ.get("ASSISTANT_SPECULATION_STABLE_MS", "300")) / 1000
+# A speculation whose final instruction does not follow this long after the last partial is dropped,
+# e.g. when speech-to-text gave up or recognized nothing and publishes no instruction at all
+SPECULATION_EXPIRY_S = float(os.environ.get("ASSISTANT_SPECULATION_EXPIRY_MS", "10000")) / 1000
+# Sentences shorter than this are sent together with the next one to text-to-speech
+MIN_SENTENCE_LENGTH = 0
+MAX_SENTENCE_LENGTH = 300
+# Agent runs of different sessions executed at the same time
+MAX_CONCURRENT_RUNS = 4
 
-class SentenceStreamer:
-    def __init__(self):
-        self.buffer = ""  # Holds text not yet emitted
+tracer = Tracer("assistant")
 
-    def feed(self, chunk):
-        """
-        Feed a new chunk of text from the LLM stream.
-        Returns a list of complete sentences ready to forward.
-        """
-        self.buffer += chunk
-        sentences = sent_tokenize(self.buffer)
 
-        # Emit all complete sentences except the last one (may be incomplete)
-        if len(sentences) == 0:
-            return []
+def session_from_topic(topic):
+    levels = topic.removesuffix(PARTIAL_SUFFIX).split("/")
+    return levels[1] if len(levels) == 3 else DEFAULT_SESSION
 
-        # Keep the last sentence in buffer for next chunk
-        self.buffer = sentences[-1]
 
-        # Return all sentences except the last (still in buffer)
-        return sentences[:-1]
+def reply_topic(session_id):
+    return topic_reply if session_id == DEFAULT_SESSION else topic_device_reply.format(session=session_id)
 
-    def flush(self):
-        """
-        Call at the end to emit any leftover text as a sentence.
-        """
-        leftover = self.buffer.strip()
-        self.buffer = ""
-        return [leftover] if leftover else []
 
-async def run_agent_on_incoming_instructions():
+class InstructionScheduler:
+    """
+    Runs the agent for incoming instructions, one run per session at a time.
+    A new instruction for a session cancels its run in flight and tells text-to-speech to
+    drop the stale reply; instructions of different sessions run concurrently.
+    Partial transcripts warm up the tools and may start a speculative run, see speculation.py.
+    """
+
+    def __init__(self, client, assistant, max_concurrent_runs, store, warm_up=None):
+        self.client = client
+        self.assistant = assistant
+        self.semaphore = asyncio.Semaphore(max_concurrent_runs)
+        self.tasks = {}
+        self.store = store
+        self.memories = {}
+        self.history_policy = HistoryPolicy(HISTORY_TOKENS)
+        self.run_config = RunConfig(session_input_callback=self.history_policy.apply)
+        self.warm_up = warm_up
+        # Sessions that received partials since their last instruction
+        self.listening = set()
+        self.timers = {}
+        self.speculations = {}
+        self.expiries = {}
+        self.speculation_stats = SpeculationStats()
+
+    def memory(self, session_id):
+        if session_id not in self.memories:
+            self.memories[session_id] = BufferedSession(session_id, self.store, ttl=MEMORY_TTL_S)
+        return self.memories[session_id]
+
+    async def submit(self, session_id, instruction, interaction=None):
+        self.listening.discard(session_id)
+        timer = self.timers.pop(session_id, None)
+        if timer is not None:
+            timer.cancel()
+        self.cancel_expiry(session_id)
+        speculation = self.speculations.pop(session_id, None)
+        if speculation is not None and not speculation.matches(instruction, interaction):
+            await self.abort(session_id, speculation, "diverged")
+            speculation = None
+
+        previous = self.tasks.get(session_id)
+        if previous is not None:
+            if not previous.done():
+                print(f"New instruction for session '{session_id}', cancelling the running reply.")
+                previous.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await previous
+            # Text-to-speech may still be speaking the previous reply
+            await self.client.publish(reply_topic(session_id) + CANCEL_SUFFIX, session_id)
+
+        if speculation is not None:
+            self.tasks[session_id] = speculation.task
+            await self.commit(session_id, speculation, instruction, interaction)
+        else:
+            self.tasks[session_id] = asyncio.create_task(self.run(session_id, instruction, interaction))
+
+    async def partial(self, session_id, text, interaction=None):
+        """A partial transcript of an instruction the user is still speaking."""
+        if session_id not in self.listening:
+            self.listening.add(session_id)
+            if self.warm_up is not None:
+                asyncio.create_task(self.warm_up())
+        if SPECULATION != "run" or not text.strip():
+            return
+        speculation = self.speculations.get(session_id)
+        if speculation is not None:
+            if speculation.matches(text, interaction):
+                self.schedule_expiry(session_id, speculation)
+                return
+            # The user kept talking
+            del self.speculations[session_id]
+            self.cancel_expiry(session_id)
+            await self.abort(session_id, speculation, "superseded")
+        timer = self.timers.pop(session_id, None)
+        if timer is not None:
+            timer.cancel()
+        # Speculate once the partial has been stable for a moment
+        self.timers[session_id] = asyncio.get_running_loop().call_later(
+            SPECULATION_STABLE_S, self.speculate, session_id, text, interaction)
+
+    def speculate(self, session_id, text, interaction):
+        self.timers.pop(session_id, None)
+        output = ReplyOutput(lambda sentence, first: self.forward(session_id, sentence, interaction, first), held=True)
+        speculation = Speculation(text, interaction, output)
+        speculation.task = asyncio.create_task(self.run(session_id, text, interaction, speculation))
+        self.speculations[session_id] = speculation
+        self.schedule_expiry(session_id, speculation)
+        self.speculation_stats.started += 1
+        print(f"Speculatively answering session '{session_id}': '{text}'")
 
-    # Create encrypted SQLite session
-    underlying = SQLiteSession("user-1")
+    def schedule_expiry(self, session_id, speculation):
+        self.cancel_expiry(session_id)
+        self.expiries[session_id] = asyncio.get_running_loop().call_later(
+            SPECULATION_EXPIRY_S, lambda: asyncio.create_task(self.expire(session_id, speculation)))
 
-    session = EncryptedSession(
-        session_id="user-1",
-        underlying_session=underlying,
-        encryption_key="secret-key",
-        ttl=120,
-    )
+    def cancel_expiry(self, session_id):
+        expiry = self.expiries.pop(session_id, None)
+        if expiry is not None:
+            expiry.cancel()
+
+    async def expire(self, session_id, speculation):
+        """No final instruction followed the partials of a speculation."""
+        if self.speculations.get(session_id) is not speculation:
+            return
+        del self.speculations[session_id]
+        self.expiries.pop(session_id, None)
+        # The next partial is the start of a new instruction again
+        self.listening.discard(session_id)
+        await self.abort(session_id, speculation, "expired")
+
+    async def commit(self, session_id, speculation, instruction, interaction):
+        head_start = self.speculation_stats.commit(speculation)
+        speculation.committed = True
+        speculation.instruction = instruction
+        await tracer.amark(self.client, interaction, "run_started", session=session_id, speculative=True)
+        if speculation.first_token:
+            await tracer.amark(self.client, interaction, "first_token", session=session_id)
+        await tracer.amark(self.client, interaction, "speculation_committed", session=session_id,
+                           head_start_ms=round(head_start * 1000))
+        print(f"Committing the speculative reply of session '{session_id}'. Speculation: {self.speculation_stats}")
+        await speculation.output.release()
+        speculation.decided.set()
+
+    async def abort(self, session_id, speculation, reason):
+        self.speculation_stats.abort(reason)
+        speculation.task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await speculation.task
+        await tracer.amark(self.client, speculation.interaction, "speculation_aborted", session=session_id, reason=reason)
+        print(f"Dropping the speculative reply of session '{session_id}' ({reason}). Speculation: {self.speculation_stats}")
+
+    async def forward(self, session_id, sentence, interaction=None, first=False):
+        if first:
+            await tracer.amark(self.client, interaction, "first_sentence", session=session_id)
+        topic = reply_topic(session_id)
+        print(f"Forwarding assistant reply to mqtt topic '{topic}'.")
+        print(f"Sentence: {sentence}")
+        await self.client.publish(topic, wrap_text(sentence, interaction))
+
+    async def run(self, session_id, user_instruction, interaction=None, speculation=None):
+        memory = self.memory(session_id)
+        result = None
+        try:
+            async with self.semaphore:
+                if speculation is None:
+                    await tracer.amark(self.client, interaction, "run_started", session=session_id)
+                    output = ReplyOutput(lambda sentence, first: self.forward(session_id, sentence, interaction, first))
+                else:
+                    await tracer.amark(self.client, interaction, "speculation_started", session=session_id)
+                    output = speculation.output
+                tokens = 0
+                if speculation is None:
+                    result = Runner.run_streamed(self.assistant, input=f"{user_instruction}", session=memory,
+                                                 run_config=self.run_config)
+                else:
+                    # Nothing goes into the session before the instruction is final
+                    prepared = self.history_policy.apply(await memory.get_items(),
+                                                         [{"role": "user", "content": user_instruction}])
+                    result = Runner.run_streamed(self.assistant, input=prepared)
+                streamer = SentenceStreamer(MIN_SENTENCE_LENGTH, MAX_SENTENCE_LENGTH)
+                async for event in result.stream_events():
+                    if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+                        chunk = event.data.delta
+                        if not tokens:
+                            if speculation is None or speculation.committed:
+                                await tracer.amark(self.client, interaction, "first_token", session=session_id)
+                            else:
+                                speculation.first_token = True
+                        tokens += 1
+                        for sentence in streamer.feed(chunk):
+                            await output.send(sentence)
+                # Flush leftover
+                for sentence in streamer.flush():
+                    await output.send(sentence)
+            if speculation is not None:
+                # Waits without holding a run slot; an expiry cancels the run if nothing follows
+                await speculation.decided.wait()
+                # The instruction and the new items; the history before it is already stored.
+                # The final wording of the instruction is remembered, not the partial one
+                new_items = result.to_input_list()[len(prepared) - 1:]
+                new_items[0] = {"role": "user", "content": speculation.instruction}
+                await memory.add_items(new_items)
+            await tracer.amark(self.client, interaction, "reply_done", session=session_id, sentences=output.sentences)
+        except asyncio.CancelledError:
+            if result is not None:
+                result.cancel()
+            raise
+        except Exception as e:
+            if speculation is not None and not speculation.committed:
+                # The final instruction is answered by a regular run instead
+                speculation.failed = True
+                print(f"Speculative run of session '{session_id}' failed: {e}")
+                return
+            error_reply = f"Error processing request."
+            print(e)
+            print(f"Forwarding assistant error to mqtt topic '{reply_topic(session_id)}'.")
+            await self.client.publish(reply_topic(session_id), wrap_text(error_reply, interaction))
+            await tracer.amark(self.client, interaction, "reply_done", session=session_id, error=True)
+
+async def run_agent_on_incoming_instructions():
 
     async with MCPServerStreamableHttp(
         name="tagesschau_news",
@@ -72,33 +284,46 @@ async def run_agent_on_incoming_instructions():
             mcp_servers=[server],
         )
 
-        async with Client(broker, port=port) as client:
-            await client.subscribe(topic_instruction)
-            print(f"Subscribed to mqtt topic '{topic_instruction}' to wait for incoming instructions.")
-
-            async for message in client.messages:
-                user_instruction = message.payload.decode()
-                print(f"Received user instruction: '{user_instruction}'")
-
-                try:
-                    result = Runner.run_streamed(assistant, input=f"{user_instruction}", session=session)
-                    streamer = SentenceStreamer()
-                    async for event in result.stream_events():
-                        if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
-                            chunk = event.data.delta
-                            for sentence in streamer.feed(chunk):
-                                print(f"Forwarding assistant reply to mqtt topic '{topic_reply}'.")
-                                print(f"Sentence: {sentence}")
-                                await client.publish(topic_reply, sentence)
-                    # Flush leftover
-                    for sentence in streamer.flush():
-                        print(f"Forwarding assistant reply to mqtt topic '{topic_reply}'.")
-                        print(f"Sentence: {sentence}")
-                        await client.publish(topic_reply, sentence)
-                except Exception as e:
-                    error_reply = f"Error processing request."
-                    print(e)
-                    print(f"Forwarding assistant error to mqtt topic '{topic_reply}'.")
-                    await client.publish(topic_reply, error_reply)
+        async def warm_up():
+            # Fetches the tool list if it is not cached yet and revives the MCP connection
+            try:
+                await server.list_tools()
+                if server.session is not None:
+                    await server.session.send_ping()
+            except Exception as e:
+                print(f"Warming up the MCP server failed: {e}")
+
+        with startup.phase("mcp_tools"):
+            # Fetched now instead of on the first instruction; cached from then on
+            await server.list_tools()
+
+        store = MemoryStore(MEMORY_DB, MEMORY_KEY)
+        will_topic, will_payload = startup.will()
+        try:
+            async with Client(broker, port=port, will=Will(will_topic, will_payload, qos=1, retain=True)) as client:
+                await client.subscribe(topic_instruction)
+                await client.subscribe(topic_device_instruction)
+                print(f"Subscribed to mqtt topics '{topic_instruction}' and '{topic_device_instruction}' to wait for incoming instructions.")
+                if SPECULATION != "off":
+                    await client.subscribe(topic_instruction_partial)
+                    await client.subscribe(topic_device_instruction_partial)
+                    print(f"Subscribed to partial transcripts, speculation mode '{SPECULATION}'.")
+                scheduler = InstructionScheduler(client, assistant, MAX_CONCURRENT_RUNS, store,
+                                                 warm_up if SPECULATION != "off" else None)
+                ready_topic, ready_payload = startup.ready()
+                await client.publish(ready_topic, ready_payload, qos=1, retain=True)
+
+                async for message in client.messages:
+                    topic = str(message.topic)
+                    session_id = session_from_topic(topic)
+                    text, interaction = unwrap_text(message.payload)
+                    if topic.endswith(PARTIAL_SUFFIX):
+                        await scheduler.partial(session_id, text, interaction)
+                        continue
+                    await tracer.amark(client, interaction, "instruction_received", session=session_id)
+                    print(f"Received user instruction for session '{session_id}': '{text}'")
+                    await scheduler.submit(session_id, text, interaction)
+        finally:
+            store.close()
 
 asyncio.run(run_agent_on_incoming_instructions())
\ No newline at end of file
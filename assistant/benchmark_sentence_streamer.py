@@ -0,0 +1,99 @@
+"""
+Micro-benchmark of the incremental SentenceStreamer against the previous NLTK based one.
+
+Streams synthetic responses of growing length in LLM-sized deltas through both
+implementations and prints the total segmentation time, the slowest single `feed`
+call and the number of sentences found.
+
+    uv run --group bench benchmark_sentence_streamer.py
+"""
+
+import argparse
+import random
+import time
+
+from nltk.tokenize import sent_tokenize
+
+from sentence_streamer import SentenceStreamer
+
+SENTENCES = [
+    "The weather in Hamburg stays mostly cloudy today.",
+    "Dr. Meyer said the new bridge costs about 3.5 million euros.",
+    "Trains between Berlin and Munich are delayed, e.g. the ICE at 7 p.m. is cancelled.",
+    "Is that really true?",
+    "Wow!",
+    "Some people waited... and waited for hours.",
+    "Prices rose by 2.4 percent compared to last year, according to the U.S. statistics office.",
+    "Fans celebrated the win late into the night.",
+]
+
+
+class NltkSentenceStreamer:
+    """The previous implementation, re-tokenizing the buffer on every delta."""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        sentences = sent_tokenize(self.buffer)
+        if len(sentences) == 0:
+            return []
+        self.buffer = sentences[-1]
+        return sentences[:-1]
+
+    def flush(self):
+        leftover = self.buffer.strip()
+        self.buffer = ""
+        return [leftover] if leftover else []
+
+
+def make_deltas(n_chars, seed=0):
+    """A response of about `n_chars` characters split like LLM token deltas (1 to 6 characters)."""
+    rng = random.Random(seed)
+    text = ""
+    while len(text) < n_chars:
+        text += rng.choice(SENTENCES) + " "
+    deltas, i = [], 0
+    while i < len(text):
+        step = rng.randint(1, 6)
+        deltas.append(text[i:i + step])
+        i += step
+    return deltas
+
+
+def run(streamer, deltas):
+    slowest = 0.0
+    count = 0
+    start = time.perf_counter()
+    for delta in deltas:
+        t = time.perf_counter()
+        count += len(streamer.feed(delta))
+        slowest = max(slowest, time.perf_counter() - t)
+    count += len(streamer.flush())
+    return time.perf_counter() - start, slowest, count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lengths", type=int, nargs="+", default=[1_000, 10_000, 50_000, 200_000],
+                        help="response lengths in characters")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per length, the fastest is reported")
+    args = parser.parse_args()
+
+    # The first call loads the Punkt model, which the previous implementation paid on the first reply
+    start = time.perf_counter()
+    NltkSentenceStreamer().feed("Loading Punkt. ")
+    print(f"NLTK first call (Punkt loading): {(time.perf_counter() - start) * 1000:.1f} ms\n")
+
+    print(f"{'chars':>8} {'impl':>12} {'total ms':>10} {'us/delta':>9} {'max feed ms':>12} {'sentences':>10}")
+    for length in args.lengths:
+        deltas = make_deltas(length)
+        for name, factory in (("nltk", NltkSentenceStreamer), ("incremental", SentenceStreamer)):
+            total, slowest, count = min(run(factory(), deltas) for _ in range(args.repeat))
+            print(f"{length:>8} {name:>12} {total * 1000:>10.1f} {total / len(deltas) * 1e6:>9.1f} "
+                  f"{slowest * 1000:>12.3f} {count:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Incremental sentence segmentation of streamed LLM output.
+
+Every delta is scanned once: the streamer remembers how far it got and only looks at
+newly appended text, so the work grows linearly with the length of the response.
+Sentence ends are `.`, `!`, `?` and `…` followed by whitespace. A period does not end
+a sentence after a title ("Dr."), an initial ("J.") or inside a number ("3.5"); after
+an ellipsis or an abbreviation like "etc." it only does when the next word is
+capitalized.
+"""
+
+from __future__ import annotations
+
+TERMINATORS = ".!?…"
+CLOSERS = "\"'”’)]"
+OPENERS = "\"'“‘(["
+# Never end a sentence, they are followed by a name or number
+TITLES = frozenset({
+    "mr", "mrs", "ms", "dr", "prof", "st", "mt", "sr", "jr", "no", "nr", "fig", "vol", "gen", "sen", "rep", "gov",
+})
+# End a sentence only when the next word is capitalized
+ABBREVIATIONS = frozenset({
+    "etc", "e.g", "i.e", "vs", "inc", "ltd", "co", "corp", "approx", "dept", "est", "a.m", "p.m", "u.s", "u.k",
+    "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec",
+})
+# Where an overlong sentence is cut, best first
+SOFT_BREAKS = ("; ", ": ", ", ", " ")
+
+
+class SentenceStreamer:
+    def __init__(self, min_length: int = 0, max_length: int = 300):
+        """
+        `min_length`: sentences shorter than this are merged with the next one.
+        `max_length`: text without a sentence end is cut at a clause or word boundary once it gets this long.
+        """
+        self.min_length = min_length
+        self.max_length = max_length
+        self.buffer = ""  # Holds text not yet emitted
+        self.pos = 0      # Everything before this position in the buffer has been scanned
+
+    def feed(self, chunk):
+        """
+        Feed a new chunk of text from the LLM stream.
+        Returns a list of complete sentences ready to forward.
+        """
+        self.buffer += chunk
+        sentences = []
+        while True:
+            end = self._next_boundary()
+            if end is None:
+                break
+            sentence = self.buffer[:end].strip()
+            if len(sentence) >= self.min_length:
+                if sentence:
+                    sentences.append(sentence)
+                self._consume(end)
+
+        if len(self.buffer) >= self.max_length:
+            cut = self._soft_break()
+            sentences.append(self.buffer[:cut].strip())
+            self._consume(cut)
+        return sentences
+
+    def flush(self):
+        """
+        Call at the end to emit any leftover text as a sentence.
+        """
+        leftover = self.buffer.strip()
+        self.buffer = ""
+        self.pos = 0
+        return [leftover] if leftover else []
+
+    def _consume(self, end):
+        self.buffer = self.buffer[end:]
+        self.pos = max(self.pos - end, 0)
+
+    def _next_boundary(self):
+        """Scan from `pos` and return the end of the next sentence, or None if more text is needed."""
+        buffer = self.buffer
+        n = len(buffer)
+        i = self.pos
+        while i < n:
+            if buffer[i] not in TERMINATORS:
+                i += 1
+                continue
+
+            j = i
+            while j < n and buffer[j] in TERMINATORS:
+                j += 1
+            while j < n and buffer[j] in CLOSERS:
+                j += 1
+            if j == n:
+                # The terminator may still be followed by more of a number or an abbreviation
+                self.pos = i
+                return None
+            if not buffer[j].isspace():
+                i = j
+                continue
+
+            decision = self._ends_sentence(i, j)
+            if decision is None:
+                self.pos = i
+                return None
+            self.pos = j
+            if decision:
+                return j
+            i = j
+        self.pos = n
+        return None
+
+    def _ends_sentence(self, i, j):
+        """
+        Whether the terminators at buffer[i:j] end a sentence.
+        Returns None if that depends on text that has not arrived yet.
+        """
+        marks = self.buffer[i:j]
+        if "!" in marks or "?" in marks:
+            return True
+
+        needs_capital = "…" in marks or marks.count(".") > 1
+        if not needs_capital:
+            word = self._word_before(i)
+            # Single letters are initials, except the pronoun "I"
+            if word in TITLES or (len(word) == 1 and word.isalpha() and word != "i"):
+                return False
+            needs_capital = word in ABBREVIATIONS
+        if not needs_capital:
+            return True
+
+        k = j
+        while k < len(self.buffer) and self.buffer[k].isspace():
+            k += 1
+        while k < len(self.buffer) and self.buffer[k] in OPENERS:
+            k += 1
+        if k == len(self.buffer):
+            return None
+        return self.buffer[k].isupper() or self.buffer[k].isdigit()
+
+    def _word_before(self, i):
+        start = i
+        while start > 0 and not self.buffer[start - 1].isspace() and self.buffer[start - 1] not in OPENERS:
+            start -= 1
+        return self.buffer[start:i].lower()
+
+    def _soft_break(self):
+        limit = self.max_length
+        for separator in SOFT_BREAKS:
+            cut = self.buffer.rfind(separator, 0, limit)
+            if cut > 0:
+                return cut + len(separator)
+        return limit
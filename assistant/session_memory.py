@@ -0,0 +1,267 @@
+"""
+Conversation memory of the assistant sessions.
+
+The history of a session is read from SQLite once, when the session is first used, and
+then kept in memory: the agent reads it without touching the disk, and new items are
+handed to a writer thread that stores them in batches. A crash loses at most the
+items of the last `flush_interval` seconds. Items are stored encrypted when the store
+has a key, and items older than the `ttl` of a session are left out of its history,
+like the encrypted sessions of the Agents SDK do.
+
+Only a bounded part of the history goes into the prompt, so prompt tokens and time to
+first token do not grow with the conversation: `HistoryPolicy` keeps the latest whole
+turns that fit a token budget and replaces the older ones with a short note of what
+the user asked before.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import json
+import queue
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from agents.memory import SessionABC
+
+Item = Dict[str, Any]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS session_items_session ON session_items (session_id, id);
+"""
+
+
+def estimate_tokens(item: Item) -> int:
+    """About four characters per token, good enough for a budget."""
+    return len(json.dumps(item, ensure_ascii=False)) // 4 + 1
+
+
+def user_text(item: Item) -> Optional[str]:
+    """Text of a user message, None for any other item."""
+    if item.get("role") != "user":
+        return None
+    content = item.get("content")
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict)).strip()
+    return ""
+
+
+def split_turns(items: List[Item]) -> List[List[Item]]:
+    """Split a history at every user message."""
+    turns: List[List[Item]] = []
+    for item in items:
+        if user_text(item) is not None or not turns:
+            turns.append([])
+        turns[-1].append(item)
+    return turns
+
+
+@dataclass
+class HistoryPolicy:
+    max_tokens: int = 3000    # Budget of the history and the new instruction in the prompt
+    summary_chars: int = 600  # Length of the note about older turns, 0 leaves them out entirely
+
+    def apply(self, history: List[Item], new_input: List[Item]) -> List[Item]:
+        """`session_input_callback` of the agent run: the prompt input for a new instruction."""
+        used = sum(estimate_tokens(item) for item in new_input)
+        turns = split_turns(history)
+        # A turn cut off at the start of the history would begin with a tool output
+        # whose call is missing, which the model API rejects
+        if turns and user_text(turns[0][0]) is None:
+            turns = turns[1:]
+        kept = len(turns)
+        while kept:
+            cost = sum(estimate_tokens(item) for item in turns[kept - 1])
+            if used + cost > self.max_tokens:
+                break
+            used += cost
+            kept -= 1
+        older, recent = turns[:kept], turns[kept:]
+        return self.summarize(older) + [item for turn in recent for item in turn] + new_input
+
+    def summarize(self, turns: List[List[Item]]) -> List[Item]:
+        if not turns or self.summary_chars <= 0:
+            return []
+        asked: List[str] = []
+        length = 0
+        for turn in reversed(turns):
+            text = user_text(turn[0])
+            if not text:
+                continue
+            if length + len(text) > self.summary_chars:
+                break
+            asked.insert(0, text)
+            length += len(text)
+        if not asked:
+            return []
+        note = "Earlier in this conversation the user asked: " + " / ".join(asked)
+        return [{"role": "system", "content": note}]
+
+
+class MemoryStore:
+    """SQLite file shared by all sessions, written by a background thread."""
+
+    def __init__(self, path: str, key: Optional[str] = None, flush_interval: float = 0.5):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.fernet = None
+        if key:
+            # Imported only when the history is stored encrypted
+            from cryptography.fernet import Fernet
+            self.fernet = Fernet(base64.urlsafe_b64encode(hashlib.sha256(key.encode()).digest()))
+        connection = self.connect()
+        connection.executescript(SCHEMA)
+        connection.close()
+        self.queue: queue.Queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="memory-writer")
+        self.thread.start()
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        # Readers are not blocked while the writer thread commits
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def load(self, session_id: str, limit: int, since: float = 0.0) -> List[Tuple[float, Item]]:
+        """The latest `limit` items of a session created after `since`, oldest first, with their
+        creation time. Blocking."""
+        connection = self.connect()
+        try:
+            rows = connection.execute(
+                "SELECT created_at, data FROM session_items WHERE session_id = ? AND created_at > ? "
+                "ORDER BY id DESC LIMIT ?",
+                (session_id, since, limit)).fetchall()
+        finally:
+            connection.close()
+        items = []
+        for created_at, data in reversed(rows):
+            try:
+                items.append((created_at, json.loads(self.fernet.decrypt(data.encode()) if self.fernet else data)))
+            except Exception as e:
+                print(f"Skipping an unreadable item of session '{session_id}': {e!r}")
+        return items
+
+    def append(self, session_id: str, items: List[Item], created_at: float) -> None:
+        self.queue.put(("append", session_id, [json.dumps(item) for item in items], created_at))
+
+    def pop(self, session_id: str) -> None:
+        self.queue.put(("pop", session_id, None, None))
+
+    def clear(self, session_id: str) -> None:
+        self.queue.put(("clear", session_id, None, None))
+
+    def close(self) -> None:
+        """Write what is still queued and stop the writer."""
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self) -> None:
+        connection = self.connect()
+        closing = False
+        while not closing:
+            batch = [self.queue.get()]
+            # Collect whatever else arrives meanwhile and commit it in one transaction
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not None and (timeout := deadline - time.monotonic()) > 0:
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            closing = batch[-1] is None
+            try:
+                with connection:
+                    for operation in batch:
+                        if operation is not None:
+                            self._execute(connection, *operation)
+            except sqlite3.Error as e:
+                print(f"Writing {len(batch)} memory operations failed: {e!r}")
+        connection.close()
+
+    def _execute(self, connection: sqlite3.Connection, operation: str, session_id: str, data, created_at) -> None:
+        if operation == "append":
+            if self.fernet:
+                data = [self.fernet.encrypt(d.encode()).decode() for d in data]
+            connection.executemany(
+                "INSERT INTO session_items (session_id, created_at, data) VALUES (?, ?, ?)",
+                [(session_id, created_at, d) for d in data])
+        elif operation == "pop":
+            connection.execute(
+                "DELETE FROM session_items WHERE id = (SELECT MAX(id) FROM session_items WHERE session_id = ?)",
+                (session_id,))
+        elif operation == "clear":
+            connection.execute("DELETE FROM session_items WHERE session_id = ?", (session_id,))
+
+
+class BufferedSession(SessionABC):
+    """Agents SDK session served from memory and persisted by a `MemoryStore`."""
+
+    def __init__(self, session_id: str, store: MemoryStore, max_items: int = 200, ttl: float = 0.0):
+        """`max_items`: items kept in memory; older ones are only in the database.
+        `ttl`: seconds after which an item is left out of the history, 0 keeps items forever."""
+        self.session_id = session_id
+        self.store = store
+        self.max_items = max_items
+        self.ttl = ttl
+        # (creation time, item), oldest first
+        self.items: Optional[List[Tuple[float, Item]]] = None
+        self.lock = asyncio.Lock()
+
+    def _since(self) -> float:
+        return time.time() - self.ttl if self.ttl > 0 else 0.0
+
+    async def _loaded(self) -> List[Tuple[float, Item]]:
+        if self.items is None:
+            async with self.lock:
+                if self.items is None:
+                    self.items = await asyncio.to_thread(self.store.load, self.session_id, self.max_items,
+                                                         self._since())
+        if self.ttl > 0:
+            since = self._since()
+            expired = next((i for i, (created_at, _) in enumerate(self.items) if created_at > since),
+                           len(self.items))
+            del self.items[:expired]
+        return self.items
+
+    async def get_items(self, limit: int | None = None) -> List[Item]:
+        items = [item for _, item in await self._loaded()]
+        if limit is None:
+            return items
+        return items[max(len(items) - limit, 0):]
+
+    async def add_items(self, items: List[Item]) -> None:
+        # The agent run also hands back the note of `HistoryPolicy`, which is made up
+        # anew for every prompt; the assistant has no other system messages
+        items = [item for item in items if item.get("role") != "system"]
+        if not items:
+            return
+        history = await self._loaded()
+        created_at = time.time()
+        history.extend((created_at, item) for item in items)
+        del history[:-self.max_items]
+        self.store.append(self.session_id, items, created_at)
+
+    async def pop_item(self) -> Item | None:
+        history = await self._loaded()
+        if not history:
+            return None
+        self.store.pop(self.session_id)
+        return history.pop()[1]
+
+    async def clear_session(self) -> None:
+        await self._loaded()
+        self.items = []
+        self.store.clear(self.session_id)
@@ -0,0 +1,100 @@
+"""
+Speculative agent runs on partial transcripts.
+
+Speech-to-text publishes partial transcripts while the user is still speaking. Once a
+partial has not changed for a moment, the assistant starts the agent run with it,
+holding the reply back. When the final instruction arrives and says the same, the run
+is committed: the sentences produced so far are forwarded and the rest follows live,
+so the LLM and tool calls have a head start of up to the end-of-speech detection and
+transcription time. When it says something else, the speculative run is cancelled
+and nothing of it is published or remembered.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+WORD_RE = re.compile(r"[\w']+")
+
+
+def normalize(text: str) -> str:
+    """Compare transcripts by their words only."""
+    return " ".join(WORD_RE.findall(text.lower()))
+
+
+class ReplyOutput:
+    """Sends the sentences of one run to text-to-speech, or holds them back until released."""
+
+    def __init__(self, forward: Callable[[str, bool], Awaitable[None]], held: bool = False):
+        self.forward = forward
+        self.held = held
+        self.buffer: List[str] = []
+        self.sentences = 0
+
+    async def send(self, sentence: str) -> None:
+        if self.held:
+            self.buffer.append(sentence)
+            return
+        await self._forward(sentence)
+
+    async def release(self) -> None:
+        # Sentences sent while the buffer is forwarded are appended to it and go out in order
+        while self.buffer:
+            await self._forward(self.buffer.pop(0))
+        self.held = False
+
+    async def _forward(self, sentence: str) -> None:
+        await self.forward(sentence, not self.sentences)
+        self.sentences += 1
+
+
+class Speculation:
+    def __init__(self, text: str, interaction: Optional[str], output: ReplyOutput):
+        self.text = text
+        # The final instruction, once committed
+        self.instruction = text
+        self.key = normalize(text)
+        self.interaction = interaction
+        self.output = output
+        self.started = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self.committed = False
+        self.failed = False
+        # Whether the first token arrived before the commit
+        self.first_token = False
+        # Set on commit; the run stores its result in the session only then
+        self.decided = asyncio.Event()
+
+    def matches(self, text: str, interaction: Optional[str]) -> bool:
+        if self.failed or self.key != normalize(text):
+            return False
+        return interaction is None or self.interaction is None or interaction == self.interaction
+
+
+@dataclass
+class SpeculationStats:
+    started: int = 0
+    committed: int = 0
+    aborted: Dict[str, int] = field(default_factory=dict)
+    # Summed time from the start of committed speculative runs to their final instruction
+    head_start_s: float = 0.0
+
+    def commit(self, speculation: Speculation) -> float:
+        head_start = time.monotonic() - speculation.started
+        self.committed += 1
+        self.head_start_s += head_start
+        return head_start
+
+    def abort(self, reason: str) -> None:
+        self.aborted[reason] = self.aborted.get(reason, 0) + 1
+
+    def __str__(self) -> str:
+        aborted = sum(self.aborted.values())
+        reasons = ", ".join(f"{count} {reason}" for reason, count in sorted(self.aborted.items()))
+        mean_ms = self.head_start_s / self.committed * 1000 if self.committed else 0.0
+        return (f"{self.started} started, {self.committed} committed, {aborted} aborted"
+                f"{f' ({reasons})' if reasons else ''}, mean head start {mean_ms:.0f} ms")
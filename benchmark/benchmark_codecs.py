@@ -0,0 +1,106 @@
+"""
+Micro-benchmark of the audio codecs of audio_frame.py.
+
+Encodes and decodes a recording, or a synthetic voice-like signal, chunk by chunk
+like the microphone publishes it and prints, per codec, the bytes on the wire, the
+encoding and decoding time per chunk, how many times faster than real time a consumer
+decodes, and the signal-to-noise ratio after the round trip. Decoding is measured
+into a new array per chunk and into the reused buffer of a `FrameDecoder`.
+
+    uv run benchmark_codecs.py
+    uv run --group opus benchmark_codecs.py recordings/news.wav
+"""
+
+import argparse
+import time
+import wave
+
+import numpy as np
+
+from audio_frame import CODECS, FrameDecoder, FrameEncoder
+
+RATE = 16000
+CHUNK = 1280
+
+
+def synthetic_voice(seconds: float, seed: int = 0) -> np.ndarray:
+    """Harmonics of a gliding pitch, syllable-like bursts and a little noise."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * RATE)) / RATE
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / RATE
+    voice = sum(np.sin(k * phase) / k for k in range(1, 12))
+    envelope = np.clip(np.sin(2 * np.pi * 3 * t), 0, None) ** 2
+    signal = 6000 * envelope * voice + 100 * rng.standard_normal(len(t))
+    return np.clip(signal, -32768, 32767).astype("<i2")
+
+
+def read_wav(path: str) -> np.ndarray:
+    with wave.open(path) as f:
+        if f.getframerate() != RATE or f.getnchannels() != 1 or f.getsampwidth() != 2:
+            raise SystemExit(f"{path} is not a 16 kHz mono 16 bit WAV file.")
+        return np.frombuffer(f.readframes(f.getnframes()), dtype="<i2")
+
+
+def snr_db(original: np.ndarray, decoded: np.ndarray) -> float:
+    noise = np.sum((original.astype(np.float64) - decoded) ** 2)
+    return 10 * np.log10(np.sum(original.astype(np.float64) ** 2) / noise) if noise else float("inf")
+
+
+def run(codec: str, chunks: list) -> dict:
+    encoder = FrameEncoder(codec, RATE)
+    start = time.perf_counter()
+    payloads = [encoder.encode(chunk, sequence) for sequence, chunk in enumerate(chunks)]
+    encode_s = time.perf_counter() - start
+
+    # Opus keeps state between chunks, so every pass needs a decoder of its own
+    allocating = FrameDecoder()
+    start = time.perf_counter()
+    decoded = [allocating.decode(payload).samples for payload in payloads]
+    allocate_s = time.perf_counter() - start
+
+    reusing = FrameDecoder(reuse_buffer=True)
+    reusing.configure(encoder.meta(CHUNK))
+    start = time.perf_counter()
+    for payload in payloads:
+        reusing.decode(payload)
+    reuse_s = time.perf_counter() - start
+
+    return {
+        "bytes": sum(len(p) for p in payloads) / len(payloads),
+        "encode_us": encode_s / len(chunks) * 1e6,
+        "allocate_us": allocate_s / len(chunks) * 1e6,
+        "reuse_us": reuse_s / len(chunks) * 1e6,
+        "snr_db": snr_db(np.concatenate(chunks), np.concatenate(decoded)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("wav", nargs="?", help="16 kHz mono 16 bit WAV file; default is 30 s of a synthetic voice")
+    parser.add_argument("--codecs", nargs="+", default=list(CODECS), choices=list(CODECS))
+    parser.add_argument("--repeat", type=int, default=5, help="runs per codec, the fastest is reported")
+    args = parser.parse_args()
+
+    samples = read_wav(args.wav) if args.wav else synthetic_voice(30)
+    samples = samples[:len(samples) // CHUNK * CHUNK]
+    chunks = [samples[i:i + CHUNK] for i in range(0, len(samples), CHUNK)]
+    chunk_us = CHUNK / RATE * 1e6
+    print(f"{len(chunks)} chunks of {CHUNK} samples ({chunk_us / 1000:.0f} ms)\n")
+
+    print(f"{'codec':>6} {'bytes':>7} {'KB/s':>6} {'enc us':>8} {'dec us':>8} {'reuse us':>9} "
+          f"{'x realtime':>11} {'SNR dB':>7}")
+    for codec in args.codecs:
+        try:
+            results = [run(codec, chunks) for _ in range(args.repeat)]
+        except ImportError as e:
+            print(f"{codec:>6} skipped: {e}; install it with `uv run --group opus` and libopus")
+            continue
+        best = {key: min(r[key] for r in results) for key in results[0]}
+        print(f"{codec:>6} {best['bytes']:>7.0f} {best['bytes'] * RATE / CHUNK / 1000:>6.1f} "
+              f"{best['encode_us']:>8.1f} {best['allocate_us']:>8.1f} {best['reuse_us']:>9.1f} "
+              f"{chunk_us / best['reuse_us']:>11.0f} {best['snr_db']:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Minimal in-process MQTT 3.1.1 broker for benchmarks and offline runs.
+
+Speaks just enough of the protocol for paho-mqtt and aiomqtt clients: CONNECT,
+PUBLISH with QoS 0, 1 and 2, SUBSCRIBE and UNSUBSCRIBE with `+` and `#` wildcards,
+retained messages, last will, PINGREQ and DISCONNECT. Messages are delivered to
+subscribers with QoS 0, which is what the voice pipeline uses throughout. There is no
+authentication, persistence or session state.
+
+    uv run fake_broker.py --port 1883
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import struct
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    # Wildcards at the first level do not match system topics like "$SYS/..."
+    if topic.startswith("$") and filter_levels[0] in ("+", "#"):
+        return False
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels):
+            return False
+        if level != "+" and level != topic_levels[i]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def encode_length(length: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+
+def encode_string(value: str) -> bytes:
+    data = value.encode()
+    return struct.pack("!H", len(data)) + data
+
+
+def packet(packet_type: int, flags: int, body: bytes) -> bytes:
+    return bytes([packet_type << 4 | flags]) + encode_length(len(body)) + body
+
+
+def publish_packet(topic: str, payload: bytes, retain: bool = False) -> bytes:
+    return packet(PUBLISH, 1 if retain else 0, encode_string(topic) + payload)
+
+
+class Reader:
+    """Decodes the fields of a packet body."""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.pos = 0
+
+    def uint16(self) -> int:
+        if self.pos + 2 > len(self.body):
+            raise ProtocolError("Truncated packet.")
+        value, = struct.unpack_from("!H", self.body, self.pos)
+        self.pos += 2
+        return value
+
+    def byte(self) -> int:
+        if self.pos >= len(self.body):
+            raise ProtocolError("Truncated packet.")
+        self.pos += 1
+        return self.body[self.pos - 1]
+
+    def bytes(self) -> bytes:
+        length = self.uint16()
+        value = self.body[self.pos:self.pos + length]
+        self.pos += length
+        return value
+
+    def string(self) -> str:
+        return self.bytes().decode()
+
+    def rest(self) -> bytes:
+        return self.body[self.pos:]
+
+    def done(self) -> bool:
+        return self.pos >= len(self.body)
+
+
+@dataclass
+class Connection:
+    client_id: str
+    writer: asyncio.StreamWriter
+    subscriptions: Dict[str, int] = field(default_factory=dict)
+    will: Optional[Tuple[str, bytes, bool]] = None
+
+
+class FakeBroker:
+    def __init__(self, host: str = "127.0.0.1", port: int = 1883):
+        self.host = host
+        self.port = port
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.connections: List[Connection] = []
+        self.handlers: set[asyncio.Task] = set()
+        self.retained: Dict[str, bytes] = {}
+        self.messages: Counter[str] = Counter()
+        self.bytes: Counter[str] = Counter()
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        # Port 0 picks a free port
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            for connection in list(self.connections):
+                connection.writer.close()
+            # Closed connections end their handlers with an incomplete read
+            await asyncio.gather(*self.handlers, return_exceptions=True)
+            await self.server.wait_closed()
+
+    def stats(self) -> dict:
+        return {"connections": len(self.connections), "messages": dict(self.messages), "bytes": dict(self.bytes)}
+
+    def subscribers(self, topic: str) -> int:
+        """Connected clients that would receive a message on `topic`."""
+        return sum(any(topic_matches(f, topic) for f in c.subscriptions) for c in self.connections)
+
+    def publish(self, topic: str, payload: bytes, retain: bool = False) -> None:
+        self.messages[topic] += 1
+        self.bytes[topic] += len(payload)
+        if retain:
+            # An empty retained message clears the topic
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+        data = publish_packet(topic, payload)
+        for connection in self.connections:
+            if any(topic_matches(f, topic) for f in connection.subscriptions):
+                connection.writer.write(data)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        connection = None
+        clean = False
+        self.handlers.add(asyncio.current_task())
+        try:
+            packet_type, _, body = await self._read_packet(reader)
+            if packet_type != CONNECT:
+                raise ProtocolError("First packet is not CONNECT.")
+            connection = self._connect(Reader(body), writer)
+            writer.write(packet(CONNACK, 0, b"\x00\x00"))
+            self.connections.append(connection)
+            while True:
+                packet_type, flags, body = await self._read_packet(reader)
+                if packet_type == DISCONNECT:
+                    clean = True
+                    break
+                self._handle(connection, packet_type, flags, Reader(body))
+                # Slow subscribers hold up the publisher, like a full TCP buffer would
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ProtocolError):
+            pass
+        finally:
+            if connection is not None:
+                self.connections.remove(connection)
+                if not clean and connection.will is not None:
+                    self.publish(*connection.will)
+            writer.close()
+            self.handlers.discard(asyncio.current_task())
+
+    async def _read_packet(self, reader: asyncio.StreamReader) -> Tuple[int, int, bytes]:
+        first = (await reader.readexactly(1))[0]
+        length, multiplier = 0, 1
+        for _ in range(4):
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+        else:
+            raise ProtocolError("Malformed remaining length.")
+        body = await reader.readexactly(length) if length else b""
+        return first >> 4, first & 0x0F, body
+
+    def _connect(self, reader: Reader, writer: asyncio.StreamWriter) -> Connection:
+        protocol, level = reader.string(), reader.byte()
+        if protocol not in ("MQTT", "MQIsdp") or level not in (3, 4):
+            raise ProtocolError(f"Unsupported protocol {protocol} level {level}.")
+        flags = reader.byte()
+        reader.uint16()  # keep alive; the broker never times clients out
+        connection = Connection(reader.string(), writer)
+        if flags & 0x04:
+            will_topic, will_payload = reader.string(), reader.bytes()
+            connection.will = (will_topic, will_payload, bool(flags & 0x20))
+        return connection
+
+    def _handle(self, connection: Connection, packet_type: int, flags: int, reader: Reader) -> None:
+        writer = connection.writer
+        if packet_type == PUBLISH:
+            qos, retain = (flags >> 1) & 0x03, bool(flags & 0x01)
+            topic = reader.string()
+            packet_id = reader.uint16() if qos else None
+            self.publish(topic, reader.rest(), retain)
+            if qos == 1:
+                writer.write(packet(PUBACK, 0, struct.pack("!H", packet_id)))
+            elif qos == 2:
+                writer.write(packet(PUBREC, 0, struct.pack("!H", packet_id)))
+        elif packet_type == PUBREL:
+            writer.write(packet(PUBCOMP, 0, struct.pack("!H", reader.uint16())))
+        elif packet_type == SUBSCRIBE:
+            packet_id = reader.uint16()
+            filters = []
+            while not reader.done():
+                topic_filter = reader.string()
+                reader.byte()
+                connection.subscriptions[topic_filter] = 0
+                filters.append(topic_filter)
+            # Everything is delivered with QoS 0
+            writer.write(packet(SUBACK, 0, struct.pack("!H", packet_id) + bytes(len(filters))))
+            for topic, payload in self.retained.items():
+                if any(topic_matches(f, topic) for f in filters):
+                    writer.write(publish_packet(topic, payload, retain=True))
+        elif packet_type == UNSUBSCRIBE:
+            packet_id = reader.uint16()
+            while not reader.done():
+                connection.subscriptions.pop(reader.string(), None)
+            writer.write(packet(UNSUBACK, 0, struct.pack("!H", packet_id)))
+        elif packet_type == PINGREQ:
+            writer.write(packet(PINGRESP, 0, b""))
+        elif packet_type in (PUBACK, PUBREC, PUBCOMP):
+            # Acknowledgements of QoS 0 deliveries do not occur
+            pass
+        else:
+            raise ProtocolError(f"Unexpected packet type {packet_type}.")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Run a minimal MQTT 3.1.1 broker.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+
+    broker = FakeBroker(args.host, args.port)
+    await broker.start()
+    print(f"Fake MQTT broker listening on {args.host}:{broker.port}.")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
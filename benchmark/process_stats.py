@@ -0,0 +1,138 @@
+"""
+CPU time and resident memory of the pipeline services, read from /proc.
+
+A service is found by its script name among the arguments of a process, so it is
+measured the same whether the benchmark launched it, it runs under `uv run`, or in a
+container sharing the host's process table. Child processes, like the synthesis
+workers of text-to-speech, are counted with their service. Linux only.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def read_processes() -> Dict[int, tuple[int, List[str]]]:
+    """pid -> (parent pid, arguments) of all processes."""
+    processes = {}
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+            argv = (entry / "cmdline").read_bytes().decode(errors="replace").split("\0")
+        except OSError:
+            continue
+        # The command name in parentheses may contain spaces
+        fields = stat[stat.rindex(")") + 2:].split()
+        processes[int(entry.name)] = (int(fields[1]), argv)
+    return processes
+
+
+def process_tree(roots: Iterable[int], processes: Dict[int, tuple[int, List[str]]]) -> Set[int]:
+    tree = set(roots)
+    added = True
+    while added:
+        added = False
+        for pid, (parent, _) in processes.items():
+            if parent in tree and pid not in tree:
+                tree.add(pid)
+                added = True
+    return tree
+
+
+def cpu_seconds(pid: int) -> Optional[float]:
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+    except OSError:
+        return None
+    fields = stat[stat.rindex(")") + 2:].split()
+    # utime and stime, fields 14 and 15 of /proc/<pid>/stat
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def rss_bytes(pid: int) -> int:
+    try:
+        return int(Path(f"/proc/{pid}/statm").read_text().split()[1]) * PAGE_SIZE
+    except OSError:
+        return 0
+
+
+@dataclass
+class ServiceUsage:
+    script: str
+    # Latest CPU time of every process seen, so exited workers still count
+    cpu: Dict[int, float] = field(default_factory=dict)
+    baseline: Dict[int, float] = field(default_factory=dict)
+    rss_samples: List[int] = field(default_factory=list)
+
+    def cpu_used(self) -> float:
+        return sum(self.cpu.values()) - sum(self.baseline.get(pid, 0.0) for pid in self.cpu)
+
+
+class ProcessSampler:
+    """Samples CPU time and RSS of every service on a background thread."""
+
+    def __init__(self, scripts: Dict[str, str], interval: float = 0.5):
+        """`scripts`: service name -> file name of the script the service runs."""
+        self.services = {name: ServiceUsage(script) for name, script in scripts.items()}
+        self.interval = interval
+        self.own_pid = os.getpid()
+        self.started = time.monotonic()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="process-sampler")
+
+    def start(self) -> None:
+        self.sample()
+        for usage in self.services.values():
+            usage.baseline = dict(usage.cpu)
+            usage.rss_samples.clear()
+        self.started = time.monotonic()
+        self.thread.start()
+
+    def stop(self) -> Dict[str, dict]:
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+        return self.results()
+
+    def _run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self) -> None:
+        processes = read_processes()
+        for usage in self.services.values():
+            roots = [pid for pid, (_, argv) in processes.items()
+                     if pid != self.own_pid and any(os.path.basename(arg) == usage.script for arg in argv)]
+            rss = 0
+            for pid in process_tree(roots, processes):
+                cpu = cpu_seconds(pid)
+                if cpu is not None:
+                    usage.cpu[pid] = cpu
+                    rss += rss_bytes(pid)
+            usage.rss_samples.append(rss)
+
+    def results(self) -> Dict[str, dict]:
+        elapsed = time.monotonic() - self.started
+        results = {}
+        for name, usage in self.services.items():
+            cpu = usage.cpu_used()
+            samples = [s for s in usage.rss_samples if s] or [0]
+            results[name] = {
+                "found": bool(usage.cpu),
+                "processes": len(usage.cpu),
+                "cpu_s": round(cpu, 3),
+                "cpu_percent": round(100 * cpu / elapsed, 1) if elapsed else 0.0,
+                "rss_peak_mb": round(max(samples) / 2**20, 1),
+                "rss_mean_mb": round(sum(samples) / len(samples) / 2**20, 1),
+            }
+        return results
@@ -0,0 +1,484 @@
+"""
+Offline replay benchmark of the voice pipeline.
+
+Replays WAV recordings of scripted wake words and instructions onto the audio topic,
+in real time or faster, and measures how the services handle them: the latency of
+every stage from the trace events (see tracing.py), CPU time and memory of every
+service, and the audio each one gets through per CPU second. The OpenAI and
+Tagesschau APIs are replaced by local stubs, and the MQTT broker by an in-process
+fake unless --broker external is given. Results are written as JSON, and compared
+against an earlier run with --baseline.
+
+    uv run replay.py scenario.json --launch all --output results/run.json
+    uv run replay.py scenario.json --launch all --baseline results/main.json
+
+A scenario lists the recordings, 16 kHz mono 16 bit WAV files, relative to the
+scenario file. `wake_end_s` and `speech_end_s` mark where the wake word and the
+instruction end in the recording; with them the harness also measures wake word and
+end of speech detection, and the response time as the user perceives it:
+
+    {
+      "gap_s": 6.0,
+      "items": [
+        {"wav": "recordings/news.wav", "wake_end_s": 1.2, "speech_end_s": 3.9,
+         "transcript": "what is the latest news"}
+      ]
+    }
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import signal
+import subprocess
+import sys
+import time
+import wave
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from aiomqtt import Client
+
+from audio_frame import CODECS, FrameEncoder
+from fake_broker import FakeBroker
+from process_stats import ProcessSampler
+from stub_backends import StubSettings, start_stub_server
+from tracing import unwrap_text
+
+REPO = Path(__file__).resolve().parent.parent
+RATE = 16000
+CHUNK = 1280
+
+topic_audio = "audio/stream"
+topic_audio_meta = "audio/meta"
+topic_trace = "trace/#"
+topic_instruction = "assistant/instruction"
+topic_reply = "assistant/reply"
+
+# Service name -> (directory, arguments of `uv run`); the first argument is the script
+SERVICES = {
+    "news-mcp": ("mcp/news-mcp", ["news_mcp.py"]),
+    "wake-word-detection": ("wake-word-detection", [
+        "detect_wake_word_from_mqtt.py", "--model_path", "models/hey_rhasspy_v0.1.onnx",
+        "--inference_framework", "onnx"]),
+    "speech-to-text": ("speech-to-text", ["speech-to-text.py", "--model", "en-us"]),
+    "assistant": ("assistant", ["assistant.py"]),
+    "text-to-speech": ("text-to-speech", ["text-to-speech.py"]),
+}
+# Services publishing a retained readiness message, see service_status.py
+READY_TOPIC = "service/{name}/ready"
+READY_SERVICES = ["wake-word-detection", "speech-to-text", "assistant", "text-to-speech"]
+
+# (stage, start, end); "wake_end" and "speech_end" are the scripted marks of the scenario
+STAGES = [
+    ("wake_word", "wake_end", "wake_detected"),
+    ("wake_to_stt", "wake_detected", "stt_started"),
+    ("endpointing", "speech_end", "endpoint"),
+    ("transcript", "endpoint", "instruction_published"),
+    ("instruction_delivery", "instruction_published", "instruction_received"),
+    ("agent_queue", "instruction_received", "run_started"),
+    ("first_token", "run_started", "first_token"),
+    ("first_sentence", "first_token", "first_sentence"),
+    ("reply_delivery", "first_sentence", "reply_received"),
+    ("synthesis", "reply_received", "first_audio"),
+    # From the end of the instruction to the first audio of the reply, the delay the user notices
+    ("response", "speech_end", "first_audio"),
+    ("total", "wake_end", "first_audio"),
+]
+FINAL_EVENTS = {"reply_done", "first_audio"}
+# Smaller changes are noise, whatever the tolerance
+MIN_LATENCY_CHANGE_MS = 20.0
+MIN_CPU_CHANGE_S = 0.5
+
+
+@dataclass
+class Item:
+    wav: str
+    samples: np.ndarray
+    wake_end_s: Optional[float] = None
+    speech_end_s: Optional[float] = None
+    transcript: Optional[str] = None
+
+
+def read_wav(path: Path) -> np.ndarray:
+    with wave.open(str(path), "rb") as f:
+        if f.getframerate() != RATE or f.getnchannels() != 1 or f.getsampwidth() != 2:
+            raise ValueError(f"{path} must be {RATE} Hz mono 16 bit, is {f.getframerate()} Hz "
+                             f"{f.getnchannels()} channel(s) {8 * f.getsampwidth()} bit.")
+        return np.frombuffer(f.readframes(f.getnframes()), dtype="<i2")
+
+
+def load_scenario(path: Path) -> tuple[List[Item], float]:
+    scenario = json.loads(path.read_text(encoding="utf-8"))
+    items = []
+    for entry in scenario["items"]:
+        samples = read_wav(path.parent / entry["wav"])
+        items.append(Item(entry["wav"], samples, entry.get("wake_end_s"), entry.get("speech_end_s"),
+                          entry.get("transcript")))
+    return items, float(scenario.get("gap_s", 6.0))
+
+
+class Observer:
+    """Collects the trace events and texts the pipeline publishes during the replay."""
+
+    def __init__(self, items: List[Item]):
+        self.items = items
+        self.current_item: Optional[int] = None
+        # Scripted marks per item, monotonic ns of when the chunk containing them was published
+        self.marks: List[Dict[str, int]] = [{} for _ in items]
+        self.interactions: List[List[str]] = [[] for _ in items]
+        self.events: Dict[str, Dict[str, dict]] = {}
+        self.instructions: Dict[str, str] = {}
+        self.replies: Dict[str, List[str]] = {}
+        self.synthesized_audio_s = 0.0
+
+    def handle(self, topic: str, payload: bytes) -> None:
+        if topic.startswith("trace/"):
+            event = json.loads(payload)
+            interaction = event.get("interaction")
+            if interaction is None:
+                return
+            if interaction not in self.events:
+                self.events[interaction] = {}
+                # Wake words are attributed to the recording being replayed when they are detected
+                if self.current_item is not None:
+                    self.interactions[self.current_item].append(interaction)
+            self.events[interaction].setdefault(event["event"], event)
+            if event["event"] == "sentence_synthesized":
+                self.synthesized_audio_s += event.get("audio_s", 0.0)
+            return
+        text, interaction = unwrap_text(payload)
+        if interaction is None:
+            return
+        if topic.endswith("/instruction"):
+            self.instructions[interaction] = text
+        elif topic.endswith("/reply"):
+            self.replies.setdefault(interaction, []).append(text)
+
+    def finished(self) -> bool:
+        return all(interactions and FINAL_EVENTS <= self.events[interactions[0]].keys()
+                   for interactions in self.interactions)
+
+    def item_results(self) -> List[dict]:
+        results = []
+        for index, item in enumerate(self.items):
+            interactions = self.interactions[index]
+            interaction = interactions[0] if interactions else None
+            times = {name: ns for name, ns in self.marks[index].items()}
+            if interaction is not None:
+                times.update({name: event["mono_ns"] for name, event in self.events[interaction].items()})
+            latencies = {stage: round((times[end] - times[start]) / 1e6, 1)
+                         for stage, start, end in STAGES if start in times and end in times}
+            results.append({
+                "wav": item.wav,
+                "interaction": interaction,
+                # More than one means the wake word was reported again, e.g. for the reply
+                "wake_words": len(interactions),
+                "expected_transcript": item.transcript,
+                "transcript": self.instructions.get(interaction),
+                "reply": " ".join(self.replies.get(interaction, [])) or None,
+                "latency_ms": latencies,
+            })
+        return results
+
+
+def summarize(values: List[float]) -> dict:
+    ordered = sorted(values)
+    n = len(ordered)
+    return {
+        "count": n,
+        "mean": round(sum(ordered) / n, 1),
+        "p50": ordered[min(n - 1, int(0.5 * n))],
+        "p95": ordered[min(n - 1, int(0.95 * n))],
+        "max": ordered[-1],
+    }
+
+
+async def replay(client: Client, items: List[Item], gap_s: float, speed: float, observer: Observer,
+                 codec: str = "pcm") -> dict:
+    """Publish the recordings chunk by chunk, paced like a microphone `speed` times faster than real time."""
+    period = CHUNK / RATE / speed
+    silence = np.zeros(int(gap_s * RATE), dtype="<i2")
+    encoder = FrameEncoder(codec, RATE)
+    await client.publish(topic_audio_meta, encoder.meta(CHUNK), qos=1, retain=True)
+    sequence = late = payload_bytes = 0
+    started = next_time = time.monotonic()
+    for index, item in enumerate(items):
+        observer.current_item = index
+        samples = np.concatenate([item.samples, silence])
+        marks = {"wake_end": item.wake_end_s, "speech_end": item.speech_end_s}
+        for offset in range(0, len(samples), CHUNK):
+            chunk = samples[offset:offset + CHUNK]
+            if len(chunk) < CHUNK:
+                chunk = np.pad(chunk, (0, CHUNK - len(chunk)))
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -period:
+                late += 1
+            # Stamped like the microphone does: capture started one chunk before it is sent
+            capture_ns = time.time_ns() - int(period * 1e9)
+            payload = encoder.encode(chunk, sequence, capture_ns)
+            payload_bytes += len(payload)
+            await client.publish(topic_audio, payload)
+            chunk_end_s = (offset + CHUNK) / RATE
+            for name, at in marks.items():
+                if at is not None and name not in observer.marks[index] and chunk_end_s >= at:
+                    observer.marks[index][name] = time.monotonic_ns()
+            sequence += 1
+            next_time += period
+    wall_s = time.monotonic() - started
+    audio_s = sequence * CHUNK / RATE
+    return {"chunks": sequence, "audio_s": round(audio_s, 2), "wall_s": round(wall_s, 2),
+            "speed": round(audio_s / wall_s, 2), "late_chunks": late,
+            "payload_kb_per_audio_s": round(payload_bytes / 1000 / audio_s, 1) if audio_s else None}
+
+
+class Services:
+    """Launches the pipeline services with the stubs configured, and stops them again."""
+
+    def __init__(self, names: List[str], stub_url: str, log_dir: Path):
+        self.names = names
+        self.stub_url = stub_url
+        self.log_dir = log_dir
+        self.processes: Dict[str, subprocess.Popen] = {}
+
+    def start(self) -> None:
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        memory = self.log_dir.resolve() / "assistant-memory.db"
+        for path in (memory, memory.with_name(memory.name + "-wal"), memory.with_name(memory.name + "-shm")):
+            path.unlink(missing_ok=True)
+        env = {
+            **os.environ,
+            "OPENAI_BASE_URL": f"{self.stub_url}/v1",
+            "OPENAI_API_KEY": os.environ.get("BENCHMARK_OPENAI_API_KEY", "stub"),
+            "OPENAI_AGENTS_DISABLE_TRACING": "1",
+            "TAGESSCHAU_API_URL": f"{self.stub_url}/api2u/news",
+            "NEWS_INDEX_INTERVAL": "0",
+            "TTS_AUDIO_OUTPUT": "null",
+            # Every run starts with an empty conversation memory
+            "ASSISTANT_MEMORY_DB": str(memory),
+            "VOICE_TRACE": "1",
+            "PYTHONUNBUFFERED": "1",
+        }
+        for name in self.names:
+            directory, arguments = SERVICES[name]
+            log = open(self.log_dir / f"{name}.log", "w")
+            # A session of its own, so the whole process group can be stopped
+            self.processes[name] = subprocess.Popen(["uv", "run", *arguments], cwd=REPO / directory, env=env,
+                                                    stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+            print(f"Started {name}, logging to {self.log_dir / f'{name}.log'}.")
+
+    def exited(self) -> List[str]:
+        return [name for name, p in self.processes.items() if p.poll() is not None]
+
+    def stop(self) -> None:
+        for process in self.processes.values():
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(process.pid, signal.SIGTERM)
+        for name, process in self.processes.items():
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                print(f"{name} did not stop in time, killing it.")
+                os.killpg(process.pid, signal.SIGKILL)
+
+
+async def wait_until_ready(client: Client, services: Optional[Services], names: List[str],
+                           timeout: float) -> Dict[str, dict]:
+    """Wait for the readiness message of every service; returns their startup timings."""
+    waiting = {READY_TOPIC.format(name=name): name for name in names if name in READY_SERVICES}
+    startup: Dict[str, dict] = {}
+    if not waiting:
+        return startup
+    await client.subscribe(READY_TOPIC.format(name="+"))
+    deadline = time.monotonic() + timeout
+    messages = aiter(client.messages)
+    while waiting:
+        if services is not None and services.exited():
+            raise RuntimeError(f"{', '.join(services.exited())} exited before the replay started, see the logs.")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise RuntimeError(f"{', '.join(waiting.values())} did not get ready within {timeout:.0f}s.")
+        try:
+            message = await asyncio.wait_for(anext(messages), min(remaining, 0.5))
+        except asyncio.TimeoutError:
+            continue
+        topic = str(message.topic)
+        try:
+            status = json.loads(message.payload)
+        except ValueError:
+            continue
+        # A retained message of an earlier run, left by the last will
+        if topic not in waiting or not status.get("ready"):
+            continue
+        startup[waiting.pop(topic)] = {"startup_ms": status.get("startup_ms"), "phases_ms": status.get("phases_ms", {})}
+    await client.unsubscribe(READY_TOPIC.format(name="+"))
+    print("All services ready: " + ", ".join(f"{name} {info['startup_ms']} ms" for name, info in startup.items()))
+    return startup
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Describe every latency, CPU time and detection count that got worse than the baseline."""
+    regressions = []
+    for stage, stats in results["latency_ms"].items():
+        old = baseline.get("latency_ms", {}).get(stage)
+        if not old:
+            continue
+        for key in ("p50", "p95"):
+            change = stats[key] - old[key]
+            if change > MIN_LATENCY_CHANGE_MS and stats[key] > old[key] * (1 + tolerance):
+                regressions.append(f"{stage} {key} latency {old[key]:.0f} ms -> {stats[key]:.0f} ms")
+    for service, usage in results["processes"].items():
+        old = baseline.get("processes", {}).get(service)
+        if not old or not usage["found"] or not old["found"]:
+            continue
+        if usage["cpu_s"] - old["cpu_s"] > MIN_CPU_CHANGE_S and usage["cpu_s"] > old["cpu_s"] * (1 + tolerance):
+            regressions.append(f"{service} CPU time {old['cpu_s']:.1f}s -> {usage['cpu_s']:.1f}s")
+        if usage["rss_peak_mb"] > old["rss_peak_mb"] * (1 + tolerance):
+            regressions.append(f"{service} peak RSS {old['rss_peak_mb']:.0f} MB -> {usage['rss_peak_mb']:.0f} MB")
+    old_detected = baseline.get("detections", {}).get("detected")
+    if old_detected is not None and results["detections"]["detected"] < old_detected:
+        regressions.append(f"wake words detected {old_detected} -> {results['detections']['detected']}")
+    return regressions
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    items, gap_s = load_scenario(Path(args.scenario))
+    names = list(SERVICES) if args.launch == "all" else [n for n in args.launch.split(",") if n]
+    unknown = set(names) - set(SERVICES)
+    if unknown:
+        raise SystemExit(f"Unknown services: {', '.join(sorted(unknown))}; known are {', '.join(SERVICES)}.")
+
+    settings = StubSettings(first_token_delay=args.first_token_ms / 1000, token_delay=args.token_ms / 1000)
+    stub = start_stub_server(port=args.stub_port, settings=settings)
+    stub_url = f"http://127.0.0.1:{stub.server_address[1]}"
+    broker = None
+    if args.broker == "fake":
+        broker = FakeBroker("127.0.0.1", args.broker_port)
+        await broker.start()
+    services = Services(names, stub_url, Path(args.logs)) if names else None
+    sampler = ProcessSampler({name: arguments[0] for name, (_, arguments) in SERVICES.items()})
+    observer = Observer(items)
+    try:
+        if services is not None:
+            services.start()
+        async with Client("localhost", port=args.broker_port) as client:
+            startup = await wait_until_ready(client, services, names or READY_SERVICES, args.warmup)
+            await client.subscribe(topic_trace)
+            await client.subscribe("assistant/#")
+
+            async def observe():
+                async for message in client.messages:
+                    observer.handle(str(message.topic), message.payload)
+
+            observing = asyncio.create_task(observe())
+            sampler.start()
+            print(f"Replaying {len(items)} recordings at {args.speed}x real time.")
+            replayed = await replay(client, items, gap_s, args.speed, observer, args.codec)
+            deadline = time.monotonic() + args.settle
+            while not observer.finished() and time.monotonic() < deadline:
+                await asyncio.sleep(0.2)
+            processes = sampler.stop()
+            observing.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await observing
+    finally:
+        if services is not None:
+            services.stop()
+        if broker is not None:
+            broker_stats = broker.stats()
+            await broker.close()
+        stub.shutdown()
+
+    item_results = observer.item_results()
+    latencies: Dict[str, List[float]] = {}
+    for item in item_results:
+        for stage, ms in item["latency_ms"].items():
+            latencies.setdefault(stage, []).append(ms)
+    audio_s = replayed["audio_s"]
+    throughput = {}
+    for service, processed_s in (("wake-word-detection", audio_s), ("speech-to-text", audio_s),
+                                 ("text-to-speech", observer.synthesized_audio_s)):
+        cpu_s = processes[service]["cpu_s"]
+        throughput[service] = {"audio_s": round(processed_s, 2),
+                               "audio_s_per_cpu_s": round(processed_s / cpu_s, 2) if cpu_s else None}
+    return {
+        "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "host": {"platform": platform.platform(), "cpus": os.cpu_count(), "python": platform.python_version()},
+        "config": {"scenario": args.scenario, "speed": args.speed, "codec": args.codec, "broker": args.broker,
+                   "launched": names,
+                   "first_token_ms": args.first_token_ms, "token_ms": args.token_ms},
+        "replay": replayed,
+        "detections": {"expected": len(items), "detected": sum(1 for i in item_results if i["interaction"]),
+                       "transcribed": sum(1 for i in item_results if i["transcript"]),
+                       "replied": sum(1 for i in item_results if i["reply"])},
+        "latency_ms": {stage: summarize(latencies[stage]) for stage, _, _ in STAGES if stage in latencies},
+        "startup": startup,
+        "processes": processes,
+        "throughput": throughput,
+        "broker": broker_stats if broker is not None else None,
+        "items": item_results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recordings through the voice pipeline and measure it.")
+    parser.add_argument("scenario", help="scenario JSON file")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay this many times faster than real time; latencies are only meaningful at 1")
+    parser.add_argument("--codec", choices=list(CODECS), default="pcm",
+                        help="compression of the replayed audio, like stream_mic_to_mqtt.py --codec")
+    parser.add_argument("--broker", choices=["fake", "external"], default="fake",
+                        help="in-process fake broker, or a broker already running on localhost")
+    parser.add_argument("--broker-port", type=int, default=1883, help="the services expect the broker on 1883")
+    parser.add_argument("--launch", default="", help="services to start, comma separated, or 'all'")
+    parser.add_argument("--logs", default="benchmark-logs", help="directory for the output of launched services")
+    parser.add_argument("--stub-port", type=int, default=8090)
+    parser.add_argument("--first-token-ms", type=float, default=300, help="time to first token of the fake model")
+    parser.add_argument("--token-ms", type=float, default=20, help="time per token of the fake model")
+    parser.add_argument("--warmup", type=float, default=120, help="seconds to wait for the services to start")
+    parser.add_argument("--settle", type=float, default=30, help="seconds to wait for the last replies")
+    parser.add_argument("--output", help="write the results to this JSON file instead of stdout")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"Results written to {args.output}.")
+    else:
+        print(json.dumps(results, indent=2))
+
+    for stage, stats in results["latency_ms"].items():
+        print(f"{stage}: p50 {stats['p50']:.0f} ms, p95 {stats['p95']:.0f} ms over {stats['count']} recordings")
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Local stand-ins for the OpenAI Responses API and the Tagesschau API.
+
+The assistant reaches the stub through OPENAI_BASE_URL, the news MCP server through
+TAGESSCHAU_API_URL, so a benchmark run needs neither network access nor an API key,
+and its timing does not depend on a remote model.
+
+The fake model behaves like the real one would with `tool_choice="required"`: its
+first answer to an instruction is a call of the news tool, and once the tool output
+is in the conversation it streams a fixed reply, a token at a time, after a
+configurable time to first token.
+
+    uv run stub_backends.py --port 8090
+    OPENAI_BASE_URL=http://127.0.0.1:8090/v1 TAGESSCHAU_API_URL=http://127.0.0.1:8090/api2u/news ...
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_REPLY = (
+    "Here is the latest news from Schleswig-Holstein. The state parliament agreed on a new budget for schools. "
+    "In Kiel, the harbour expects a record number of cruise ships this summer. "
+    "And the weather stays mild, with some rain in the north."
+)
+NEWS_TOOL = "fetch_default_news_by_ressort"
+NEWS_TOOL_ARGUMENTS = {"region": 1}
+TOKEN_RE = re.compile(r"\S+\s*")
+
+
+@dataclass
+class StubSettings:
+    reply: str = DEFAULT_REPLY
+    first_token_delay: float = 0.3
+    token_delay: float = 0.02
+    tool_call_delay: float = 0.3
+    articles_per_ressort: int = 5
+
+
+def fake_article(number: int, ressort: str, base_url: str) -> Dict[str, Any]:
+    return {
+        "sophoraId": f"stub-{ressort}-{number}",
+        "title": f"Meldung {number} aus dem Ressort {ressort}",
+        "topline": ressort.capitalize(),
+        "firstSentence": f"Dies ist der erste Satz der Meldung {number} &quot;{ressort}&quot;.",
+        "date": "2025-01-31T08:00:00.000+01:00",
+        "ressort": ressort,
+        "details": f"{base_url}/api2u/stub-{ressort}-{number}.json",
+    }
+
+
+def fake_details(article_id: str) -> Dict[str, Any]:
+    return {
+        "title": f"Meldung {article_id}",
+        "date": "2025-01-31T08:00:00.000+01:00",
+        "topline": "Stub",
+        "content": [
+            {"type": "headline", "value": "<h2>Zwischenüberschrift</h2>"},
+            {"type": "text", "value": "Der Text der Meldung hat <strong>mehrere</strong> Sätze. " * 8},
+        ],
+    }
+
+
+def usage(output_text: str) -> Dict[str, Any]:
+    output_tokens = len(TOKEN_RE.findall(output_text))
+    return {
+        "input_tokens": 100,
+        "input_tokens_details": {"cached_tokens": 0},
+        "output_tokens": output_tokens,
+        "output_tokens_details": {"reasoning_tokens": 0},
+        "total_tokens": 100 + output_tokens,
+    }
+
+
+class FakeResponse:
+    """Builds the server-sent events of one streamed Responses API call."""
+
+    def __init__(self, request: Dict[str, Any]):
+        self.request = request
+        self.id = f"resp_{uuid.uuid4().hex}"
+        self.sequence = 0
+
+    def envelope(self, status: str, output: List[Dict[str, Any]], text: str = "") -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "object": "response",
+            "created_at": int(time.time()),
+            "status": status,
+            "model": self.request.get("model", "stub"),
+            "output": output,
+            "parallel_tool_calls": True,
+            "tool_choice": self.request.get("tool_choice", "auto"),
+            "tools": self.request.get("tools", []),
+            "usage": usage(text) if status == "completed" else None,
+        }
+
+    def event(self, event_type: str, **fields) -> bytes:
+        data = {"type": event_type, "sequence_number": self.sequence, **fields}
+        self.sequence += 1
+        return f"event: {event_type}\ndata: {json.dumps(data)}\n\n".encode()
+
+    def function_call(self, name: str, arguments: str) -> Iterator[bytes]:
+        item = {"id": f"fc_{uuid.uuid4().hex}", "type": "function_call", "call_id": f"call_{uuid.uuid4().hex}",
+                "name": name, "arguments": "", "status": "in_progress"}
+        yield self.event("response.created", response=self.envelope("in_progress", []))
+        yield self.event("response.output_item.added", output_index=0, item=item)
+        yield self.event("response.function_call_arguments.delta", item_id=item["id"], output_index=0, delta=arguments)
+        yield self.event("response.function_call_arguments.done", item_id=item["id"], output_index=0,
+                         name=name, arguments=arguments)
+        item = {**item, "arguments": arguments, "status": "completed"}
+        yield self.event("response.output_item.done", output_index=0, item=item)
+        yield self.event("response.completed", response=self.envelope("completed", [item]))
+
+    def message(self, tokens: Iterator[str]) -> Iterator[bytes]:
+        item = {"id": f"msg_{uuid.uuid4().hex}", "type": "message", "role": "assistant",
+                "status": "in_progress", "content": []}
+        part = {"type": "output_text", "text": "", "annotations": []}
+        where = {"item_id": item["id"], "output_index": 0, "content_index": 0}
+        yield self.event("response.created", response=self.envelope("in_progress", []))
+        yield self.event("response.output_item.added", output_index=0, item=item)
+        yield self.event("response.content_part.added", **where, part=part)
+        text = ""
+        for token in tokens:
+            text += token
+            yield self.event("response.output_text.delta", **where, delta=token, logprobs=[])
+        part = {**part, "text": text}
+        yield self.event("response.output_text.done", **where, text=text, logprobs=[])
+        yield self.event("response.content_part.done", **where, part=part)
+        item = {**item, "status": "completed", "content": [part]}
+        yield self.event("response.output_item.done", output_index=0, item=item)
+        yield self.event("response.completed", response=self.envelope("completed", [item], text))
+
+
+def needs_tool_call(request: Dict[str, Any]) -> Optional[str]:
+    """Name of the tool to call first, or None once the last instruction has its tool output."""
+    tools = [t.get("name") for t in request.get("tools", []) if t.get("type") == "function"]
+    if not tools:
+        return None
+    items = request.get("input", [])
+    if isinstance(items, str):
+        return NEWS_TOOL if NEWS_TOOL in tools else tools[0]
+    # Only what happened since the latest user message counts
+    for item in reversed(items):
+        if item.get("type") == "function_call_output":
+            return None
+        if item.get("role") == "user":
+            break
+    return NEWS_TOOL if NEWS_TOOL in tools else tools[0]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    settings = StubSettings()
+    counters: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def do_POST(self):
+        if not urlparse(self.path).path.endswith("/responses"):
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not request.get("stream"):
+            self.send_error(400, "The stub only streams responses.")
+            return
+        response = FakeResponse(request)
+        tool = needs_tool_call(request)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        if tool is not None:
+            self.count("tool_calls")
+            time.sleep(self.settings.tool_call_delay)
+            arguments = json.dumps(NEWS_TOOL_ARGUMENTS if tool == NEWS_TOOL else {})
+            events = response.function_call(tool, arguments)
+        else:
+            self.count("replies")
+            events = response.message(self.tokens())
+        try:
+            for chunk in events:
+                self.wfile.write(chunk)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The assistant cancelled the run
+            self.count("cancelled")
+
+    def tokens(self) -> Iterator[str]:
+        time.sleep(self.settings.first_token_delay)
+        for i, token in enumerate(TOKEN_RE.findall(self.settings.reply)):
+            if i:
+                time.sleep(self.settings.token_delay)
+            yield token
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        base_url = f"http://{self.headers.get('Host')}"
+        if url.path.endswith("/news"):
+            self.count("news")
+            ressort = parse_qs(url.query).get("ressort", ["inland"])[0]
+            body = {"news": [fake_article(i, ressort, base_url) for i in range(self.settings.articles_per_ressort)]}
+        elif url.path.endswith(".json") and "/stub-" in url.path:
+            self.count("details")
+            body = fake_details(url.path.rsplit("/", 1)[-1].removesuffix(".json"))
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, settings: StubSettings | None = None) -> ThreadingHTTPServer:
+    """Serve the stubs on a daemon thread; port 0 picks a free port (see `server.server_address`)."""
+    handler = type("Handler", (StubHandler,), {"settings": settings or StubSettings(), "counters": {}})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="stub-backends").start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve stubs of the OpenAI and Tagesschau APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--reply", default=DEFAULT_REPLY, help="text the fake model replies with")
+    parser.add_argument("--first-token-ms", type=float, default=300, help="delay before the first reply token")
+    parser.add_argument("--token-ms", type=float, default=20, help="delay between reply tokens")
+    args = parser.parse_args()
+
+    settings = StubSettings(args.reply, args.first_token_ms / 1000, args.token_ms / 1000)
+    server = start_stub_server(args.host, args.port, settings)
+    print(f"Stub backends on http://{args.host}:{server.server_address[1]}: "
+          f"OpenAI at /v1, Tagesschau at /api2u/news.")
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    main()
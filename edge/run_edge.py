@@ -0,0 +1,137 @@
+"""
+Runs the microphone, wake word detection, speech-to-text and text-to-speech stages in
+one Python process, connected by the in-process message bus (see message_bus.py in
+the stage directories). Audio chunks are handed from stage to stage as numpy arrays,
+without encoding them or a round trip through the broker, and the interpreter and
+libraries are loaded once instead of four times.
+
+The assistant keeps running as its own service: wake word events, instructions and
+trace events are also published to the MQTT broker, and replies from the broker are
+delivered to text-to-speech.
+
+    uv run run_edge.py
+    uv run run_edge.py --stages wake-word,speech-to-text,text-to-speech --export "audio/#"
+"""
+
+import argparse
+import os
+import shlex
+import signal
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# Started in this order, so every consumer has subscribed before its producer starts
+STAGES = {
+    "text-to-speech": ("text-to-speech", "text-to-speech.py", []),
+    "speech-to-text": ("speech-to-text", "speech-to-text.py", ["--model", "en-us"]),
+    "wake-word": ("wake-word-detection", "detect_wake_word_from_mqtt.py",
+                  ["--model_path", os.path.join(ROOT, "wake-word-detection", "models", "hey_rhasspy_v0.1.onnx"),
+                   "--inference_framework", "onnx"]),
+    "mic": ("stream-mic-to-mqtt", "stream_mic_to_mqtt.py", []),
+}
+
+EXPORT = ["wakeword/#", "assistant/#", "trace/#", "service/#"]
+IMPORT = ["assistant/reply", "assistant/+/reply", "assistant/reply/cancel", "assistant/+/reply/cancel"]
+
+
+def run_stage(name: str, path: str, stopped: threading.Event):
+    """Run a stage script like `python <path>` would, but as a thread of this process."""
+    with open(path) as f:
+        code = compile(f.read(), path, "exec")
+    # Not runpy, which would swap sys.modules["__main__"] while the stage runs
+    namespace = {"__name__": "__main__", "__file__": path, "__builtins__": __builtins__}
+    try:
+        exec(code, namespace)
+    except SystemExit:
+        pass
+    except BaseException as e:
+        print(f"Stage {name} failed: {e!r}")
+    if not stopped.is_set():
+        print(f"Stage {name} exited.")
+
+
+def start_stage(name: str, bus, stage_args: list, timeout: float) -> threading.Thread:
+    directory, script, default_args = STAGES[name]
+    path = os.path.join(ROOT, directory, script)
+    # argparse reads sys.argv when the stage starts; the next stage is only started once
+    # this one subscribed, so they never see each other's arguments
+    sys.argv = [path, *default_args, *stage_args]
+    thread = threading.Thread(target=run_stage, args=(name, path, bus.stopped), daemon=True, name=f"stage-{name}")
+    started = time.monotonic()
+    thread.start()
+    while not bus.started.acquire(timeout=1.0):
+        if not thread.is_alive():
+            raise RuntimeError(f"Stage {name} exited before it subscribed.")
+        if time.monotonic() - started > timeout:
+            raise RuntimeError(f"Stage {name} did not start within {timeout:.0f} s.")
+    print(f"Stage {name} started in {time.monotonic() - started:.1f} s.")
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the voice pipeline stages in one process.")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help=f"comma separated stages to run; default is all of {', '.join(STAGES)}")
+    for name in STAGES:
+        parser.add_argument(f"--{name}-args", default="",
+                            help=f"additional command line arguments of the {name} stage")
+    parser.add_argument("--broker", default="localhost", help="MQTT broker of the assistant and other services")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--no-bridge", action="store_true",
+                        help="do not connect to the broker, e.g. to run only the microphone and wake word detection")
+    parser.add_argument("--export", action="append", default=[],
+                        help=f"additional topic filter published to the broker, besides {', '.join(EXPORT)}")
+    parser.add_argument("--queue-size", type=int, default=1000,
+                        help="messages a subscriber may fall behind before the oldest ones are dropped")
+    parser.add_argument("--start-timeout", type=float, default=300,
+                        help="seconds a stage may take to load its models")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+
+    # The stages import their modules from their own directories; the modules shared
+    # between them (audio_frame, message_bus, tracing) are identical, so one copy serves all
+    for name in STAGES:
+        sys.path.insert(0, os.path.join(ROOT, STAGES[name][0]))
+    import message_bus
+
+    bridge = None if args.no_bridge else message_bus.MqttBus(args.broker, args.port)
+    bus = message_bus.LocalBus(args.queue_size, bridge, EXPORT + args.export, IMPORT)
+    message_bus.use_in_process_bus(bus)
+    if bridge is not None:
+        bridge.start()
+
+    def handle_stop_signals(signum, frame):
+        print("Received stop signal, shutting down gracefully...")
+        bus.stop()
+
+    signal.signal(signal.SIGTERM, handle_stop_signals)
+    signal.signal(signal.SIGINT, handle_stop_signals)
+
+    threads = []
+    try:
+        for name in (s for s in STAGES if s in stages):
+            threads.append(start_stage(name, bus, shlex.split(getattr(args, f"{name.replace('-', '_')}_args")),
+                                       args.start_timeout))
+            if bus.stopped.is_set():
+                break
+    except RuntimeError as e:
+        print(e)
+        bus.stop()
+
+    while not bus.stopped.wait(60):
+        if bus.dropped():
+            print(f"Messages dropped by slow subscribers: {bus.dropped()}")
+    for thread in threads:
+        thread.join(timeout=5)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Collects the trace events of all stages and reports the latency of every hop of a
+voice interaction, from the wake word to the first audio of the reply.
+
+Events arrive on "trace/<stage>" (see tracing.py in the services). They are grouped by
+interaction id; an interaction is complete once its reply was fully generated and its
+first audio played, or after --timeout seconds without further events. The durations
+between pairs of events are kept per stage and exported as Prometheus summaries on
+http://<host>:<port>/metrics, and as JSON on /summary.json. Complete timelines are
+appended to --timelines as JSON lines.
+"""
+
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import paho.mqtt.client as mqtt
+
+broker = "localhost"
+port = 1883
+topic_trace = "trace/#"
+
+# (stage, start event, end event); the events are emitted in this order by the services
+STAGES = [
+    ("wake_to_stt", "wake_detected", "stt_started"),
+    ("utterance", "stt_started", "endpoint"),
+    ("transcript", "endpoint", "instruction_published"),
+    ("instruction_delivery", "instruction_published", "instruction_received"),
+    ("agent_queue", "instruction_received", "run_started"),
+    ("first_token", "run_started", "first_token"),
+    ("first_sentence", "first_token", "first_sentence"),
+    ("reply_delivery", "first_sentence", "reply_received"),
+    ("synthesis", "reply_received", "first_audio"),
+    # From the end of speech to the first audio, the delay the user notices
+    ("response", "endpoint", "first_audio"),
+    ("total", "wake_detected", "first_audio"),
+    # How much earlier a committed speculative agent run started than a regular one would have
+    ("speculation_head_start", "speculation_started", "instruction_received"),
+]
+FINAL_EVENTS = {"reply_done", "first_audio"}
+QUANTILES = (0.5, 0.95, 0.99)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--http_port", help="Port of the metrics endpoint", type=int, default=9464)
+parser.add_argument("--timelines", help="File complete timelines are appended to as JSON lines", type=str, default="")
+parser.add_argument("--timeout", help="Seconds after the last event an incomplete interaction is reported", type=float, default=60.0)
+parser.add_argument("--window", help="Latest samples per stage the quantiles are computed from", type=int, default=1000)
+parser.add_argument("--report_interval", help="Seconds between printed summaries, 0 to disable", type=float, default=60.0)
+args = parser.parse_args()
+
+
+def quantile(ordered, q):
+    # Nearest rank
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class StageStats:
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def quantiles(self):
+        ordered = sorted(self.samples)
+        return {q: quantile(ordered, q) for q in QUANTILES} if ordered else {}
+
+
+class LatencyCollector:
+    def __init__(self, window, timeout, timelines_path):
+        self.timeout = timeout
+        self.timelines_path = timelines_path
+        self.stages = {name: StageStats(window) for name, _, _ in STAGES}
+        self.capture_lag = StageStats(window)
+        self.open = {}
+        # Ids of reported interactions, so stray late events do not open them again
+        self.finished = deque(maxlen=1000)
+        self.outcomes = {"complete": 0, "timeout": 0}
+        self.lock = threading.Lock()
+
+    def add(self, event):
+        interaction = event.get("interaction")
+        if not interaction or "event" not in event or "mono_ns" not in event:
+            return
+        with self.lock:
+            if interaction in self.finished:
+                return
+            timeline = self.open.setdefault(interaction, {"events": {}, "last_seen": time.monotonic()})
+            timeline["last_seen"] = time.monotonic()
+            # Only the first occurrence counts, e.g. of a wake word reported twice
+            timeline["events"].setdefault(event["event"], event)
+            if FINAL_EVENTS <= timeline["events"].keys():
+                self._finish(interaction, "complete")
+
+    def expire(self):
+        now = time.monotonic()
+        with self.lock:
+            for interaction in [i for i, t in self.open.items() if now - t["last_seen"] > self.timeout]:
+                self._finish(interaction, "timeout")
+
+    def _finish(self, interaction, outcome):
+        events = self.open.pop(interaction)["events"]
+        self.finished.append(interaction)
+        self.outcomes[outcome] += 1
+        durations = {}
+        for name, start, end in STAGES:
+            if start in events and end in events:
+                seconds = (events[end]["mono_ns"] - events[start]["mono_ns"]) / 1e9
+                durations[name] = seconds
+                self.stages[name].add(seconds)
+        capture_lag_ms = events.get("wake_detected", {}).get("capture_lag_ms")
+        if capture_lag_ms is not None:
+            self.capture_lag.add(capture_lag_ms / 1000)
+        if "total" in durations:
+            print(f"Interaction {interaction}: {durations['total'] * 1000:.0f} ms from wake word to first audio, "
+                  f"{durations.get('response', 0) * 1000:.0f} ms after the end of speech.")
+        if self.timelines_path:
+            self._write_timeline(interaction, outcome, events, durations)
+
+    def _write_timeline(self, interaction, outcome, events, durations):
+        ordered = sorted(events.values(), key=lambda e: e["mono_ns"])
+        start = ordered[0]["mono_ns"]
+        timeline = {
+            "interaction": interaction,
+            "outcome": outcome,
+            "wall_ns": ordered[0].get("wall_ns"),
+            "events": [{**e, "offset_ms": (e["mono_ns"] - start) / 1e6} for e in ordered],
+            "stages_ms": {name: seconds * 1000 for name, seconds in durations.items()},
+        }
+        with open(self.timelines_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(timeline) + "\n")
+
+    def summary(self):
+        with self.lock:
+            stages = {}
+            for name, stats in [*self.stages.items(), ("capture_lag", self.capture_lag)]:
+                if stats.count:
+                    stages[name] = {"count": stats.count,
+                                    **{f"p{int(q * 100)}_ms": v * 1000 for q, v in stats.quantiles().items()}}
+            return {"interactions": dict(self.outcomes), "open": len(self.open), "stages": stages}
+
+    def prometheus(self):
+        lines = [
+            "# HELP voice_stage_latency_seconds Latency of the stages of a voice interaction.",
+            "# TYPE voice_stage_latency_seconds summary",
+        ]
+        with self.lock:
+            for name, stats in [*self.stages.items(), ("capture_lag", self.capture_lag)]:
+                for q, value in stats.quantiles().items():
+                    lines.append(f'voice_stage_latency_seconds{{stage="{name}",quantile="{q}"}} {value:.6f}')
+                lines.append(f'voice_stage_latency_seconds_sum{{stage="{name}"}} {stats.total:.6f}')
+                lines.append(f'voice_stage_latency_seconds_count{{stage="{name}"}} {stats.count}')
+            lines.append("# HELP voice_interactions_total Traced interactions by how their timeline ended.")
+            lines.append("# TYPE voice_interactions_total counter")
+            for outcome, count in self.outcomes.items():
+                lines.append(f'voice_interactions_total{{outcome="{outcome}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+collector = LatencyCollector(args.window, args.timeout, args.timelines)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = collector.prometheus(), "text/plain; version=0.0.4"
+        elif self.path == "/summary.json":
+            body, content_type = json.dumps(collector.summary(), indent=2), "application/json"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def expire_and_report():
+    last_report = time.monotonic()
+    while True:
+        time.sleep(1.0)
+        collector.expire()
+        if args.report_interval and time.monotonic() - last_report >= args.report_interval:
+            last_report = time.monotonic()
+            summary = collector.summary()
+            for name, stats in summary["stages"].items():
+                print(f"{name}: p50 {stats['p50_ms']:.0f} ms, p95 {stats['p95_ms']:.0f} ms, "
+                      f"p99 {stats['p99_ms']:.0f} ms over {stats['count']} interactions")
+
+
+def on_message(client, userdata, msg):
+    try:
+        event = json.loads(msg.payload)
+    except ValueError:
+        return
+    if isinstance(event, dict):
+        collector.add(event)
+
+
+def on_connect(client, userdata, flags, reason_code, properties):
+    client.subscribe(topic_trace)
+
+
+server = ThreadingHTTPServer(("", args.http_port), MetricsHandler)
+threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+threading.Thread(target=expire_and_report, daemon=True, name="expire-thread").start()
+print(f"Serving latency metrics on port {args.http_port} (/metrics, /summary.json).")
+
+client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+client.on_connect = on_connect
+client.on_message = on_message
+client.connect(broker, port, 60)
+client.loop_forever()
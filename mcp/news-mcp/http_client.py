@@ -0,0 +1,111 @@
+"""
+Long-lived HTTP client shared by all tools of the news MCP server.
+
+One `httpx.AsyncClient` is opened with the server and reused for every request, so
+tool calls run over pooled keep-alive connections (HTTP/2 where the server offers it)
+instead of paying a TCP and TLS handshake each time. Transient failures (connection
+errors, timeouts, 429 and 5xx responses) are retried with exponential backoff.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import random
+from typing import Any, Dict, Optional
+
+import httpx
+
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+# Longest wait between two attempts, also caps a server's Retry-After
+MAX_BACKOFF = 10.0
+
+
+class NewsHttpClient:
+    """Pooled HTTP client, opened and closed with `async with`."""
+
+    def __init__(
+        self,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = 15.0,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 30.0,
+        retries: int = 3,
+        backoff: float = 0.25,
+        http2: bool = True,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        """
+        `retries`: attempts after the first one for transient errors.
+        `backoff`: wait before the first retry in seconds, doubled for every further one.
+        `transport`: replaces the network transport, e.g. with `httpx.MockTransport`.
+        """
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.retries = retries
+        self.backoff = backoff
+        self.http2 = http2
+        self.transport = transport
+        self.client: Optional[httpx.AsyncClient] = None
+
+    async def __aenter__(self) -> "NewsHttpClient":
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=self.timeout,
+            limits=self.limits,
+            http2=self.http2,
+            transport=self.transport,
+        )
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        client, self.client = self.client, None
+        if client is not None:
+            await client.aclose()
+
+    async def get(self, url: str, params: Optional[Dict[str, Any]] = None,
+                  headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        """
+        GET `url`, retrying transient errors. Raises for an error status that is left after the retries.
+        A 304 answer to a conditional request is returned like a success.
+        """
+        if self.client is None:
+            raise RuntimeError("The HTTP client is not open, use it inside 'async with'.")
+
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.get(url, params=params, headers=headers)
+            except httpx.TransportError:
+                if attempt >= self.retries:
+                    raise
+                delay = self._backoff_delay(attempt)
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.retries:
+                    if response.status_code != 304:
+                        response.raise_for_status()
+                    return response
+                delay = self._retry_after(response) or self._backoff_delay(attempt)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def get_json(self, url: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        response = await self.get(url, params=params)
+        return response.json()
+
+    def _backoff_delay(self, attempt: int) -> float:
+        # Full jitter keeps retries of concurrent tool calls from arriving together
+        return random.uniform(0, min(self.backoff * 2 ** attempt, MAX_BACKOFF))
+
+    @staticmethod
+    def _retry_after(response: httpx.Response) -> Optional[float]:
+        value = response.headers.get("Retry-After", "")
+        try:
+            return min(max(float(value), 0.0), MAX_BACKOFF)
+        except ValueError:
+            return None
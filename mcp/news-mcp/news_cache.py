@@ -0,0 +1,146 @@
+"""
+In-process cache for Tagesschau API responses.
+
+The news feeds change every few minutes, so the same region/ressort queries and
+article details are served from memory while they are fresh. After `ttl` seconds an
+entry turns stale: it is still returned right away while a background request
+revalidates it with If-None-Match/If-Modified-Since, which usually only costs a 304.
+Entries older than `ttl + stale_ttl` are fetched before answering. Concurrent misses
+for the same URL share a single upstream request.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import httpx
+
+from http_client import NewsHttpClient
+
+
+@dataclass
+class CacheEntry:
+    data: Any
+    fetched_at: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+def cache_key(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """Normalized URL with sorted query parameters, so equal requests share an entry."""
+    parsed = httpx.URL(url)
+    query = sorted(parsed.params.multi_items())
+    if params:
+        query += sorted((key, str(value)) for key, value in params.items())
+    return str(httpx.URL(parsed.copy_with(query=None, fragment=None), params=sorted(query)))
+
+
+class ResponseCache:
+    """TTL and LRU bounded cache of JSON responses with stale-while-revalidate and single-flight."""
+
+    def __init__(self, http_client: NewsHttpClient, ttl: float = 120.0, stale_ttl: float = 600.0,
+                 max_entries: int = 512):
+        """
+        `ttl`: seconds an entry is served without asking upstream.
+        `stale_ttl`: seconds after that during which the entry is still served while it is refreshed.
+        `max_entries`: least recently used entries beyond this are dropped.
+        """
+        self.http_client = http_client
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self.inflight: Dict[str, asyncio.Task] = {}
+        self.counters = {"hits": 0, "misses": 0, "stale": 0, "revalidated": 0, "errors": 0, "evictions": 0}
+
+    async def get_json(self, url: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        key = cache_key(url, params)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            age = time.monotonic() - entry.fetched_at
+            if age < self.ttl:
+                self.counters["hits"] += 1
+                return entry.data
+            if age < self.ttl + self.stale_ttl:
+                self.counters["stale"] += 1
+                self._refresh(key, url, params)
+                return entry.data
+
+        self.counters["misses"] += 1
+        # Shielded, so a caller giving up does not cancel the request other callers wait for
+        return await asyncio.shield(self._refresh(key, url, params))
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.counters, "entries": len(self.entries), "inflight": len(self.inflight)}
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    async def close(self) -> None:
+        """Cancel refreshes still in flight, before the HTTP client goes away."""
+        tasks = list(self.inflight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _refresh(self, key: str, url: str, params: Optional[Dict[str, Any]]) -> asyncio.Task:
+        """Start fetching `key`, or return the fetch already in flight."""
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key, url, params))
+            self.inflight[key] = task
+            task.add_done_callback(lambda done: self._fetch_done(key, done))
+        return task
+
+    def _fetch_done(self, key: str, task: asyncio.Task) -> None:
+        self.inflight.pop(key, None)
+        # Background refreshes have no caller to report to
+        if not task.cancelled() and task.exception() is not None:
+            self.counters["errors"] += 1
+            print(f"Fetching '{key}' failed: {task.exception()!r}")
+
+    async def _fetch(self, key: str, url: str, params: Optional[Dict[str, Any]]) -> Any:
+        entry = self.entries.get(key)
+        headers = {}
+        if entry is not None and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+
+        try:
+            response = await self.http_client.get(url, params=params, headers=headers)
+        except Exception:
+            if entry is None:
+                raise
+            # Better an old answer than none
+            self.counters["errors"] += 1
+            print(f"Serving an outdated response for '{key}', upstream failed.")
+            return entry.data
+
+        if response.status_code == 304:
+            # Only sent for conditional requests, so there is an entry, even if it was evicted meanwhile
+            self.counters["revalidated"] += 1
+            entry.fetched_at = time.monotonic()
+            self._store(key, entry)
+            return entry.data
+
+        data = response.json()
+        self._store(key, CacheEntry(
+            data=data,
+            fetched_at=time.monotonic(),
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        ))
+        return data
+
+    def _store(self, key: str, entry: CacheEntry) -> None:
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters["evictions"] += 1
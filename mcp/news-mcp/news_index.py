@@ -0,0 +1,345 @@
+"""
+Local full-text index of Tagesschau articles.
+
+A background ingester periodically pulls the news feeds, and the details of new or
+updated articles, into a SQLite FTS5 table. `search_news` then answers with a local
+query of a few milliseconds instead of fetching and scanning whole feeds. Articles
+are deduplicated by their id; details are only fetched again when the date of an
+article changed.
+
+The ingester gets its responses from any `get_json(url, params)` source, so it runs
+against recorded fixtures as well as the API. Record fixtures, then ingest and search
+them without network access:
+
+    uv run news_index.py --record fixtures --db /tmp/news.db
+    uv run news_index.py --fixtures fixtures --db /tmp/news.db --search "Bahn Streik"
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import re
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+import httpx
+
+from http_client import NewsHttpClient
+from news_cache import cache_key
+from tagesschau_api import API_URL, DEFAULT_RESSORTS, USER_AGENT
+from tagesschau_text import clean_tagesschau_text, extract_article
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    id TEXT PRIMARY KEY,
+    date TEXT,
+    published REAL,
+    ressort TEXT,
+    regions TEXT,
+    details TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+    title, topline, first_sentence, text,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+# Rank matches in the title above those in the topline, the first sentence and the text
+BM25_WEIGHTS = (5.0, 3.0, 2.0, 1.0)
+WORD_RE = re.compile(r"\w+")
+
+FetchJson = Callable[..., Awaitable[Any]]
+
+
+def parse_date(value: Optional[str]) -> Optional[float]:
+    """Unix time of an ISO 8601 date as used by the API ("2025-01-31T10:15:00.000+01:00")."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+def match_expression(query: str, any_term: bool = False) -> str:
+    """FTS5 query of the words in `query` as prefixes, so punctuation in a user question cannot break the syntax."""
+    terms = [f'"{word}"*' for word in WORD_RE.findall(query)]
+    return (" OR " if any_term else " ").join(terms)
+
+
+class NewsIndex:
+    """SQLite FTS5 index of articles, safe to use from the event loop and worker threads."""
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.lock = Lock()
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.executescript(SCHEMA)
+
+    def known_dates(self, ids: Iterable[str]) -> Dict[str, Optional[str]]:
+        ids = list(ids)
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT id, date FROM articles WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall()
+        return {row["id"]: row["date"] for row in rows}
+
+    def upsert(self, articles: List[Dict[str, Any]]) -> None:
+        """Insert or replace articles with the keys id, date, ressort, regions, details, title, topline, first_sentence and text."""
+        with self.lock, self.db:
+            for article in articles:
+                row = self.db.execute("SELECT rowid, regions FROM articles WHERE id = ?", (article["id"],)).fetchone()
+                regions = self._merge_regions(row["regions"] if row else None, article["regions"])
+                values = (article["date"], parse_date(article["date"]), article["ressort"], regions, article["details"])
+                if row is None:
+                    cursor = self.db.execute(
+                        "INSERT INTO articles (date, published, ressort, regions, details, id) VALUES (?, ?, ?, ?, ?, ?)",
+                        values + (article["id"],))
+                    rowid = cursor.lastrowid
+                else:
+                    rowid = row["rowid"]
+                    self.db.execute(
+                        "UPDATE articles SET date = ?, published = ?, ressort = ?, regions = ?, details = ? WHERE rowid = ?",
+                        values + (rowid,))
+                    self.db.execute("DELETE FROM articles_fts WHERE rowid = ?", (rowid,))
+                self.db.execute(
+                    "INSERT INTO articles_fts (rowid, title, topline, first_sentence, text) VALUES (?, ?, ?, ?, ?)",
+                    (rowid, article["title"], article["topline"], article["first_sentence"], article["text"]))
+
+    def add_regions(self, regions_by_id: Dict[str, Iterable[int]]) -> None:
+        """Record that already indexed articles also appeared in the feeds of these regions."""
+        with self.lock, self.db:
+            for article_id, regions in regions_by_id.items():
+                row = self.db.execute("SELECT regions FROM articles WHERE id = ?", (article_id,)).fetchone()
+                if row is not None:
+                    merged = self._merge_regions(row["regions"], regions)
+                    if merged != row["regions"]:
+                        self.db.execute("UPDATE articles SET regions = ? WHERE id = ?", (merged, article_id))
+
+    def search(self, query: str, region: Optional[int] = None, since: Optional[float] = None,
+               limit: int = 10) -> List[Dict[str, Any]]:
+        """Best matching articles first. All words have to match; if no article has all of them, any word does."""
+        results = self._search(match_expression(query), region, since, limit)
+        if not results and len(WORD_RE.findall(query)) > 1:
+            results = self._search(match_expression(query, any_term=True), region, since, limit)
+        return results
+
+    def count(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT count(*) FROM articles").fetchone()[0]
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+    def _search(self, expression: str, region: Optional[int], since: Optional[float], limit: int) -> List[Dict[str, Any]]:
+        if not expression:
+            return []
+        sql = (
+            "SELECT a.date, a.ressort, a.details, f.title, snippet(articles_fts, -1, '', '', ' … ', 24) AS snippet "
+            "FROM articles_fts f JOIN articles a ON a.rowid = f.rowid WHERE articles_fts MATCH ?"
+        )
+        params: List[Any] = [expression]
+        if region is not None:
+            sql += " AND a.regions LIKE ?"
+            params.append(f"%,{int(region)},%")
+        if since is not None:
+            sql += " AND a.published >= ?"
+            params.append(since)
+        sql += f" ORDER BY bm25(articles_fts, {', '.join(map(str, BM25_WEIGHTS))}) LIMIT ?"
+        params.append(limit)
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    def _merge_regions(stored: Optional[str], regions: Iterable[int]) -> str:
+        # Stored as ",2,9," so a region can be matched with LIKE '%,2,%'
+        merged = {int(r) for r in (stored or "").split(",") if r} | {int(r) for r in regions}
+        return "," + ",".join(str(r) for r in sorted(merged)) + "," if merged else ""
+
+
+def article_id(item: Dict[str, Any]) -> Optional[str]:
+    return item.get("sophoraId") or item.get("externalId") or item.get("details")
+
+
+def item_regions(item: Dict[str, Any], requested: Optional[int]) -> set:
+    regions = {r for r in item.get("regionIds") or [] if r}
+    if item.get("regionId"):
+        regions.add(item["regionId"])
+    if requested is not None:
+        regions.add(requested)
+    return regions
+
+
+class NewsIngester:
+    """Pulls feeds and article details from `fetch_json` into a `NewsIndex`."""
+
+    def __init__(self, index: NewsIndex, fetch_json: FetchJson, api_url: str, ressorts: List[str],
+                 regions: Optional[List[int]] = None, interval: float = 300.0, max_parallel: int = 6):
+        """
+        `regions`: feeds fetched per region; without, one feed per ressort with the regions the API tags.
+        `interval`: seconds between two ingestion rounds.
+        """
+        self.index = index
+        self.fetch_json = fetch_json
+        self.api_url = api_url
+        self.ressorts = ressorts
+        self.regions = regions or [None]
+        self.interval = interval
+        self.semaphore = asyncio.Semaphore(max_parallel)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                start = time.perf_counter()
+                updated = await self.ingest_once()
+                print(f"Indexed {updated} new or updated articles in {time.perf_counter() - start:.1f}s.")
+            except Exception as e:
+                print(f"Ingesting news failed: {e!r}")
+            await asyncio.sleep(self.interval)
+
+    async def ingest_once(self) -> int:
+        """One round over all feeds. Returns the number of articles added or updated."""
+        feeds = [(ressort, region) for ressort in self.ressorts for region in self.regions]
+        responses = await asyncio.gather(*(self._feed(ressort, region) for ressort, region in feeds))
+
+        items: Dict[str, Dict[str, Any]] = {}
+        regions: Dict[str, set] = {}
+        for (ressort, region), news in zip(feeds, responses):
+            for item in news:
+                item_id = article_id(item)
+                if item_id is None:
+                    continue
+                items.setdefault(item_id, {**item, "ressort": item.get("ressort") or ressort})
+                regions.setdefault(item_id, set()).update(item_regions(item, region))
+        if not items:
+            return 0
+
+        known = await asyncio.to_thread(self.index.known_dates, items)
+        changed = [item_id for item_id, item in items.items() if item_id not in known or known[item_id] != item.get("date")]
+        await asyncio.to_thread(self.index.add_regions, {i: r for i, r in regions.items() if i not in changed})
+
+        articles = await asyncio.gather(*(self._article(i, items[i], regions[i]) for i in changed))
+        await asyncio.to_thread(self.index.upsert, articles)
+        return len(articles)
+
+    async def _feed(self, ressort: str, region: Optional[int]) -> List[Dict[str, Any]]:
+        params = {"ressort": ressort}
+        if region is not None:
+            params["regions"] = str(region)
+        try:
+            async with self.semaphore:
+                data = await self.fetch_json(self.api_url, params=params)
+        except Exception as e:
+            print(f"Fetching the '{ressort}' feed of region {region} failed: {e!r}")
+            return []
+        news = data.get("news") if isinstance(data, dict) else None
+        return news if isinstance(news, list) else []
+
+    async def _article(self, item_id: str, item: Dict[str, Any], regions: set) -> Dict[str, Any]:
+        date = item.get("date")
+        details = {"title": item.get("title"), "topline": item.get("topline"), "text": ""}
+        if item.get("details"):
+            try:
+                async with self.semaphore:
+                    details = extract_article(await self.fetch_json(item["details"]))
+            except Exception as e:
+                print(f"Fetching the details of '{item_id}' failed, indexing the teaser only: {e!r}")
+                # Without a date the details are fetched again next round
+                date = None
+        return {
+            "id": item_id,
+            "date": date,
+            "ressort": item.get("ressort"),
+            "regions": regions,
+            "details": item.get("details"),
+            "title": details.get("title") or item.get("title") or "",
+            "topline": details.get("topline") or item.get("topline") or "",
+            "first_sentence": clean_tagesschau_text(item.get("firstSentence", "")),
+            "text": details.get("text") or "",
+        }
+
+
+def fixture_name(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """File name of a recorded response: the last path segment, plus the sorted query parameters."""
+    normalized = httpx.URL(cache_key(url, params))
+    name = normalized.path.rstrip("/").rsplit("/", 1)[-1] or "index"
+    stem = name[:-len(".json")] if name.endswith(".json") else name
+    query = normalized.query.decode()
+    if query:
+        stem += "-" + re.sub(r"[^\w.=-]", "_", query)
+    return stem + ".json"
+
+
+class FixtureSource:
+    """Serves recorded API responses from a directory instead of the network."""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+
+    async def get_json(self, url: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        path = self.directory / fixture_name(url, params)
+        if not path.exists():
+            raise FileNotFoundError(f"No fixture '{path.name}' for {url}")
+        return json.loads(path.read_text(encoding="utf-8"))
+
+
+class RecordingSource:
+    """Passes requests on to `fetch_json` and writes every response into a fixture directory."""
+
+    def __init__(self, fetch_json: FetchJson, directory: str):
+        self.fetch_json = fetch_json
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    async def get_json(self, url: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        data = await self.fetch_json(url, params=params)
+        path = self.directory / fixture_name(url, params)
+        path.write_text(json.dumps(data, ensure_ascii=False, indent=1), encoding="utf-8")
+        return data
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Ingest Tagesschau news into the search index once and query it.")
+    parser.add_argument("--db", default="news_index.db", help="index file")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--fixtures", help="ingest recorded responses from this directory instead of the API")
+    source.add_argument("--record", help="ingest from the API and record the responses into this directory")
+    parser.add_argument("--regions", type=int, nargs="*", help="fetch the feeds per region")
+    parser.add_argument("--ressorts", nargs="*", default=DEFAULT_RESSORTS)
+    parser.add_argument("--search", help="query to run after ingesting")
+    parser.add_argument("--region", type=int, help="only return articles of this region")
+    args = parser.parse_args()
+
+    index = NewsIndex(args.db)
+    async with NewsHttpClient(headers={"User-Agent": USER_AGENT}) as http_client:
+        if args.fixtures:
+            fetch_json = FixtureSource(args.fixtures).get_json
+        elif args.record:
+            fetch_json = RecordingSource(http_client.get_json, args.record).get_json
+        else:
+            fetch_json = http_client.get_json
+        ingester = NewsIngester(index, fetch_json, API_URL, args.ressorts, args.regions)
+        start = time.perf_counter()
+        updated = await ingester.ingest_once()
+        print(f"Indexed {updated} new or updated articles in {time.perf_counter() - start:.2f}s, "
+              f"{index.count()} in total.")
+
+    if args.search:
+        start = time.perf_counter()
+        results = index.search(args.search, region=args.region)
+        print(f"{len(results)} results in {(time.perf_counter() - start) * 1000:.1f} ms")
+        for result in results:
+            print(f"- {result['date']} [{result['ressort']}] {result['title']}: {result['snippet']}")
+    index.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -5,29 +5,81 @@ Uses Tagesschau public API: https://www.tagesschau.de/api2u/news
 """
 
 from __future__ import annotations
-import httpx
-import html
-import re
-from typing import Any, Dict, List
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Union
 from fastmcp import FastMCP
+from starlette.requests import Request
+from starlette.responses import JSONResponse
 
-API_URL = "https://www.tagesschau.de/api2u/news"
-USER_AGENT = "tagesschau-mcp/1.0"
-MCP_NAME = "tagesschau_news"
-
-mcp = FastMCP(MCP_NAME)
-
+from http_client import NewsHttpClient
+from news_cache import ResponseCache
+from news_index import FixtureSource, NewsIndex, NewsIngester, parse_date
+from tagesschau_api import API_URL, DEFAULT_RESSORTS, USER_AGENT
+from tagesschau_text import clean_tagesschau_text, extract_article
 
-def clean_tagesschau_text(raw_value: str) -> str:
-    """Clean Tagesschau API text (escaped HTML → plain text)."""
-    if not raw_value:
-        return ""
+MCP_NAME = "tagesschau_news"
+# The assistant gives up on a tool call after 10 seconds, a slow ressort is left empty well before that
+RESSORT_DEADLINE = float(os.environ.get("RESSORT_DEADLINE", "5.0"))
+# Upper bound of API requests one tool call has in flight
+MAX_PARALLEL_REQUESTS = 6
+
+# One pooled client for the lifetime of the server, shared by all tools
+http_client = NewsHttpClient(headers={"User-Agent": USER_AGENT}, timeout=15.0)
+# The feeds change every few minutes, repeated questions are answered from memory
+news_cache = ResponseCache(
+    http_client,
+    ttl=float(os.environ.get("NEWS_CACHE_TTL", "120")),
+    stale_ttl=float(os.environ.get("NEWS_CACHE_STALE_TTL", "600")),
+    max_entries=int(os.environ.get("NEWS_CACHE_SIZE", "512")),
+)
+# Local full-text index for search_news, filled in the background
+NEWS_INDEX_PATH = os.environ.get("NEWS_INDEX_PATH", "news_index.db")
+NEWS_INDEX_INTERVAL = float(os.environ.get("NEWS_INDEX_INTERVAL", "300"))
+NEWS_INDEX_REGIONS = [int(r) for r in os.environ.get("NEWS_INDEX_REGIONS", "").split(",") if r.strip()]
+# Ingest recorded responses instead of calling the API, see news_index.py
+NEWS_INDEX_FIXTURES = os.environ.get("NEWS_INDEX_FIXTURES")
+news_index = NewsIndex(NEWS_INDEX_PATH)
+
+
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    async with http_client:
+        ingest_task = None
+        if NEWS_INDEX_INTERVAL > 0:
+            # Not through the response cache: every run would push the article details out of it,
+            # which the tools rely on
+            source = FixtureSource(NEWS_INDEX_FIXTURES).get_json if NEWS_INDEX_FIXTURES else http_client.get_json
+            ingester = NewsIngester(news_index, source, API_URL, DEFAULT_RESSORTS, NEWS_INDEX_REGIONS,
+                                    NEWS_INDEX_INTERVAL, MAX_PARALLEL_REQUESTS)
+            ingest_task = asyncio.create_task(ingester.run())
+        try:
+            yield
+        finally:
+            if ingest_task is not None:
+                ingest_task.cancel()
+            await news_cache.close()
+
+
+mcp = FastMCP(MCP_NAME, lifespan=lifespan)
+
+
+def normalize_regions(regions: Union[int, str, List[int]]) -> str:
+    """Turn one or more region IDs (int, list or comma-separated string) into the sorted, deduplicated API parameter."""
+    if isinstance(regions, int):
+        values = [regions]
+    elif isinstance(regions, str):
+        values = [part for part in regions.split(",") if part.strip()]
+    else:
+        values = list(regions)
     try:
-        decoded = raw_value.encode("utf-8").decode("unicode_escape")
-    except Exception:
-        decoded = raw_value
-    unescaped = html.unescape(decoded)
-    return re.sub(r"<[^>]+>", "", unescaped).strip()
+        ids = sorted({int(str(value).strip()) for value in values})
+    except ValueError:
+        raise ValueError(f"Regions must be integer IDs between 1 and 16, got {regions!r}.")
+    if not ids or ids[0] < 1 or ids[-1] > 16:
+        raise ValueError(f"Regions must be integer IDs between 1 and 16, got {regions!r}.")
+    return ",".join(str(i) for i in ids)
 
 
 @mcp.tool(
@@ -47,13 +99,8 @@ async def fetch_regional_news(regions: str, ressort: str) -> List[Dict[str, Any]
     Fetch news from Tagesschau API filtered by Bundesland and topic.
     Multiple regions can be comma-separated (e.g. "9,8").
     """
-    params = {"regions": regions, "ressort": ressort}
-    headers = {"User-Agent": USER_AGENT}
-
-    async with httpx.AsyncClient() as client:
-        response = await client.get(API_URL, params=params, headers=headers, timeout=15.0)
-        response.raise_for_status()
-        data = response.json()
+    params = {"regions": normalize_regions(regions), "ressort": ressort}
+    data = await news_cache.get_json(API_URL, params=params)
 
     if "news" not in data or not isinstance(data["news"], list):
         return []
@@ -76,37 +123,38 @@ async def fetch_regional_news(regions: str, ressort: str) -> List[Dict[str, Any]
 @mcp.tool(
     name="fetch_default_news_by_ressort",
     description=(
-        "Fetch 3 latest Tagesschau news articles per ressort for a given Bundesland (integer region ID 1–16). "
-        "Each article includes title, date, firstSentence, ressort, and details."
+        "Fetch 3 latest Tagesschau news articles per ressort for a given Bundesland (integer region ID 1–16), "
+        "or for several Bundesländer at once (list of IDs or comma-separated, e.g. \"9,8\"). "
+        "Each article includes title, date, firstSentence, ressort, and details. "
+        "A ressort that cannot be fetched in time is returned empty."
     ),
 )
-async def fetch_default_news_by_ressort(region: int) -> Dict[str, List[Dict[str, Any]]]:
-    """Fetches 3 articles per ressort for a specific Bundesland."""
-    ressorts = ["inland", "ausland", "wirtschaft", "sport", "wissen", "investigativ"]
-    results = {}
-    headers = {"User-Agent": USER_AGENT}
-
-    async with httpx.AsyncClient() as client:
-        for ressort in ressorts:
-            params = {"regions": str(region), "ressort": ressort}
-            try:
-                resp = await client.get(API_URL, params=params, headers=headers, timeout=15.0)
-                resp.raise_for_status()
-                data = resp.json()
-                articles = data.get("news", [])[:3]
-                simplified = [
-                    {
-                        "title": a.get("title"),
-                        "date": a.get("date"),
-                        "firstSentence": clean_tagesschau_text(a.get("firstSentence", "")),
-                        "details": a.get("details"),
-                    }
-                    for a in articles
-                ]
-                results[ressort] = simplified
-            except Exception:
-                results[ressort] = []
-    return results
+async def fetch_default_news_by_ressort(region: Union[int, str, List[int]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Fetches 3 articles per ressort for one or more Bundesländer, all ressorts concurrently."""
+    regions = normalize_regions(region)
+    semaphore = asyncio.Semaphore(MAX_PARALLEL_REQUESTS)
+
+    async def fetch_ressort(ressort: str) -> List[Dict[str, Any]]:
+        params = {"regions": regions, "ressort": ressort}
+        try:
+            async with semaphore:
+                data = await asyncio.wait_for(news_cache.get_json(API_URL, params=params), RESSORT_DEADLINE)
+        except Exception as e:
+            print(f"Ressort '{ressort}' for regions '{regions}' returned empty: {e!r}")
+            return []
+        articles = data.get("news", [])[:3]
+        return [
+            {
+                "title": a.get("title"),
+                "date": a.get("date"),
+                "firstSentence": clean_tagesschau_text(a.get("firstSentence", "")),
+                "details": a.get("details"),
+            }
+            for a in articles
+        ]
+
+    fetched = await asyncio.gather(*(fetch_ressort(ressort) for ressort in DEFAULT_RESSORTS))
+    return dict(zip(DEFAULT_RESSORTS, fetched))
 
 
 @mcp.tool(
@@ -118,29 +166,57 @@ async def fetch_default_news_by_ressort(region: int) -> Dict[str, List[Dict[str,
 )
 async def fetch_article_details(details_url: str) -> Dict[str, Any]:
     """Fetch and clean the article text from a Tagesschau details JSON link."""
-    headers = {"User-Agent": USER_AGENT}
-
-    async with httpx.AsyncClient() as client:
-        response = await client.get(details_url, headers=headers, timeout=15.0)
-        response.raise_for_status()
-        data = response.json()
-
-    content = data.get("content", [])
-    text_parts = []
-    for block in content:
-        if block.get("type") in ("text", "headline"):
-            value = block.get("value", "")
-            clean_value = clean_tagesschau_text(value)
-            if clean_value:
-                text_parts.append(clean_value)
-
-    paragraph = "\n\n".join(text_parts)
-    return {
-        "title": data.get("title"),
-        "date": data.get("date"),
-        "topline": data.get("topline"),
-        "text": paragraph,
-    }
+    data = await news_cache.get_json(details_url)
+    return extract_article(data)
+
+
+@mcp.tool(
+    name="fetch_article_details_batch",
+    description=(
+        "Fetch and clean the detailed content of several Tagesschau articles at once from their 'details' JSON URLs. "
+        "Prefer this over calling fetch_article_details for each article. Returns one entry per URL, in the given order, "
+        "with title, date, topline and text, or an error. Set max_chars_per_article to shorten long texts."
+    ),
+)
+async def fetch_article_details_batch(details_urls: List[str], max_chars_per_article: int = 0) -> List[Dict[str, Any]]:
+    """Fetch the article texts of several details links concurrently."""
+    semaphore = asyncio.Semaphore(MAX_PARALLEL_REQUESTS)
+
+    async def fetch_one(details_url: str) -> Dict[str, Any]:
+        try:
+            async with semaphore:
+                data = await news_cache.get_json(details_url)
+        except Exception as e:
+            return {"details": details_url, "error": f"Fetching the article failed: {e}"}
+        return {"details": details_url, **extract_article(data, max_chars_per_article)}
+
+    # The cache lets duplicate URLs share one request
+    return list(await asyncio.gather(*(fetch_one(url) for url in details_urls)))
+
+@mcp.tool(
+    name="search_news",
+    description=(
+        "Search recent Tagesschau articles by keywords, e.g. \"Bahn Streik\". Use German words, the articles are German. "
+        "Optionally only articles of a Bundesland (integer region ID 1–16) or published since an ISO date "
+        "(e.g. \"2025-01-31\" or \"2025-01-31T08:00:00+01:00\"). Returns the best matches first with title, date, "
+        "ressort, a text snippet around the match, and details."
+    ),
+)
+async def search_news(query: str, region: Optional[int] = None, since: Optional[str] = None,
+                      limit: int = 10) -> List[Dict[str, Any]]:
+    """Ranked snippets from the local article index."""
+    since_time = None
+    if since:
+        since_time = parse_date(since)
+        if since_time is None:
+            raise ValueError(f"'since' must be an ISO date, got {since!r}.")
+    return await asyncio.to_thread(news_index.search, query, region, since_time, max(1, min(limit, 50)))
+
+
+@mcp.custom_route("/cache/stats", methods=["GET"])
+async def cache_stats(request: Request) -> JSONResponse:
+    """Hit, miss and stale counters of the response cache."""
+    return JSONResponse(news_cache.stats())
 
 # Create ASGI application
 # app = mcp.http_app()
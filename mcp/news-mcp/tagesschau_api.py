@@ -0,0 +1,10 @@
+"""
+Endpoint and defaults of the Tagesschau API, shared by the MCP server and the ingest command line.
+"""
+
+import os
+
+# Point TAGESSCHAU_API_URL to a local stand-in server for testing
+API_URL = os.environ.get("TAGESSCHAU_API_URL", "https://www.tagesschau.de/api2u/news")
+USER_AGENT = "tagesschau-mcp/1.0"
+DEFAULT_RESSORTS = ["inland", "ausland", "wirtschaft", "sport", "wissen", "investigativ"]
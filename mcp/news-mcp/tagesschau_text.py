@@ -0,0 +1,59 @@
+"""
+Plain text from Tagesschau API responses, shared by the tools and the search index.
+"""
+
+from __future__ import annotations
+
+import html
+import re
+from typing import Any, Dict
+
+TAG_RE = re.compile(r"<[^>]*>")
+ESCAPE_RE = re.compile(r"\\(?:u[0-9a-fA-F]{4}|[nrt\"'/\\])")
+SIMPLE_ESCAPES = {"n": "\n", "r": "\r", "t": "\t", '"': '"', "'": "'", "/": "/", "\\": "\\"}
+
+
+def _replace_escape(match: re.Match) -> str:
+    token = match.group()
+    if token[1] == "u":
+        return chr(int(token[2:], 16))
+    return SIMPLE_ESCAPES[token[1]]
+
+
+def clean_tagesschau_text(raw_value: str) -> str:
+    """Clean Tagesschau API text (escaped HTML → plain text)."""
+    if not raw_value:
+        return ""
+    # Entities and backslash escapes are rare, their passes only run when there is one.
+    # Both run before the tags are stripped, as they may encode markup themselves.
+    text = raw_value
+    if "\\" in text:
+        text = ESCAPE_RE.sub(_replace_escape, text)
+    if "&" in text:
+        text = html.unescape(text)
+    return TAG_RE.sub("", text).strip()
+
+
+def truncate_text(text: str, max_chars: int) -> str:
+    """Cut `text` at a word boundary to at most `max_chars` characters; 0 keeps it whole."""
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    cut = text.rfind(" ", 0, max_chars)
+    return text[:cut if cut > 0 else max_chars].rstrip() + " …"
+
+
+def extract_article(data: Dict[str, Any], max_chars: int = 0) -> Dict[str, Any]:
+    """Title, date, topline and the plain text of the 'headline' and 'text' blocks of a details response."""
+    text_parts = []
+    for block in data.get("content", []):
+        if block.get("type") in ("text", "headline"):
+            clean_value = clean_tagesschau_text(block.get("value", ""))
+            if clean_value:
+                text_parts.append(clean_value)
+
+    return {
+        "title": data.get("title"),
+        "date": data.get("date"),
+        "topline": data.get("topline"),
+        "text": truncate_text("\n\n".join(text_parts), max_chars),
+    }
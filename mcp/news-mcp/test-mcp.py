@@ -28,5 +28,12 @@ async def test_tools():
         )
         print(f"Details: {result}")
 
+        result = await client.call_tool(
+            "fetch_article_details_batch",
+            {"details_urls": ["https://www.tagesschau.de/api2u/inland/lindner-wechsel-autobranche-100.json"],
+             "max_chars_per_article": 500}
+        )
+        print(f"Details batch: {result}")
+
 if __name__ == "__main__":
     asyncio.run(test_tools())
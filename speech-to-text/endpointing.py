@@ -0,0 +1,98 @@
+"""
+Endpointing for speech-to-text: decides when the user has finished speaking.
+
+Waiting for a final Vosk result and then for a fixed time without new text adds Vosk's
+own endpoint delay on top of the wait. The `Endpointer` instead follows the audio
+itself: a frame-level energy voice activity detector measures the trailing silence,
+and the utterance ends as soon as that silence exceeds the budget. A final result from
+Vosk halves the budget, since the recognizer already closed the segment. All times
+are measured in audio time, so pre-roll audio fed faster than real time is endpointed
+the same way as live audio.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+FRAME_MS = 20
+MIN_NOISE_FLOOR = 10.0
+FLOOR_FALL_RATE = 0.2
+FLOOR_RISE_RATE = 0.002
+
+# Voiced audio needed before an utterance counts as started, so the tail of the wake
+# word in the pre-roll does not start the silence countdown on its own
+MIN_SPEECH = 0.25
+
+END_SILENCE = "silence"
+END_NO_SPEECH = "no speech"
+END_MAX_LENGTH = "max length"
+
+
+class FrameVad:
+    """Energy based voice activity per 20 ms frame with an adaptive noise floor."""
+
+    def __init__(self, sample_rate: int, threshold_db: float = 9.0):
+        self.frame_samples = sample_rate * FRAME_MS // 1000
+        self.ratio = 10 ** (threshold_db / 20)
+        self.noise_floor: float | None = None
+
+    def voiced(self, samples: np.ndarray, adapt: bool = True) -> np.ndarray:
+        """Return one bool per complete frame of `samples`; a trailing partial frame is ignored."""
+        n_frames = len(samples) // self.frame_samples
+        if n_frames == 0:
+            return np.zeros(0, dtype=bool)
+        frames = samples[:n_frames * self.frame_samples].reshape(n_frames, self.frame_samples).astype(np.float32)
+        rms = np.sqrt(np.einsum("ij,ij->i", frames, frames) / self.frame_samples)
+
+        if self.noise_floor is None:
+            self.noise_floor = max(float(rms.min()), MIN_NOISE_FLOOR)
+        voiced = rms > self.noise_floor * self.ratio
+        if adapt:
+            for value in rms[~voiced]:
+                rate = FLOOR_FALL_RATE if value < self.noise_floor else FLOOR_RISE_RATE
+                self.noise_floor = max(self.noise_floor + rate * (float(value) - self.noise_floor), MIN_NOISE_FLOOR)
+        return voiced
+
+
+class Endpointer:
+    """Tracks one utterance and reports why it ended, if it did."""
+
+    def __init__(self, silence_budget: float = 0.5, no_speech_timeout: float = 5.0, max_length: float = 20.0):
+        self.silence_budget = silence_budget
+        self.no_speech_timeout = no_speech_timeout
+        self.max_length = max_length
+        self.reset()
+
+    def reset(self) -> None:
+        self.elapsed = 0.0
+        self.voiced_time = 0.0
+        self.trailing_silence = 0.0
+        self.speech_started = False
+        self.segment_closed = False
+
+    def update(self, voiced: np.ndarray, final: bool, has_text: bool) -> str | None:
+        """
+        Feed the voice activity of the latest chunk and what the recognizer made of it.
+        `final` is set when Vosk closed a segment on this chunk, `has_text` when there is
+        any recognized text so far. Returns one of the END_* reasons once the utterance is over.
+        """
+        frame_seconds = FRAME_MS / 1000
+        self.elapsed += len(voiced) * frame_seconds
+        if voiced.any():
+            self.voiced_time += int(voiced.sum()) * frame_seconds
+            last_voiced = len(voiced) - 1 - int(np.flatnonzero(voiced)[-1])
+            self.trailing_silence = last_voiced * frame_seconds
+        else:
+            self.trailing_silence += len(voiced) * frame_seconds
+        self.speech_started = self.speech_started or has_text or self.voiced_time >= MIN_SPEECH
+        # A segment Vosk closed stays closed until the user speaks again
+        self.segment_closed = final or (self.segment_closed and not voiced.any())
+
+        if not self.speech_started:
+            return END_NO_SPEECH if self.elapsed >= self.no_speech_timeout else None
+        if self.elapsed >= self.max_length:
+            return END_MAX_LENGTH
+        budget = self.silence_budget / 2 if self.segment_closed else self.silence_budget
+        if self.trailing_silence >= budget:
+            return END_SILENCE
+        return None
@@ -0,0 +1,87 @@
+"""
+Fixed-size ring buffer holding the most recent seconds of PCM audio.
+
+Speech-to-text only starts once the wake word event arrives, which is a detector
+inference plus an MQTT hop after the wake word ended. The ring buffer keeps the audio
+of that gap so it can be handed to the recognizer as soon as the event arrives.
+Chunks are indexed by the sequence number and capture timestamp of their audio frame.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+from audio_frame import AudioFrame
+
+SEQUENCE_MASK = 0xFFFFFFFF
+
+
+class PcmRingBuffer:
+    def __init__(self, seconds: float, sample_rate: int, max_chunks: int = 1024):
+        self.samples = np.zeros(int(seconds * sample_rate), dtype=np.int16)
+        # Per chunk: absolute start position in the stream, length, sequence and timestamp
+        self.starts = np.zeros(max_chunks, dtype=np.int64)
+        self.lengths = np.zeros(max_chunks, dtype=np.int64)
+        self.sequences = np.zeros(max_chunks, dtype=np.int64)
+        self.timestamps = np.zeros(max_chunks, dtype=np.int64)
+        self.n_chunks = 0
+        self.written = 0  # total samples ever written
+
+    def append(self, frame: AudioFrame) -> None:
+        samples = frame.samples
+        capacity = len(self.samples)
+        if len(samples) > capacity:
+            samples = samples[-capacity:]
+        n = len(samples)
+
+        start = self.written % capacity
+        first = min(n, capacity - start)
+        self.samples[start:start + first] = samples[:first]
+        self.samples[:n - first] = samples[first:]
+
+        slot = self.n_chunks % len(self.starts)
+        self.starts[slot] = self.written
+        self.lengths[slot] = n
+        # Legacy frames carry no sequence, number them by arrival instead
+        self.sequences[slot] = frame.sequence if frame.sequence is not None else self.n_chunks & SEQUENCE_MASK
+        self.timestamps[slot] = frame.timestamp_ns or 0
+        self.n_chunks += 1
+        self.written += n
+
+    def _available_slots(self) -> np.ndarray:
+        """Slots of the chunks whose audio has not been overwritten yet, oldest first."""
+        count = min(self.n_chunks, len(self.starts))
+        slots = np.arange(self.n_chunks - count, self.n_chunks) % len(self.starts)
+        oldest_sample = self.written - len(self.samples)
+        return slots[self.starts[slots] >= oldest_sample]
+
+    def _read(self, start: int) -> np.ndarray:
+        """Copy of the audio from absolute sample position `start` up to the newest sample."""
+        capacity = len(self.samples)
+        start = max(start, self.written - capacity)
+        n = self.written - start
+        begin = start % capacity
+        if begin + n <= capacity:
+            return self.samples[begin:begin + n].copy()
+        return np.concatenate((self.samples[begin:], self.samples[:begin + n - capacity]))
+
+    def after_sequence(self, sequence: int) -> np.ndarray:
+        """Audio of all buffered chunks captured after the chunk with the given sequence number."""
+        slots = self._available_slots()
+        distance = (self.sequences[slots] - sequence) & SEQUENCE_MASK
+        later = slots[(distance > 0) & (distance <= SEQUENCE_MASK // 2)]
+        if len(later) == 0:
+            return np.zeros(0, dtype=np.int16)
+        return self._read(int(self.starts[later[0]]))
+
+    def after_timestamp(self, timestamp_ns: int) -> np.ndarray:
+        """Audio of all buffered chunks captured after `timestamp_ns`."""
+        slots = self._available_slots()
+        later = slots[self.timestamps[slots] > timestamp_ns]
+        if len(later) == 0:
+            return np.zeros(0, dtype=np.int16)
+        return self._read(int(self.starts[later[0]]))
+
+    def clear(self) -> None:
+        self.n_chunks = 0
+        self.written = 0
@@ -1,88 +1,247 @@
-import numpy as np
+from service_status import StartupTimer
+startup = StartupTimer("speech-to-text")
+
 import argparse
-import paho.mqtt.client as mqtt
-import paho.mqtt.publish as mqtt_publish
-import base64
 import json
-from queue import Queue, Empty
+import os
 import signal
-from threading import Event, Thread
-
-from vosk import Model, KaldiRecognizer
-
-# Create a global event that can be used by other threads
-stop_event = Event()
-client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+import time
+from threading import Event, Lock, Thread
 
-def handle_stop_signals(signum, frame):
-    print(f"Received stop signal, shutting down gracefully...")
-    stop_event.set()
-    client.disconnect()
+with startup.phase("import"):
+    from vosk import Model, KaldiRecognizer
 
-# Register signal handlers
-signal.signal(signal.SIGTERM, handle_stop_signals)
-signal.signal(signal.SIGINT, handle_stop_signals)
+from audio_frame import FrameError
+from endpointing import Endpointer
+from message_bus import connect_bus, in_process
+from stt_sessions import DeviceStream, OrderedExecutor, RecognizerPool, Session
+from tracing import Tracer, wrap_text
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "-m", "--model", type=str, help="language model; e.g. en-us, fr, nl; default is en-us")
 parser.add_argument(
-    "-r", "--samplerate", type=int, help="sampling rate")
+    "--model-path", type=str, default=os.environ.get("VOSK_MODEL_PATH", ""),
+    help="directory of an unpacked Vosk model, loaded instead of looking up --model; default is $VOSK_MODEL_PATH")
+parser.add_argument(
+    "-r", "--samplerate", type=int, default=16000, help="sampling rate; default is 16000")
+parser.add_argument(
+    "--preroll", type=float, default=3.0,
+    help="seconds of audio kept before the wake word event, to recognize speech that started before it arrived")
+parser.add_argument(
+    "--endpoint-silence", type=float, default=0.5,
+    help="seconds of trailing silence after which the instruction is forwarded")
+parser.add_argument(
+    "--no-speech-timeout", type=float, default=5.0,
+    help="seconds to wait for speech after the wake word before giving up")
+parser.add_argument(
+    "--max-utterance", type=float, default=20.0,
+    help="longest instruction in seconds")
+parser.add_argument(
+    "--workers", type=int, default=os.cpu_count() or 1,
+    help="decoding threads; default is the number of CPUs")
+parser.add_argument(
+    "--max-sessions", type=int, default=os.cpu_count() or 1,
+    help="devices that can be transcribed at the same time; default is the number of CPUs")
 args = parser.parse_args()
-        
-if args.model is None:
-    model = Model(lang="en-us")
-else:
-    model = Model(lang=args.model)
+
+with startup.phase("load_model"):
+    if args.model_path:
+        # Skips the lookup of the model by language, which downloads it if it is not in the cache
+        model = Model(model_path=args.model_path)
+    elif args.model is None:
+        model = Model(lang="en-us")
+    else:
+        model = Model(lang=args.model)
 
 broker = "localhost"
 port = 1883
-topic_wakeword = "wakeword/detected"
-topic_audio = "audio/stream"
-topic_instruction = "assistant/instruction"
-
-rec = KaldiRecognizer(model, args.samplerate)
-text_queue = Queue()
-wakeword_event = Event()
-SILENCE_TIME = 0.5
-
-def on_message(client, userdata, msg):
-    msg_topic = str(msg.topic)
-    if msg_topic == topic_audio:
-        if wakeword_event.is_set():
-            decoded_chunk = base64.b64decode(msg.payload)
-            # Get audio
-            audio = bytes(decoded_chunk)
-            if rec.AcceptWaveform(audio):
-                full_result = json.loads(rec.Result())
-                full_result = full_result.get("text", "")
-                if full_result:
-                    text_queue.put(full_result)
-    elif msg_topic == topic_wakeword:
-        if not wakeword_event.is_set():
-            print("Wakeword was detected. Start speech-to-text.")
-            wakeword_event.set()
+# Devices publish on "audio/<device>/stream", the single microphone setup on "audio/stream".
+# Instructions of a device go to "assistant/<device>/instruction", those of the single
+# microphone to "assistant/instruction".
+topic_wakeword = "wakeword/+/detected"
+topic_wakeword_legacy = "wakeword/detected"
+topic_audio = "audio/+/stream"
+topic_audio_legacy = "audio/stream"
+topic_audio_meta = "audio/+/meta"
+topic_audio_meta_legacy = "audio/meta"
+topic_instruction = "assistant/{device}/instruction"
+topic_instruction_legacy = "assistant/instruction"
+topic_instruction_partial = "assistant/{device}/instruction/partial"
+topic_instruction_partial_legacy = "assistant/instruction/partial"
+LEGACY_DEVICE = "default"
+# Endpointing runs on the audio, so a device that stops streaming is checked on the wall clock
+SESSION_CHECK_INTERVAL = 1.0
+END_TIMEOUT = "timeout"
+# Devices without audio and session for this long have their streaming state dropped
+DEVICE_EXPIRY_TIME = 60.0
+
+tracer = Tracer("speech-to-text")
+recognizer_pool = RecognizerPool(lambda: KaldiRecognizer(model, args.samplerate), args.max_sessions)
+with startup.phase("warm_up"):
+    # One second of silence through a recognizer, which then waits in the pool for the first session
+    recognizer_pool.warm_up(bytes(2 * args.samplerate))
+executor = OrderedExecutor(args.workers)
+devices = {}
+devices_lock = Lock()
+stopped = Event()
+
+def device_from_topic(topic):
+    levels = topic.split("/")
+    return levels[1] if len(levels) == 3 else LEGACY_DEVICE
+
+def instruction_topic(device):
+    return topic_instruction_legacy if device == LEGACY_DEVICE else topic_instruction.format(device=device)
+
+def partial_topic(device):
+    return topic_instruction_partial_legacy if device == LEGACY_DEVICE else topic_instruction_partial.format(device=device)
+
+def get_device(device):
+    with devices_lock:
+        stream = devices.get(device)
+        if stream is None:
+            stream = devices[device] = DeviceStream(args.preroll, args.samplerate)
+        return stream
+
+def parse_detection(payload):
+    try:
+        detection = json.loads(payload)
+    except ValueError:
+        detection = None
+    # Legacy detectors publish plain text, without saying where the wake word ended
+    return detection if isinstance(detection, dict) else {}
+
+def audio_after_wakeword(stream, detection):
+    """Buffered audio captured after the chunk the wake word was detected in."""
+    if detection.get("sequence") is not None:
+        return stream.preroll_buffer.after_sequence(detection["sequence"])
+    if detection.get("timestamp_ns") is not None:
+        return stream.preroll_buffer.after_timestamp(detection["timestamp_ns"])
+    return None
+
+def decode_audio(device, samples, voiced):
+    stream = get_device(device)
+    session = stream.session
+    partial, reason = session.accept(samples, voiced)
+    if partial:
+        if not session.partials_published:
+            tracer.mark(bus, session.interaction, "first_partial", device=device)
+        session.partials_published += 1
+        bus.publish(partial_topic(device), wrap_text(partial, session.interaction))
+    if reason is not None:
+        end_session(device, stream, reason)
+
+def end_session(device, stream, reason):
+    session = stream.session
+    text = session.finish()
+    elapsed = session.endpointer.elapsed
+    stream.session = None
+    recognizer_pool.release(session.recognizer)
+    tracer.mark(bus, session.interaction, "endpoint", device=device, reason=reason, utterance_s=elapsed,
+                trailing_silence_s=session.endpointer.trailing_silence)
+    if text:
+        print(f"Utterance on '{device}' ended ({reason} after {elapsed:.2f}s). Forwarding input text: '{text}'")
+        bus.publish(instruction_topic(device), wrap_text(text, session.interaction))
+        tracer.mark(bus, session.interaction, "instruction_published", device=device, characters=len(text))
+    else:
+        print(f"Utterance on '{device}' ended ({reason}) without recognized text.")
+
+def configure_audio(device, payload):
+    try:
+        meta = get_device(device).decoder.configure(payload)
+    except FrameError as e:
+        print(f"Ignoring audio metadata of '{device}': {e}")
+        return
+    print(f"Audio of '{device}': {meta['codec']}, {meta['sample_rate']} Hz, {meta['channels']} channel(s).")
+
+def process_audio(device, payload):
+    stream = get_device(device)
+    try:
+        frame = stream.decoder.decode(payload)
+    except FrameError as e:
+        print(f"Ignoring invalid audio payload from '{device}': {e}")
+        return
+    stream.last_audio = time.monotonic()
+    missed = stream.sequence_tracker.update(frame)
+    if missed:
+        print(f"Missed {missed} audio chunk(s) of '{device}', {stream.sequence_tracker.dropped} in total.")
+    stream.preroll_buffer.append(frame)
+    # The noise floor is tracked all the time so it is settled when the wake word arrives
+    voiced = stream.frame_vad.voiced(frame.samples)
+    if stream.session is not None:
+        decode_audio(device, frame.samples, voiced)
+
+def start_session(device, payload):
+    stream = get_device(device)
+    if stream.session is not None:
+        return
+    recognizer = recognizer_pool.lease()
+    if recognizer is None:
+        print(f"Wakeword was detected on '{device}', but all {recognizer_pool.size} recognizers are busy.")
+        return
+    print(f"Wakeword was detected on '{device}'. Start speech-to-text.")
+    detection = parse_detection(payload)
+    endpointer = Endpointer(args.endpoint_silence, args.no_speech_timeout, args.max_utterance)
+    stream.session = Session(recognizer, endpointer, detection.get("interaction"))
+    tracer.mark(bus, stream.session.interaction, "stt_started", device=device)
+    # Recognize what was said since the wake word ended before the live audio
+    preroll = audio_after_wakeword(stream, detection)
+    if preroll is not None and len(preroll):
+        print(f"Feeding {len(preroll) / args.samplerate:.2f}s of audio recorded before the wake word event.")
+        decode_audio(device, preroll, stream.frame_vad.voiced(preroll, adapt=False))
+
+def check_device(device):
+    """End the session of a device that stopped streaming, and forget devices idle for long."""
+    with devices_lock:
+        stream = devices.get(device)
+    if stream is None:
+        return
+    now = time.monotonic()
+    session = stream.session
+    if session is not None:
+        # A wake word may arrive before the audio of a device that was quiet
+        idle = now - max(stream.last_audio, session.started)
+        if idle >= args.no_speech_timeout or now - session.started >= args.max_utterance:
+            print(f"No audio from '{device}' for {idle:.1f}s, ending its session.")
+            end_session(device, stream, END_TIMEOUT)
+    elif now - stream.last_audio >= DEVICE_EXPIRY_TIME:
+        print(f"No audio from '{device}' since {DEVICE_EXPIRY_TIME:.0f}s, dropping its state.")
+        with devices_lock:
+            devices.pop(device, None)
+
+def watch_sessions():
+    while not stopped.wait(SESSION_CHECK_INTERVAL):
+        with devices_lock:
+            known = list(devices)
+        # Checked on the worker of the device, in order with its audio
+        for device in known:
+            executor.submit(device, check_device, device)
+
+def on_message(msg_topic, payload):
+    device = device_from_topic(msg_topic)
+    if msg_topic.startswith("audio/") and msg_topic.endswith("/meta"):
+        executor.submit(device, configure_audio, device, payload)
+    elif msg_topic.startswith("audio/"):
+        # Decoded on the worker of the device, into the buffer of its decoder
+        executor.submit(device, process_audio, device, payload)
+    elif msg_topic.startswith("wakeword/"):
+        executor.submit(device, start_session, device, payload)
     else:
         print(f"Ignoring message from unknown topic '{msg_topic}'.")
 
-def forward_stt():
-    text = ""
-    while not stop_event.is_set():
-        try:
-            text_part = text_queue.get(timeout=SILENCE_TIME)
-            text += text_part
-        except Empty:
-            if text:
-                print(f"No text from stt since '{SILENCE_TIME}'. Forwarding input text: '{text}'")
-                mqtt_publish.single(topic_instruction, text, hostname=broker, port=port)
-                text = ""
-                wakeword_event.clear()
-
-client.on_message = on_message
-client.connect(broker, port, 60)
-client.subscribe(topic_wakeword)
-client.subscribe(topic_audio)
-forward_stt_thread = Thread(target=forward_stt, daemon=True, name="forward-stt-thread")
-forward_stt_thread.start()
-client.loop_forever()
-forward_stt_thread.join()
\ No newline at end of file
+def handle_stop_signals(signum, frame):
+    print(f"Received stop signal, shutting down gracefully...")
+    bus.stop()
+
+bus = connect_bus(broker, port, will=startup.will())
+# In the single-process launcher, the launcher handles the signals for all stages
+if not in_process():
+    signal.signal(signal.SIGTERM, handle_stop_signals)
+    signal.signal(signal.SIGINT, handle_stop_signals)
+bus.subscribe([topic_wakeword, topic_wakeword_legacy, topic_audio, topic_audio_legacy, topic_audio_meta,
+               topic_audio_meta_legacy], on_message)
+Thread(target=watch_sessions, daemon=True, name="stt-sessions").start()
+bus.publish(*startup.ready(), retain=True, qos=1)
+bus.loop_forever()
+stopped.set()
+executor.shutdown()
@@ -0,0 +1,145 @@
+"""
+Concurrent speech-to-text sessions, one per device that heard its wake word.
+
+All sessions share the loaded Vosk model through a pool of recognizers. Audio is
+decoded on a thread pool instead of the MQTT network thread: the work of one device
+runs strictly in arrival order, while different devices are decoded in parallel
+(Vosk releases the GIL while decoding).
+"""
+
+from __future__ import annotations
+
+import json
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Callable
+
+from audio_frame import FrameDecoder, SequenceTracker
+from endpointing import FrameVad, Endpointer
+from pcm_ring_buffer import PcmRingBuffer
+
+
+class RecognizerPool:
+    """Recognizers created on demand up to `size` and handed to one session at a time."""
+
+    def __init__(self, factory: Callable, size: int):
+        self.factory = factory
+        self.size = size
+        self.idle = []
+        self.created = 0
+        self.lock = Lock()
+
+    def lease(self):
+        """Return an idle recognizer, or None if all `size` recognizers are in use."""
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+            if self.created >= self.size:
+                return None
+            self.created += 1
+        return self.factory()
+
+    def release(self, recognizer) -> None:
+        recognizer.Reset()
+        with self.lock:
+            self.idle.append(recognizer)
+
+    def warm_up(self, pcm: bytes) -> None:
+        """Decode some audio with a new recognizer, so the first session does not pay for the first decode."""
+        recognizer = self.lease()
+        if recognizer is None:
+            return
+        recognizer.AcceptWaveform(pcm)
+        recognizer.FinalResult()
+        self.release(recognizer)
+
+
+class OrderedExecutor:
+    """Runs tasks on a thread pool, in submission order per key and concurrently across keys."""
+
+    def __init__(self, workers: int):
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="stt-worker")
+        # Keys with a drain scheduled or running, with the tasks still waiting
+        self.queues: dict[str, deque] = {}
+        self.lock = Lock()
+
+    def submit(self, key: str, fn: Callable, *args) -> None:
+        with self.lock:
+            queue = self.queues.get(key)
+            if queue is not None:
+                queue.append((fn, args))
+                return
+            self.queues[key] = deque([(fn, args)])
+        self.pool.submit(self._drain, key)
+
+    def _drain(self, key: str) -> None:
+        while True:
+            with self.lock:
+                queue = self.queues[key]
+                if not queue:
+                    del self.queues[key]
+                    return
+                fn, args = queue.popleft()
+            try:
+                fn(*args)
+            except Exception:
+                traceback.print_exc()
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+class Session:
+    """One utterance being transcribed with a leased recognizer."""
+
+    def __init__(self, recognizer, endpointer: Endpointer, interaction: str | None = None):
+        self.recognizer = recognizer
+        self.endpointer = endpointer
+        # Traced interaction the wake word started, if the detector sent one
+        self.interaction = interaction
+        self.started = time.monotonic()
+        self.partials_published = 0
+        # Text of the segments Vosk already finalized, and the last partial hypothesis
+        self.final_texts = []
+        self.last_partial = ""
+
+    def accept(self, samples, voiced) -> tuple[str | None, str | None]:
+        """Decode a chunk. Returns a new partial transcript, if any, and the end reason once the utterance is over."""
+        # Vosk only accepts bytes
+        final = self.recognizer.AcceptWaveform(samples.tobytes())
+        partial_text = None
+        if final:
+            text = json.loads(self.recognizer.Result()).get("text", "")
+            if text:
+                self.final_texts.append(text)
+            self.last_partial = ""
+        else:
+            partial = json.loads(self.recognizer.PartialResult()).get("partial", "")
+            if partial and partial != self.last_partial:
+                partial_text = " ".join(self.final_texts + [partial])
+            self.last_partial = partial
+        reason = self.endpointer.update(voiced, final, bool(self.final_texts or self.last_partial))
+        return partial_text, reason
+
+    def finish(self) -> str:
+        remaining = json.loads(self.recognizer.FinalResult()).get("text", "")
+        if remaining:
+            self.final_texts.append(remaining)
+        return " ".join(self.final_texts)
+
+
+class DeviceStream:
+    """Audio state kept for every device, whether or not a session is active."""
+
+    def __init__(self, preroll: float, sample_rate: int):
+        # Decodes on the worker of the device; every chunk is consumed before the next one
+        self.decoder = FrameDecoder(reuse_buffer=True)
+        self.sequence_tracker = SequenceTracker()
+        self.preroll_buffer = PcmRingBuffer(preroll, sample_rate)
+        self.frame_vad = FrameVad(sample_rate)
+        self.session: Session | None = None
+        # Wall clock of the last decoded chunk, to notice devices that stopped streaming
+        self.last_audio = time.monotonic()
@@ -0,0 +1,88 @@
+"""
+Latency tracing of voice interactions across the MQTT pipeline.
+
+The wake word detector starts an interaction with a new id, which then travels with
+the wake word event, the instruction and the reply sentences. Text payloads carry it
+in a small JSON envelope, {"text": ..., "interaction": ...}; plain text payloads from
+publishers that do not trace are still accepted.
+
+Every stage publishes what happened when on "trace/<stage>":
+
+    {"interaction": "3f2a...", "stage": "speech-to-text", "event": "endpoint",
+     "mono_ns": 123456789, "wall_ns": 1700000000000000000, ...}
+
+`mono_ns` is `time.monotonic_ns()`, which all processes on one host share, so the
+latency collector can subtract the timestamps of different stages. Set VOICE_TRACE=0
+to stop publishing trace events.
+
+Identical copies of this module live in every service that traces.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+import uuid
+
+TRACE_TOPIC = "trace/{stage}"
+TRACE_ENABLED = os.environ.get("VOICE_TRACE", "1") != "0"
+
+
+def new_interaction_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def wrap_text(text: str, interaction: str | None) -> str:
+    """Payload for a text topic; plain text when there is no interaction to carry."""
+    if interaction is None:
+        return text
+    return json.dumps({"text": text, "interaction": interaction}, ensure_ascii=False)
+
+
+def unwrap_text(payload: bytes | str) -> tuple[str, str | None]:
+    """Return (text, interaction id) of an enveloped or plain text payload."""
+    if isinstance(payload, bytes):
+        payload = payload.decode()
+    if payload.startswith("{"):
+        try:
+            envelope = json.loads(payload)
+        except ValueError:
+            envelope = None
+        if isinstance(envelope, dict) and isinstance(envelope.get("text"), str):
+            return envelope["text"], envelope.get("interaction")
+    return payload, None
+
+
+class Tracer:
+    """Builds the trace events of one stage."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.topic = TRACE_TOPIC.format(stage=stage)
+
+    def event(self, interaction: str | None, name: str, **fields) -> tuple[str, str] | None:
+        """Topic and payload of a trace event, or None if there is nothing to trace."""
+        if interaction is None or not TRACE_ENABLED:
+            return None
+        event = {
+            "interaction": interaction,
+            "stage": self.stage,
+            "event": name,
+            "mono_ns": time.monotonic_ns(),
+            "wall_ns": time.time_ns(),
+            **fields,
+        }
+        return self.topic, json.dumps(event)
+
+    def mark(self, client, interaction: str | None, name: str, **fields) -> None:
+        """Publish an event with a paho client or a message bus."""
+        message = self.event(interaction, name, **fields)
+        if message is not None:
+            client.publish(*message)
+
+    async def amark(self, client, interaction: str | None, name: str, **fields) -> None:
+        """Publish an event with an aiomqtt client."""
+        message = self.event(interaction, name, **fields)
+        if message is not None:
+            await client.publish(*message)
@@ -0,0 +1,221 @@
+"""
+Message bus between the stages of the voice pipeline.
+
+Stages publish and subscribe through a bus instead of a paho client, so the same
+script runs as its own process talking to the MQTT broker, or together with the other
+stages in one process (see ../edge), where messages are handed over in memory:
+
+    bus = connect_bus(broker, port)
+    bus.subscribe(["audio/+/stream", "audio/stream"], on_message)   # on_message(topic, payload)
+    bus.publish("wakeword/detected", json.dumps(detection))
+    bus.publish(*startup.ready(), retain=True, qos=1)   # see service_status.py
+    bus.loop_forever()
+
+Over MQTT an `AudioFrame` payload is encoded with `encode_frame`; the in-process bus
+passes it by reference, so the numpy samples are never copied, serialized or decoded.
+`decode_frame` accepts both. Callbacks of one subscription run one after another on a
+thread of their own, like the network thread of a paho client. Retained messages are
+kept by the in-process bus as well and handed to later subscribers.
+
+Keep this file identical in every service that uses it.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import paho.mqtt.client as mqtt
+
+from audio_frame import AudioFrame, encode_frame
+
+Callback = Callable[[str, object], None]
+
+# Set by the single-process launcher; stages started afterwards share it
+_in_process_bus: Optional["LocalBus"] = None
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels) or (level != "+" and level != topic_levels[i]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def connect_bus(host: str = "localhost", port: int = 1883, will: Optional[Tuple[str, str]] = None):
+    """
+    The in-process bus when running in the single-process launcher, an MQTT connection otherwise.
+    `will`: topic and payload the broker publishes, retained, when the connection is lost.
+    """
+    if _in_process_bus is not None:
+        return _in_process_bus
+    return MqttBus(host, port, will=will)
+
+
+def use_in_process_bus(bus: "LocalBus") -> None:
+    global _in_process_bus
+    _in_process_bus = bus
+
+
+def in_process() -> bool:
+    return _in_process_bus is not None
+
+
+class MqttBus:
+    def __init__(self, host: str = "localhost", port: int = 1883, keepalive: int = 60,
+                 will: Optional[Tuple[str, str]] = None):
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        self.client.on_connect = self._on_connect
+        self.topic_filters: List[str] = []
+        self.stopped = threading.Event()
+        self.will = will
+        if will is not None:
+            self.client.will_set(*will, qos=1, retain=True)
+        self.client.connect(host, port, keepalive)
+
+    def subscribe(self, topic_filters: Iterable[str], callback: Callback) -> None:
+        topic_filters = list(topic_filters)
+        for topic_filter in topic_filters:
+            self.client.message_callback_add(
+                topic_filter, lambda client, userdata, msg: callback(msg.topic, msg.payload))
+        self.topic_filters.extend(topic_filters)
+        if self.client.is_connected():
+            self.client.subscribe([(f, 0) for f in topic_filters])
+
+    def publish(self, topic: str, payload, retain: bool = False, qos: int = 0) -> None:
+        if isinstance(payload, AudioFrame):
+            payload = encode_frame(payload.samples, payload.sequence, payload.sample_rate, payload.channels,
+                                   payload.sample_format, payload.timestamp_ns)
+        self.client.publish(topic, payload, qos=qos, retain=retain)
+
+    def start(self) -> None:
+        """Run the network loop on a background thread."""
+        self.client.loop_start()
+
+    def loop_forever(self) -> None:
+        self.client.loop_forever()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        # The broker only publishes the will when the connection is lost, not on a clean disconnect
+        if self.will is not None:
+            self.client.publish(*self.will, qos=1, retain=True)
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        # Subscribing here restores the subscriptions after a reconnect
+        if self.topic_filters:
+            client.subscribe([(f, 0) for f in self.topic_filters])
+
+
+class _Subscription:
+    """Delivers the messages of one subscription in order on its own thread."""
+
+    def __init__(self, topic_filters: List[str], callback: Callback, queue_size: int):
+        self.topic_filters = topic_filters
+        self.callback = callback
+        self.queue = deque(maxlen=queue_size)
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True, name=f"bus-{topic_filters[0]}")
+        self.thread.start()
+
+    def matches(self, topic: str) -> bool:
+        return any(topic_matches(f, topic) for f in self.topic_filters)
+
+    def put(self, topic: str, payload) -> None:
+        with self.condition:
+            # A subscriber that falls behind loses the oldest messages, the publisher never waits
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append((topic, payload))
+            self.condition.notify()
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                topic, payload = self.queue.popleft()
+            try:
+                self.callback(topic, payload)
+            except Exception as e:
+                print(f"Handling a message on '{topic}' failed: {e!r}")
+
+
+class LocalBus:
+    """
+    In-process bus of the single-process launcher. Messages on `export` topics are also
+    published to `bridge`, an `MqttBus`, and messages on `import_` topics arriving there
+    are delivered locally, so stages running elsewhere, like the assistant, still take part.
+    """
+
+    def __init__(self, queue_size: int = 1000, bridge: Optional[MqttBus] = None,
+                 export: Iterable[str] = (), import_: Iterable[str] = ()):
+        self.queue_size = queue_size
+        self.subscriptions: List[_Subscription] = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.started = threading.Semaphore(0)
+        self.bridge = bridge
+        self.export = list(export)
+        self.import_ = list(import_)
+        self.retained: Dict[str, object] = {}
+        if bridge is not None and self.import_:
+            bridge.subscribe(self.import_, self._deliver)
+
+    def subscribe(self, topic_filters: Iterable[str], callback: Callback) -> None:
+        subscription = _Subscription(list(topic_filters), callback, self.queue_size)
+        with self.lock:
+            self.subscriptions = [*self.subscriptions, subscription]
+            retained = list(self.retained.items())
+        for topic, payload in retained:
+            if subscription.matches(topic):
+                subscription.put(topic, payload)
+
+    def publish(self, topic: str, payload, retain: bool = False, qos: int = 0) -> None:
+        if retain:
+            with self.lock:
+                self.retained[topic] = payload
+        self._deliver(topic, payload)
+        # Imported topics are not sent back to where they came from
+        if (self.bridge is not None and any(topic_matches(f, topic) for f in self.export)
+                and not any(topic_matches(f, topic) for f in self.import_)):
+            self.bridge.publish(topic, payload, retain, qos)
+
+    def start(self) -> None:
+        """Called by a stage once it subscribed; lets the launcher start the next stage."""
+        self.started.release()
+
+    def loop_forever(self) -> None:
+        self.start()
+        self.stopped.wait()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        for subscription in self.subscriptions:
+            subscription.close()
+        if self.bridge is not None:
+            self.bridge.stop()
+
+    def dropped(self) -> int:
+        return sum(s.dropped for s in self.subscriptions)
+
+    def _deliver(self, topic: str, payload) -> None:
+        for subscription in self.subscriptions:
+            if subscription.matches(topic):
+                subscription.put(topic, payload)
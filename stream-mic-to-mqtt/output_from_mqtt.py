@@ -1,10 +1,12 @@
 import pyaudio
 import paho.mqtt.client as mqtt
-import base64
+
+from audio_frame import FrameDecoder, FrameError, SequenceTracker
 
 broker = "localhost"
 port = 1883
 topic = "audio/stream"
+topic_meta = "audio/meta"
 
 # Audio playback setup
 CHUNK = 1024
@@ -19,14 +21,33 @@ stream = p.open(format=FORMAT,
                 output=True,
                 frames_per_buffer=CHUNK)
 
+sequence_tracker = SequenceTracker()
+# Every chunk is played before the next one is decoded
+frame_decoder = FrameDecoder(reuse_buffer=True)
+
 def on_message(client, userdata, msg):
-    decoded = base64.b64decode(msg.payload)
-    stream.write(decoded)
+    if msg.topic == topic_meta:
+        try:
+            meta = frame_decoder.configure(msg.payload)
+        except FrameError as e:
+            print(f"Ignoring audio metadata: {e}")
+            return
+        print(f"Audio stream: {meta['codec']}, {meta['sample_rate']} Hz, {meta['channels']} channel(s).")
+        return
+    try:
+        frame = frame_decoder.decode(msg.payload)
+    except FrameError as e:
+        print(f"Ignoring invalid audio payload: {e}")
+        return
+    missed = sequence_tracker.update(frame)
+    if missed:
+        print(f"Missed {missed} audio chunk(s), {sequence_tracker.dropped} in total.")
+    stream.write(frame.pcm_bytes())
 
 client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
 client.on_message = on_message
 client.connect(broker, port, 60)
-client.subscribe(topic)
+client.subscribe([(topic, 0), (topic_meta, 0)])
 
 print("🎧 Listening to stream...")
 client.loop_forever()
\ No newline at end of file
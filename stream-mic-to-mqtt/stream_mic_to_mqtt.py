@@ -1,15 +1,30 @@
+import argparse
+import numpy as np
 import pyaudio
-import paho.mqtt.client as mqtt
-import base64
+import time
+
+from audio_frame import AudioFrame, CODECS, FrameEncoder, OPUS_BITRATE, SAMPLE_FORMAT_S16LE
+from message_bus import connect_bus, in_process
 
 # MQTT setup
 # broker = "192.168.178.41"   # or your broker
 broker = "localhost"   # or your broker
 port = 1883
 topic = "audio/stream"
+topic_meta = "audio/meta"
 
-client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
-client.connect(broker, port, 60)
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--device", type=str, default="",
+    help="name of this microphone, e.g. 'kitchen'; publishes on 'audio/<device>/stream' instead of 'audio/stream'")
+parser.add_argument(
+    "--codec", choices=list(CODECS), default="pcm",
+    help="compression of the published audio: pcm (32 KB/s), mulaw or alaw (16 KB/s), opus (about 3 KB/s, needs opuslib)")
+parser.add_argument("--opus-bitrate", type=int, default=OPUS_BITRATE, help="bits per second of the Opus stream")
+args = parser.parse_args()
+if args.device:
+    topic = f"audio/{args.device}/stream"
+    topic_meta = f"audio/{args.device}/meta"
 
 # Audio setup
 CHUNK = 1280        # Number of frames per buffer
@@ -17,6 +32,13 @@ FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 16000        # Sample rate
 
+bus = connect_bus(broker, port)
+bus.start()
+# Frames handed over in memory by the in-process bus are never compressed
+encoder = FrameEncoder("pcm" if in_process() else args.codec, RATE, CHANNELS, args.opus_bitrate)
+# Retained, so consumers that subscribe later know the codec before the first chunk
+bus.publish(topic_meta, encoder.meta(CHUNK), retain=True, qos=1)
+
 p = pyaudio.PyAudio()
 stream = p.open(format=FORMAT,
                 channels=CHANNELS,
@@ -26,16 +48,22 @@ stream = p.open(format=FORMAT,
 
 print("🎙️ Streaming audio... Press Ctrl+C to stop.")
 
+sequence = 0
 try:
-    while True:
+    while not bus.stopped.is_set():
         data = stream.read(CHUNK, exception_on_overflow=False)
-        # Encode as base64 to avoid raw binary MQTT issues
-        encoded = base64.b64encode(data).decode("utf-8")
-        client.publish(topic, encoded)
+        # The read returns once the last sample of the chunk was captured
+        capture_ns = time.time_ns() - CHUNK * 1_000_000_000 // RATE
+        samples = np.frombuffer(data, dtype="<i2")
+        if in_process():
+            bus.publish(topic, AudioFrame(samples, RATE, CHANNELS, SAMPLE_FORMAT_S16LE, sequence, capture_ns))
+        else:
+            bus.publish(topic, encoder.encode(samples, sequence, capture_ns))
+        sequence += 1
 except KeyboardInterrupt:
     print("\n🛑 Stopping stream...")
 
 stream.stop_stream()
 stream.close()
 p.terminate()
-client.disconnect()
+bus.stop()
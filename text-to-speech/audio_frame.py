@@ -0,0 +1,402 @@
+"""
+Binary framing for PCM chunks published on the audio stream topics.
+
+A frame is a fixed little-endian header followed by the raw audio bytes:
+
+    offset  size  field
+    0       4     magic b"\\x89KPA" (the first byte never occurs in base64 text)
+    4       1     version
+    5       1     header size in bytes (24 for version 1)
+    6       1     sample format of the payload (see SAMPLE_FORMAT_*)
+    7       1     channel count
+    8       4     sample rate in Hz
+    12      4     sequence number (wraps at 2**32)
+    16      8     capture timestamp, nanoseconds since the epoch
+
+The payload is raw 16 bit PCM, G.711 μ-law or A-law (one byte per sample, half the
+bandwidth) or Opus (a length-prefixed Opus packet per OPUS_FRAME_MS, about a tenth).
+Publishers encode with a `FrameEncoder` and announce the codec, sample rate and chunk
+size of a stream with a retained `stream_meta` message, on `audio/<device>/meta` next
+to `audio/<device>/stream`. Consumers keep a `FrameDecoder` per stream, which prepares
+its buffers and Opus state from that message.
+
+Decoded frames always carry 16 bit PCM samples. For PCM payloads they are a read-only
+`np.frombuffer` view on the MQTT payload, so decoding does not copy; compressed
+payloads are decoded with lookup tables or libopus, into a buffer the decoder reuses if
+asked to. Frames handed over in memory by the in-process message bus are returned as
+they are. Payloads without the magic are treated as the legacy base64 text format and
+are still accepted while publishers are being migrated.
+
+Keep this file identical in every service that produces or consumes audio frames.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import json
+import struct
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
+FRAME_MAGIC = b"\x89KPA"
+FRAME_VERSION = 1
+
+SAMPLE_FORMAT_S16LE = 1
+SAMPLE_FORMAT_MULAW = 2
+SAMPLE_FORMAT_ALAW = 3
+SAMPLE_FORMAT_OPUS = 4
+
+# Codec names used on the command line and in the stream metadata
+CODECS = {
+    "pcm": SAMPLE_FORMAT_S16LE,
+    "mulaw": SAMPLE_FORMAT_MULAW,
+    "alaw": SAMPLE_FORMAT_ALAW,
+    "opus": SAMPLE_FORMAT_OPUS,
+}
+CODEC_NAMES = {sample_format: name for name, sample_format in CODECS.items()}
+
+# Duration of one Opus packet; a chunk must hold a whole number of them
+OPUS_FRAME_MS = 20
+OPUS_BITRATE = 24000
+
+_HEADER = struct.Struct("<4sBBBBIIQ")
+HEADER_SIZE = _HEADER.size
+_OPUS_LENGTH = struct.Struct("<H")
+
+_PCM_DTYPE = np.dtype("<i2")
+_SAMPLE_DTYPES = {
+    SAMPLE_FORMAT_S16LE: _PCM_DTYPE,
+    SAMPLE_FORMAT_MULAW: np.dtype("u1"),
+    SAMPLE_FORMAT_ALAW: np.dtype("u1"),
+}
+
+# Defaults assumed for legacy base64 payloads, which carry no metadata
+LEGACY_SAMPLE_RATE = 16000
+LEGACY_CHANNELS = 1
+
+
+class FrameError(ValueError):
+    """Raised when a payload is neither a valid frame nor legacy base64 audio."""
+
+
+@dataclass(frozen=True)
+class AudioFrame:
+    samples: np.ndarray
+    sample_rate: int
+    channels: int
+    sample_format: int
+    sequence: int | None = None
+    timestamp_ns: int | None = None
+
+    @property
+    def is_legacy(self) -> bool:
+        return self.sequence is None
+
+    @property
+    def duration_s(self) -> float:
+        return len(self.samples) / (self.sample_rate * self.channels)
+
+    def pcm_bytes(self) -> bytes:
+        """Raw little-endian PCM, e.g. for consumers that only accept `bytes`."""
+        return self.samples.tobytes()
+
+
+# G.711 as in the ITU reference implementation: segment ends of the 14 bit μ-law and
+# 13 bit A-law magnitudes
+_MULAW_SEGMENT_ENDS = np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF])
+_ALAW_SEGMENT_ENDS = np.array([0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF])
+
+
+@lru_cache(maxsize=None)
+def _g711_encode_table(sample_format: int) -> np.ndarray:
+    """Code of every 16 bit sample, indexed by the sample as unsigned 16 bit integer."""
+    pcm = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.int32)
+    if sample_format == SAMPLE_FORMAT_MULAW:
+        pcm >>= 2
+        mask = np.where(pcm < 0, 0x7F, 0xFF)
+        magnitude = np.minimum(np.abs(pcm), 8159) + 33
+        segment = np.searchsorted(_MULAW_SEGMENT_ENDS, magnitude)
+        code = np.where(segment > 7, 0x7F, (segment << 4) | ((magnitude >> (segment + 1)) & 0x0F))
+    else:
+        pcm >>= 3
+        mask = np.where(pcm < 0, 0x55, 0xD5)
+        magnitude = np.where(pcm < 0, -pcm - 1, pcm)
+        segment = np.searchsorted(_ALAW_SEGMENT_ENDS, magnitude)
+        code = (segment << 4) | ((magnitude >> np.maximum(segment, 1)) & 0x0F)
+    return (code ^ mask).astype(np.uint8)
+
+
+@lru_cache(maxsize=None)
+def _g711_decode_table(sample_format: int) -> np.ndarray:
+    """16 bit sample of every code."""
+    code = np.arange(256, dtype=np.int32)
+    if sample_format == SAMPLE_FORMAT_MULAW:
+        code = ~code
+        magnitude = (((code & 0x0F) << 3) + 0x84) << ((code >> 4) & 0x07)
+        pcm = np.where(code & 0x80, 0x84 - magnitude, magnitude - 0x84)
+    else:
+        code = code ^ 0x55
+        segment = (code >> 4) & 0x07
+        magnitude = ((code & 0x0F) << 4) + np.where(segment == 0, 8, 0x108)
+        magnitude <<= np.maximum(segment - 1, 0)
+        pcm = np.where(code & 0x80, magnitude, -magnitude)
+    return pcm.astype(_PCM_DTYPE)
+
+
+def _output(out: np.ndarray | None, n: int, dtype) -> np.ndarray:
+    if out is None:
+        return np.empty(n, dtype=dtype)
+    if len(out) < n:
+        raise ValueError(f"Output buffer of {len(out)} samples is too small for {n}.")
+    return out[:n]
+
+
+def g711_encode(samples: np.ndarray, sample_format: int, out: np.ndarray | None = None) -> np.ndarray:
+    """μ-law or A-law codes of 16 bit samples, one table lookup per sample."""
+    return np.take(_g711_encode_table(sample_format), samples.astype(_PCM_DTYPE, copy=False).view(np.uint16),
+                   out=_output(out, len(samples), np.uint8))
+
+
+def g711_decode(codes: np.ndarray, sample_format: int, out: np.ndarray | None = None) -> np.ndarray:
+    """16 bit samples of μ-law or A-law codes, written to `out` if given."""
+    return np.take(_g711_decode_table(sample_format), codes, out=_output(out, len(codes), _PCM_DTYPE))
+
+
+def encode_frame(
+    pcm: bytes | bytearray | memoryview,
+    sequence: int,
+    sample_rate: int,
+    channels: int = 1,
+    sample_format: int = SAMPLE_FORMAT_S16LE,
+    timestamp_ns: int | None = None,
+) -> bytes:
+    """Prefix audio bytes, already in `sample_format`, with a frame header."""
+    if timestamp_ns is None:
+        timestamp_ns = time.time_ns()
+    header = _HEADER.pack(
+        FRAME_MAGIC,
+        FRAME_VERSION,
+        HEADER_SIZE,
+        sample_format,
+        channels,
+        sample_rate,
+        sequence & 0xFFFFFFFF,
+        timestamp_ns,
+    )
+    return header + bytes(pcm)
+
+
+def _parse_frame(payload: bytes | bytearray | memoryview) -> tuple:
+    if len(payload) < HEADER_SIZE:
+        raise FrameError(f"Truncated frame header ({len(payload)} bytes).")
+    (_, version, header_size, sample_format, channels, sample_rate,
+     sequence, timestamp_ns) = _HEADER.unpack_from(payload)
+    if version > FRAME_VERSION or header_size < HEADER_SIZE:
+        raise FrameError(f"Unsupported frame version {version} with a {header_size} byte header.")
+    if header_size > len(payload):
+        raise FrameError(f"Header size {header_size} is beyond the end of the {len(payload)} byte frame.")
+    if sample_format not in CODEC_NAMES:
+        raise FrameError(f"Unsupported sample format {sample_format}.")
+    dtype = _SAMPLE_DTYPES.get(sample_format)
+    if dtype is not None and (len(payload) - header_size) % dtype.itemsize:
+        raise FrameError(f"Audio of {len(payload) - header_size} bytes is not a whole number of samples.")
+    return header_size, sample_format, channels, sample_rate, sequence, timestamp_ns
+
+
+def _decode_legacy(payload: bytes | bytearray | memoryview) -> AudioFrame:
+    try:
+        pcm = base64.b64decode(payload, validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise FrameError(f"Payload is neither an audio frame nor base64: {e}") from e
+    if len(pcm) % _PCM_DTYPE.itemsize:
+        raise FrameError(f"Base64 audio of {len(pcm)} bytes is not a whole number of samples.")
+    samples = np.frombuffer(pcm, dtype=_PCM_DTYPE)
+    return AudioFrame(samples, LEGACY_SAMPLE_RATE, LEGACY_CHANNELS, SAMPLE_FORMAT_S16LE)
+
+
+def decode_frame(payload: bytes | bytearray | memoryview | AudioFrame,
+                 out: np.ndarray | None = None) -> AudioFrame:
+    """Decode a framed or legacy base64 payload into an `AudioFrame`.
+
+    G.711 payloads are decoded into `out` if given, Opus payloads need a `FrameDecoder`.
+    """
+    if isinstance(payload, AudioFrame):
+        return payload
+    if bytes(payload[:4]) != FRAME_MAGIC:
+        return _decode_legacy(payload)
+    header_size, sample_format, channels, sample_rate, sequence, timestamp_ns = _parse_frame(payload)
+    if sample_format == SAMPLE_FORMAT_OPUS:
+        raise FrameError("Opus frames can only be decoded by a FrameDecoder.")
+    samples = np.frombuffer(payload, dtype=_SAMPLE_DTYPES[sample_format], offset=header_size)
+    if sample_format != SAMPLE_FORMAT_S16LE:
+        samples = g711_decode(samples, sample_format, out)
+    return AudioFrame(samples, sample_rate, channels, SAMPLE_FORMAT_S16LE, sequence, timestamp_ns)
+
+
+def stream_meta(codec: str, sample_rate: int, channels: int, chunk_samples: int) -> str:
+    """Retained metadata message of an audio stream, published on `audio/<device>/meta`."""
+    return json.dumps({"codec": codec, "sample_rate": sample_rate, "channels": channels,
+                       "chunk_samples": chunk_samples})
+
+
+def _opus_frame_samples(sample_rate: int) -> int:
+    return sample_rate * OPUS_FRAME_MS // 1000
+
+
+class FrameEncoder:
+    """Encodes the chunks of one stream with a codec; Opus keeps state between chunks."""
+
+    def __init__(self, codec: str, sample_rate: int, channels: int = 1, opus_bitrate: int = OPUS_BITRATE):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec '{codec}', known are {', '.join(CODECS)}.")
+        self.codec = codec
+        self.sample_format = CODECS[codec]
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.codes = np.empty(0, dtype=np.uint8)
+        self.opus = None
+        if self.sample_format == SAMPLE_FORMAT_OPUS:
+            # Imported only for Opus streams; needs libopus
+            import opuslib
+            self.opus = opuslib.Encoder(sample_rate, channels, opuslib.APPLICATION_VOIP)
+            self.opus.bitrate = opus_bitrate
+
+    def meta(self, chunk_samples: int) -> str:
+        return stream_meta(self.codec, self.sample_rate, self.channels, chunk_samples)
+
+    def encode(self, samples: np.ndarray, sequence: int, timestamp_ns: int | None = None) -> bytes:
+        """A frame of interleaved 16 bit samples."""
+        if self.sample_format == SAMPLE_FORMAT_S16LE:
+            payload = samples.astype(_PCM_DTYPE, copy=False)
+        elif self.opus is None:
+            if len(self.codes) < len(samples):
+                self.codes = np.empty(len(samples), dtype=np.uint8)
+            payload = g711_encode(samples, self.sample_format, self.codes)
+        else:
+            payload = self._encode_opus(samples)
+        return encode_frame(payload, sequence, self.sample_rate, self.channels, self.sample_format, timestamp_ns)
+
+    def _encode_opus(self, samples: np.ndarray) -> bytes:
+        step = _opus_frame_samples(self.sample_rate) * self.channels
+        if len(samples) % step:
+            raise ValueError(f"Opus needs chunks of a multiple of {OPUS_FRAME_MS} ms, got {len(samples)} samples.")
+        pcm = samples.astype(_PCM_DTYPE, copy=False).tobytes()
+        packets = []
+        for offset in range(0, len(pcm), step * 2):
+            packet = self.opus.encode(pcm[offset:offset + step * 2], step // self.channels)
+            packets.append(_OPUS_LENGTH.pack(len(packet)) + packet)
+        return b"".join(packets)
+
+
+class FrameDecoder:
+    """Decodes the frames of one stream.
+
+    With `reuse_buffer`, compressed payloads are decoded into a buffer kept by the
+    decoder, so the samples of a frame are only valid until the next frame is decoded;
+    use it where every chunk is consumed before the next one is decoded.
+    """
+
+    def __init__(self, reuse_buffer: bool = False):
+        self.reuse_buffer = reuse_buffer
+        self.buffer = np.empty(0, dtype=_PCM_DTYPE)
+        self.meta: dict = {}
+        self.opus = None
+        self.opus_format: tuple | None = None
+
+    def configure(self, payload: bytes | bytearray | str) -> dict:
+        """Prepare for the stream described by a `stream_meta` message and return it."""
+        try:
+            meta = json.loads(payload)
+            sample_format = CODECS[meta["codec"]]
+            sample_rate, channels = int(meta["sample_rate"]), int(meta.get("channels", 1))
+            chunk_samples = int(meta.get("chunk_samples", 0))
+        except (ValueError, TypeError, KeyError) as e:
+            raise FrameError(f"Invalid stream metadata: {e!r}") from e
+        if self.reuse_buffer and sample_format != SAMPLE_FORMAT_S16LE:
+            self._buffer(chunk_samples * channels)
+        # A new stream, e.g. after the publisher restarted
+        self.opus = None
+        if sample_format == SAMPLE_FORMAT_OPUS:
+            self._opus(sample_rate, channels)
+        self.meta = meta
+        return meta
+
+    def decode(self, payload: bytes | bytearray | memoryview | AudioFrame) -> AudioFrame:
+        if isinstance(payload, AudioFrame) or bytes(payload[:4]) != FRAME_MAGIC:
+            return decode_frame(payload)
+        header_size, sample_format, channels, sample_rate, sequence, timestamp_ns = _parse_frame(payload)
+        if sample_format == SAMPLE_FORMAT_S16LE:
+            return decode_frame(payload)
+        if sample_format == SAMPLE_FORMAT_OPUS:
+            samples = self._decode_opus(memoryview(payload)[header_size:], sample_rate, channels)
+        else:
+            codes = np.frombuffer(payload, dtype=np.uint8, offset=header_size)
+            samples = g711_decode(codes, sample_format, self._buffer(len(codes)) if self.reuse_buffer else None)
+        return AudioFrame(samples, sample_rate, channels, SAMPLE_FORMAT_S16LE, sequence, timestamp_ns)
+
+    def _buffer(self, n: int) -> np.ndarray:
+        if len(self.buffer) < n:
+            self.buffer = np.empty(n, dtype=_PCM_DTYPE)
+        return self.buffer
+
+    def _opus(self, sample_rate: int, channels: int) -> "opuslib.Decoder":
+        if self.opus is None or self.opus_format != (sample_rate, channels):
+            try:
+                import opuslib
+            except ImportError as e:
+                raise FrameError(f"Opus streams need opuslib and libopus: {e}") from e
+            self.opus = opuslib.Decoder(sample_rate, channels)
+            self.opus_format = (sample_rate, channels)
+        return self.opus
+
+    def _decode_opus(self, data: memoryview, sample_rate: int, channels: int) -> np.ndarray:
+        decoder = self._opus(sample_rate, channels)
+        step = _opus_frame_samples(sample_rate)
+        packets = []
+        offset = 0
+        while offset < len(data):
+            if offset + _OPUS_LENGTH.size > len(data):
+                raise FrameError("Truncated Opus packet length.")
+            (length,) = _OPUS_LENGTH.unpack_from(data, offset)
+            offset += _OPUS_LENGTH.size
+            packets.append(bytes(data[offset:offset + length]))
+            offset += length
+        total = len(packets) * step * channels
+        samples = self._buffer(total) if self.reuse_buffer else np.empty(total, dtype=_PCM_DTYPE)
+        n = 0
+        for packet in packets:
+            try:
+                pcm = np.frombuffer(decoder.decode(packet, step), dtype=_PCM_DTYPE)
+            except Exception as e:
+                raise FrameError(f"Invalid Opus packet: {e}") from e
+            samples[n:n + len(pcm)] = pcm
+            n += len(pcm)
+        return samples[:n]
+
+
+class SequenceTracker:
+    """Counts chunks lost between a publisher and this consumer."""
+
+    def __init__(self):
+        self.expected: int | None = None
+        self.received = 0
+        self.dropped = 0
+
+    def update(self, frame: AudioFrame) -> int:
+        """Record a frame and return how many chunks were missed right before it."""
+        self.received += 1
+        if frame.sequence is None:
+            return 0
+        missed = 0
+        if self.expected is not None:
+            gap = (frame.sequence - self.expected) & 0xFFFFFFFF
+            # A large gap means the publisher restarted, not that we lost 4 billion chunks
+            if gap < 0x80000000:
+                missed = gap
+        self.dropped += missed
+        self.expected = (frame.sequence + 1) & 0xFFFFFFFF
+        return missed
@@ -0,0 +1,146 @@
+"""
+Lock-free single-producer/single-consumer float32 ring buffer in shared memory.
+
+The synthesis process writes samples straight into the ring and the sounddevice
+callback of the playback process reads them straight into the output buffer, so audio
+is neither pickled nor concatenated on its way to the speaker. Each side only ever
+advances its own index: the producer owns the write index, the consumer the read
+index, and both indices only grow, so `write - read` is the number of samples waiting.
+
+A flush (barge-in) is requested by the producer and carried out by the consumer on
+its next read, which skips everything written before the request.
+"""
+
+from __future__ import annotations
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# int64 header slots in front of the samples
+CAPACITY = 0
+WRITE = 1         # producer
+READ = 2          # consumer
+FLUSH_SEQ = 3     # producer, incremented for every flush request
+FLUSH_TO = 4      # producer, write index at the time of the latest flush request
+IDLE_AT = 5       # producer, write index at which the producer has nothing more to say for now
+OVERRUNS = 6      # producer
+UNDERRUNS = 7     # consumer
+FLUSHED = 8       # consumer, samples dropped by flushes
+HEADER_SLOTS = 16
+HEADER_BYTES = HEADER_SLOTS * 8
+
+
+class SharedAudioRing:
+    """Create one with `create` in the parent process and `attach` to it by name in the children."""
+
+    def __init__(self, shm: shared_memory.SharedMemory):
+        self.shm = shm
+        self.header = np.ndarray((HEADER_SLOTS,), dtype=np.int64, buffer=shm.buf)
+        self.capacity = int(self.header[CAPACITY])
+        self.data = np.ndarray((self.capacity,), dtype=np.float32, buffer=shm.buf, offset=HEADER_BYTES)
+        # Producer side state
+        self.stalled = False
+        # Consumer side state
+        self.seen_flush = int(self.header[FLUSH_SEQ])
+        self.starving = False
+
+    @classmethod
+    def create(cls, capacity: int) -> "SharedAudioRing":
+        shm = shared_memory.SharedMemory(create=True, size=HEADER_BYTES + capacity * 4)
+        header = np.ndarray((HEADER_SLOTS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[CAPACITY] = capacity
+        del header
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name: str) -> "SharedAudioRing":
+        return cls(shared_memory.SharedMemory(name=name))
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def available(self) -> int:
+        return int(self.header[WRITE]) - int(self.header[READ])
+
+    def stats(self) -> dict:
+        return {
+            "buffered": self.available(),
+            "overruns": int(self.header[OVERRUNS]),
+            "underruns": int(self.header[UNDERRUNS]),
+            "flushed": int(self.header[FLUSHED]),
+        }
+
+    # Producer side ----------------------------------------------------
+
+    def write(self, samples: np.ndarray) -> int:
+        """
+        Copy as many samples as fit into the ring; returns how many. Finding the ring too full
+        counts as one overrun, however often the producer retries until it has room again.
+        """
+        write = int(self.header[WRITE])
+        free = self.capacity - (write - int(self.header[READ]))
+        n = min(len(samples), free)
+        stalled = n < len(samples)
+        if stalled and not self.stalled:
+            self.header[OVERRUNS] += 1
+        self.stalled = stalled
+        if n > 0:
+            start = write % self.capacity
+            first = min(n, self.capacity - start)
+            self.data[start:start + first] = samples[:first]
+            self.data[:n - first] = samples[first:n]
+            # Publish the samples only after they are in place
+            self.header[WRITE] = write + n
+        return n
+
+    def idle(self) -> None:
+        """Tell the consumer that running dry after the samples written so far is expected, not an underrun."""
+        self.header[IDLE_AT] = self.header[WRITE]
+
+    def flush(self) -> None:
+        """Drop everything written so far that has not been played yet."""
+        write = self.header[WRITE]
+        self.header[IDLE_AT] = write
+        self.header[FLUSH_TO] = write
+        self.header[FLUSH_SEQ] += 1
+
+    # Consumer side ----------------------------------------------------
+
+    def read_into(self, out: np.ndarray) -> int:
+        """Fill `out` with the next samples and silence after them; returns the number of real samples."""
+        flush_seq = int(self.header[FLUSH_SEQ])
+        read = int(self.header[READ])
+        if flush_seq != self.seen_flush:
+            self.seen_flush = flush_seq
+            target = int(self.header[FLUSH_TO])
+            if target > read:
+                self.header[FLUSHED] += target - read
+                read = target
+                self.header[READ] = read
+
+        write = int(self.header[WRITE])
+        n = min(write - read, len(out))
+        if n > 0:
+            start = read % self.capacity
+            first = min(n, self.capacity - start)
+            out[:first] = self.data[start:start + first]
+            out[first:n] = self.data[:n - first]
+            self.header[READ] = read + n
+        out[n:] = 0
+
+        # Running dry before the producer said it is done means it could not keep up
+        starving = n < len(out) and int(self.header[IDLE_AT]) != write
+        if starving and not self.starving:
+            self.header[UNDERRUNS] += 1
+        self.starving = starving
+        return n
+
+    def close(self) -> None:
+        del self.header, self.data
+        self.shm.close()
+
+    def unlink(self) -> None:
+        self.shm.unlink()
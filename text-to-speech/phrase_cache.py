@@ -0,0 +1,189 @@
+"""
+Content-addressed cache of synthesized phrases.
+
+The welcome message, the assistant's error reply and common short answers are spoken
+over and over. Their audio is kept under a key derived from the text, voice, speed,
+language and the hash of the model file, so a changed model or voice never plays stale
+audio. Two tiers: an LRU in memory, bounded by bytes, and float32 `.npy` files on disk
+that are memory-mapped when loaded. A hit skips the ONNX inference entirely.
+
+Short phrases are kept in memory after their first synthesis and written to disk once
+they come up a second time. Prewarm the disk tier from a phrase list, one per line:
+
+    uv run phrase_cache.py phrases.txt
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+
+import numpy as np
+
+# Longer texts are one-off sentences, not phrases
+MAX_PHRASE_CHARS = 120
+MAX_DISK_ENTRIES = 1000
+
+
+def file_digest(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class PhraseCache:
+    """Thread safe; pieces finished by the synthesis pool are stored from its result thread."""
+
+    def __init__(self, directory: str, model_path: str, sample_rate: int = 24000, memory_bytes: int = 64 << 20):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.model_hash = file_digest(model_path)
+        self.sample_rate = sample_rate
+        self.memory_bytes = memory_bytes
+        self.memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.memory_used = 0
+        # Phrases synthesized once; the second time they are asked for they are written to disk
+        self.seen: set[str] = set()
+        self.persisted: set[str] = set()
+        self.lock = Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def key(self, text: str, voice: str, speed: float, lang: str) -> str:
+        material = json.dumps([text.strip(), voice, speed, lang, self.model_hash])
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def cacheable(self, text: str) -> bool:
+        return len(text) <= MAX_PHRASE_CHARS
+
+    def get(self, text: str, voice: str, speed: float, lang: str) -> Optional[np.ndarray]:
+        if not self.cacheable(text):
+            return None
+        key = self.key(text, voice, speed, lang)
+        with self.lock:
+            samples = self.memory.get(key)
+            if samples is not None:
+                self.memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                persist = key not in self.persisted
+        if samples is not None:
+            if persist:
+                self._write(key, samples)
+            return samples
+        path = self.directory / f"{key}.npy"
+        try:
+            samples = np.load(path, mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            with self.lock:
+                self.counters["misses"] += 1
+            return None
+        with self.lock:
+            self.counters["disk_hits"] += 1
+            self.persisted.add(key)
+            self._remember(key, samples)
+        return samples
+
+    def put(self, text: str, voice: str, speed: float, lang: str, samples: np.ndarray,
+            persist: bool = False) -> None:
+        """Store freshly synthesized audio. It goes to disk when `persist` is set or the phrase was seen before."""
+        if not self.cacheable(text):
+            return
+        key = self.key(text, voice, speed, lang)
+        samples = np.asarray(samples, dtype=np.float32)
+        with self.lock:
+            self._remember(key, samples)
+            persist = persist or key in self.seen
+            self.seen.add(key)
+        if persist:
+            self._write(key, samples)
+
+    def preload(self) -> int:
+        """
+        Read the newest phrases from disk into memory, up to the memory budget, so the
+        first plays after a restart do not wait for page faults. Returns how many were loaded.
+        """
+        files = sorted(self.directory.glob("*.npy"), key=lambda p: p.stat().st_mtime, reverse=True)
+        loaded = 0
+        for path in files:
+            try:
+                samples = np.load(path)
+            except (OSError, ValueError):
+                continue
+            with self.lock:
+                if self.memory_used + samples.nbytes > self.memory_bytes:
+                    break
+                self.persisted.add(path.stem)
+                self._remember(path.stem, samples)
+            loaded += 1
+        return loaded
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {**self.counters, "memory_entries": len(self.memory), "memory_bytes": self.memory_used}
+
+    def _remember(self, key: str, samples: np.ndarray) -> None:
+        if key in self.memory:
+            self.memory_used -= self.memory.pop(key).nbytes
+        self.memory[key] = samples
+        self.memory_used += samples.nbytes
+        while self.memory_used > self.memory_bytes and len(self.memory) > 1:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_used -= evicted.nbytes
+
+    def _write(self, key: str, samples: np.ndarray) -> None:
+        with self.lock:
+            self.persisted.add(key)
+        path = self.directory / f"{key}.npy"
+        if path.exists():
+            return
+        # Written under a temporary name, so a reader never maps a half written file
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, samples)
+        os.replace(tmp, path)
+        self._prune()
+
+    def _prune(self) -> None:
+        files = sorted(self.directory.glob("*.npy"), key=lambda p: p.stat().st_mtime)
+        for path in files[:max(0, len(files) - MAX_DISK_ENTRIES)]:
+            path.unlink(missing_ok=True)
+
+
+def main():
+    from kokoro_onnx import Kokoro
+
+    parser = argparse.ArgumentParser(description="Synthesize phrases into the on-disk cache.")
+    parser.add_argument("phrases", help="text file with one phrase per line")
+    parser.add_argument("--cache-dir", default=os.environ.get("TTS_CACHE_DIR", "phrase-cache"))
+    parser.add_argument("--model", default="kokoro-v1.0.int8.onnx")
+    parser.add_argument("--voices", default="voices-v1.0.bin")
+    parser.add_argument("--voice", default="af_heart")
+    parser.add_argument("--speed", type=float, default=0.8)
+    parser.add_argument("--lang", default="en-us")
+    args = parser.parse_args()
+
+    cache = PhraseCache(args.cache_dir, args.model)
+    kokoro = Kokoro(args.model, args.voices)
+    phrases = [line.strip() for line in Path(args.phrases).read_text(encoding="utf-8").splitlines() if line.strip()]
+    for phrase in phrases:
+        if not cache.cacheable(phrase):
+            print(f"Skipping '{phrase[:40]}...', longer than {MAX_PHRASE_CHARS} characters.")
+            continue
+        if cache.get(phrase, args.voice, args.speed, args.lang) is not None:
+            print(f"Cached already: '{phrase}'")
+            continue
+        samples, sample_rate = kokoro.create(phrase, voice=args.voice, speed=args.speed, lang=args.lang)
+        cache.put(phrase, args.voice, args.speed, args.lang, samples, persist=True)
+        print(f"Cached {len(samples) / sample_rate:.1f}s: '{phrase}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Splitting replies for a fast start of playback, and timing of the synthesis.
+
+The pool workers stream every piece back per phoneme batch, but Kokoro batches up to
+510 phonemes, so the first batch of a long reply still takes a while. Longer replies
+are therefore also cut after their first clause: the short first piece is ready quickly
+and plays while the rest is still being rendered by another worker.
+"""
+
+from __future__ import annotations
+
+import re
+import time
+from typing import List
+
+import numpy as np
+
+# Clause ends where the first piece of a reply may be cut off
+CLAUSE_END_RE = re.compile(r"[,;:—–]\s+|\.\s+|[!?]\s+")
+# The first piece is at least this long, so it does not sound clipped...
+MIN_FIRST_CHUNK = 20
+# ...and a reply shorter than this is synthesized in one piece anyway
+SPLIT_ABOVE = 80
+
+
+def split_first_clause(text: str) -> List[str]:
+    """Split `text` after its first clause, if that gives a reasonably short first piece."""
+    if len(text) <= SPLIT_ABOVE:
+        return [text]
+    for match in CLAUSE_END_RE.finditer(text, MIN_FIRST_CHUNK):
+        if match.end() >= SPLIT_ABOVE:
+            break
+        return [text[:match.end()].strip(), text[match.end():].strip()]
+    return [text]
+
+
+class ReplyTiming:
+    """Measures time-to-first-audio and the real-time factor of one reply."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.received = time.perf_counter()
+        self.first_audio: float | None = None
+        self.audio_seconds = 0.0
+
+    def chunk(self, samples: np.ndarray, sample_rate: int) -> None:
+        if self.first_audio is None:
+            self.first_audio = time.perf_counter() - self.received
+        self.audio_seconds += len(samples) / sample_rate
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self.received
+        first = f"{self.first_audio * 1000:.0f} ms" if self.first_audio is not None else "-"
+        rtf = elapsed / self.audio_seconds if self.audio_seconds else 0.0
+        return (f"Time to first audio {first}, {self.audio_seconds:.1f}s of audio for {len(self.text)} characters "
+                f"synthesized in {elapsed:.2f}s (real-time factor {rtf:.2f}).")
+
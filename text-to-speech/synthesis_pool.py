@@ -0,0 +1,210 @@
+"""
+Parallel Kokoro synthesis with ordered reassembly.
+
+A single Kokoro instance renders the sentences of a reply one after another, while the
+other cores sit idle. `SynthesisPool` runs several worker processes that each load the
+ONNX model once; `OrderedSynthesizer` numbers every piece of text it submits and hands
+the rendered audio back strictly in that order, however the workers finish.
+
+Workers render a piece with `create_stream` and send every phoneme batch back through a
+shared queue as soon as it is rendered, so the first chunk of a piece plays while the
+rest of it is still being synthesized.
+
+Workers times ONNX Runtime intra-op threads should not exceed the CPU count, otherwise
+the workers only slow each other down.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import multiprocessing as mp
+import os
+import threading
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Optional
+
+import numpy as np
+
+# on_chunk(samples, sample_rate, error) of `SynthesisPool.submit`
+ChunkCallback = Callable[[Optional[np.ndarray], int, Optional[BaseException]], None]
+
+# Set in every worker process by `_load_model`
+_kokoro = None
+_chunks = None
+
+
+def default_workers(intra_op_threads: int) -> int:
+    return max(1, (os.cpu_count() or 1) // max(1, intra_op_threads))
+
+
+def _load_model(model_path: str, voices_path: str, intra_op_threads: int, chunks: mp.Queue) -> None:
+    global _kokoro, _chunks
+    _chunks = chunks
+    import onnxruntime as ort
+    from kokoro_onnx import Kokoro
+
+    if intra_op_threads > 0 and hasattr(Kokoro, "from_session"):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        _kokoro = Kokoro.from_session(session, voices_path)
+    else:
+        _kokoro = Kokoro(model_path, voices_path)
+
+
+def _synthesize(job: int, text: str, voice: str, speed: float, lang: str) -> int:
+    """Send the audio of `text` as (job, samples, sample_rate) chunks, then (job, None, 0); returns the chunk count."""
+
+    async def stream() -> int:
+        count = 0
+        async for samples, sample_rate in _kokoro.create_stream(text, voice=voice, speed=speed, lang=lang):
+            _chunks.put((job, np.asarray(samples, dtype=np.float32), sample_rate))
+            count += 1
+        return count
+
+    count = asyncio.run(stream())
+    _chunks.put((job, None, 0))
+    return count
+
+
+class SynthesisPool:
+    """Kokoro worker processes, each with its own copy of the model."""
+
+    def __init__(self, model_path: str, voices_path: str, workers: int, intra_op_threads: int):
+        self.workers = workers
+        context = mp.get_context("spawn")
+        self.chunks = context.Queue()
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_load_model,
+            initargs=(model_path, voices_path, intra_op_threads, self.chunks),
+        )
+        # Chunk callbacks of the jobs in flight, by job number
+        self.streams: dict[int, ChunkCallback] = {}
+        self.next_job = 0
+        self.reader = threading.Thread(target=self._read_chunks, daemon=True, name="synthesis-chunks")
+        self.reader.start()
+
+    def submit(self, text: str, voice: str, speed: float, lang: str,
+               on_chunk: Optional[ChunkCallback] = None) -> Future:
+        """
+        Synthesize `text` in a worker. `on_chunk(samples, sample_rate, None)` is called from
+        the reader thread for every chunk as it arrives, then once with samples None: with
+        the error if the job failed or was cancelled, otherwise with None.
+        """
+        job = self.next_job
+        self.next_job += 1
+        if on_chunk is not None:
+            self.streams[job] = on_chunk
+        future = self.executor.submit(_synthesize, job, text, voice, speed, lang)
+        # A failed or cancelled job never sends its end of stream
+        future.add_done_callback(lambda done: self._finish(job, done))
+        return future
+
+    def _finish(self, job: int, future: Future) -> None:
+        if future.cancelled() or future.exception() is not None:
+            on_chunk = self.streams.pop(job, None)
+            if on_chunk is not None:
+                on_chunk(None, 0, CancelledError() if future.cancelled() else future.exception())
+
+    def _read_chunks(self) -> None:
+        while True:
+            item = self.chunks.get()
+            if item is None:
+                return
+            job, samples, sample_rate = item
+            # Chunks of warm-up and dropped jobs have no callback
+            on_chunk = self.streams.get(job) if samples is not None else self.streams.pop(job, None)
+            if on_chunk is not None:
+                on_chunk(samples, sample_rate, None)
+
+    async def warm_up(self, voice: str, speed: float, lang: str, text: str = "Hello.") -> None:
+        """
+        Synthesize a word once per worker. The workers are started and load the model on
+        the first submit; the first synthesis in a worker is much slower than later ones.
+        """
+        futures = [self.submit(text, voice, speed, lang) for _ in range(self.workers)]
+        await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.chunks.put(None)
+
+
+@dataclass
+class Piece:
+    sequence: int
+    text: str
+    future: Future
+    # (samples, sample_rate, None) as the pool renders them, (None, 0, error) when the piece is done
+    chunks: asyncio.Queue
+    # Anything the caller wants back with the audio, e.g. which reply the piece belongs to
+    tag: object = None
+
+
+class OrderedSynthesizer:
+    """Submits text to the pool as numbered pieces and yields their audio in submission order."""
+
+    def __init__(self, pool: SynthesisPool, voice: str, speed: float, lang: str, cache=None):
+        """`cache`: a `PhraseCache` consulted before, and filled after, the pool synthesizes a piece."""
+        self.pool = pool
+        self.cache = cache
+        self.voice = voice
+        self.speed = speed
+        self.lang = lang
+        self.next_sequence = 0
+        self.pending: asyncio.Queue[Piece] = asyncio.Queue()
+
+    def submit(self, text: str, tag: object = None) -> int:
+        """Start synthesizing `text` right away; returns its sequence number."""
+        chunks = asyncio.Queue()
+        piece = Piece(self.next_sequence, text, self._synthesize(text, chunks), chunks, tag)
+        self.next_sequence += 1
+        self.pending.put_nowait(piece)
+        return piece.sequence
+
+    async def results(self) -> AsyncIterator[tuple[Piece, Optional[np.ndarray], int]]:
+        """
+        Yield (piece, samples, sample_rate) for every chunk as soon as it is rendered, piece
+        by piece in sequence order, and (piece, None, 0) once a piece is done or has failed.
+        """
+        while True:
+            piece = await self.pending.get()
+            while True:
+                samples, sample_rate, error = await piece.chunks.get()
+                if samples is None:
+                    break
+                yield piece, samples, sample_rate
+            if error is not None:
+                print(f"Synthesis of piece {piece.sequence} failed: {error!r}")
+            yield piece, None, 0
+
+    def _synthesize(self, text: str, chunks: asyncio.Queue) -> Future:
+        if self.cache is not None:
+            samples = self.cache.get(text, self.voice, self.speed, self.lang)
+            if samples is not None:
+                chunks.put_nowait((samples, self.cache.sample_rate, None))
+                chunks.put_nowait((None, 0, None))
+                future = Future()
+                future.set_result(1)
+                return future
+
+        loop = asyncio.get_running_loop()
+        rendered = []
+
+        def on_chunk(samples: Optional[np.ndarray], sample_rate: int, error: Optional[BaseException]) -> None:
+            # Called from the reader thread of the pool; only complete pieces are cached
+            if samples is not None:
+                rendered.append(samples)
+            elif self.cache is not None and error is None and rendered:
+                self.cache.put(text, self.voice, self.speed, self.lang, np.concatenate(rendered))
+            loop.call_soon_threadsafe(chunks.put_nowait, (samples, sample_rate, error))
+
+        return self.pool.submit(text, self.voice, self.speed, self.lang, on_chunk)
+
+    def cancel(self) -> None:
+        """Drop all pieces not yet handed out; those not yet started are never synthesized."""
+        while not self.pending.empty():
+            self.pending.get_nowait().future.cancel()
@@ -1,105 +1,237 @@
-import queue
 import multiprocessing as mp
-import sounddevice as sd
-import numpy as np
-from kokoro_onnx import Kokoro
-from aiomqtt import Client
 import asyncio
+import contextlib
+import os
+import threading
 import time
 
+import numpy as np
+
+from audio_ring import SharedAudioRing
+from message_bus import connect_bus, in_process
+from service_status import StartupTimer
+from phrase_cache import PhraseCache
+from streaming_synthesis import ReplyTiming, split_first_clause
+from synthesis_pool import OrderedSynthesizer, SynthesisPool, default_workers
+from tracing import Tracer, unwrap_text
+
 broker = "localhost"
 port = 1883
+# Replies to the single microphone setup and to the devices, "assistant/<device>/reply"
 topic_reply = "assistant/reply"
+topic_device_reply = "assistant/+/reply"
+# The assistant publishes on "<reply topic>/cancel" when a newer instruction replaced the reply being spoken
+topic_reply_cancel = "assistant/reply/cancel"
+topic_device_reply_cancel = "assistant/+/reply/cancel"
 
 # --------------------------------------------------------
 AUDIO_RATE = 24000
-CHUNK_MS = 400
-AUDIO_CHUNK_SAMPLES = AUDIO_RATE * CHUNK_MS // 1000
+# Samples the sound card asks for per callback, about 21 ms
+BLOCK_SIZE = 512
+# Audio the synthesis can run ahead of playback
+RING_SECONDS = 30
+STATS_INTERVAL = 10.0
+# "null" plays into the void at real-time pace, for benchmarks and hosts without a sound card
+AUDIO_OUTPUT = os.environ.get("TTS_AUDIO_OUTPUT", "sounddevice")
 
 WELCOME_MESSAGE = "Hello, I am your personal home assistant."
+VOICE = "af_heart"
+SPEED = 0.8
+LANG = "en-us"
+# Model files are looked up next to this script, wherever it is started from
+HERE = os.path.dirname(os.path.abspath(__file__))
 
+tracer = Tracer("text-to-speech")
 
-# --------------------------------------------------------
-async def audio_playback_process(audio_queue: mp.Queue, stop_flag: mp.Event):
-    sd.default.samplerate = AUDIO_RATE
-    sd.default.channels = 1
-    sd.default.dtype = "float32"
 
-    stream = sd.OutputStream(blocksize=1024)
+# --------------------------------------------------------
+class NullOutputStream:
+    """Calls the output callback at the pace of the sound card, without one."""
+
+    def __init__(self, samplerate, blocksize, callback):
+        self.period = blocksize / samplerate
+        self.outdata = np.zeros((blocksize, 1), dtype=np.float32)
+        self.callback = callback
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="null-output")
+
+    def _run(self):
+        deadline = time.monotonic()
+        while not self.stopped.is_set():
+            self.callback(self.outdata, len(self.outdata), None, None)
+            deadline += self.period
+            self.stopped.wait(max(0.0, deadline - time.monotonic()))
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def close(self):
+        pass
+
+
+def audio_playback_process(ring_name: str, stop_flag: mp.Event):
+    ring = SharedAudioRing.attach(ring_name)
+
+    def callback(outdata, frames, time_info, status):
+        # Reads straight from shared memory into the sound card buffer
+        ring.read_into(outdata[:, 0])
+
+    if AUDIO_OUTPUT == "null":
+        stream = NullOutputStream(AUDIO_RATE, BLOCK_SIZE, callback)
+    else:
+        import sounddevice as sd
+        stream = sd.OutputStream(samplerate=AUDIO_RATE, channels=1, dtype="float32",
+                                 blocksize=BLOCK_SIZE, latency="low", callback=callback)
     stream.start()
 
-    buffer = np.zeros(0, dtype=np.float32)
-
-    while not stop_flag.is_set():
-        try:
-            (samples, sample_rate) = audio_queue.get(timeout=0.1)
-            print("Got new audio for output.")
-            if samples is not None:
-                buffer = np.concatenate([buffer, samples])
-        except queue.Empty:
-            pass
-
-        if len(buffer) >= AUDIO_CHUNK_SAMPLES:
-            time.sleep(0.4)
-            to_play = buffer[:AUDIO_CHUNK_SAMPLES]
-            buffer = buffer[AUDIO_CHUNK_SAMPLES:]
-            stream.write(to_play)
-            
-        if len(buffer) > 0:
-            stream.write(buffer)
-            buffer = np.zeros(0, dtype=np.float32)
+    last_stats = None
+    while not stop_flag.wait(STATS_INTERVAL):
+        stats = ring.stats()
+        if stats != last_stats:
+            print(f"Playback: {stats['buffered']} samples buffered, {stats['underruns']} underruns, "
+                  f"{stats['overruns']} overruns, {stats['flushed']} samples flushed.")
+            last_stats = stats
 
     stream.stop()
     stream.close()
+    ring.close()
 
 # --------------------------------------------------------
-async def text_to_speech(audio_queue: mp.Queue):
-    async with Client(broker, port=port) as client:
-        # kokoro = Kokoro("kokoro-v1.0.onnx", "voices-v1.0.bin")
-        kokoro = Kokoro("kokoro-v1.0.int8.onnx", "voices-v1.0.bin")
-        # kokoro = Kokoro("kokoro-v1.0.fp16.onnx", "voices-v1.0.bin")
-        samples, sample_rate = kokoro.create(WELCOME_MESSAGE,
-                voice="af_heart",
-                speed=0.8,
-                lang="en-us",)
-        audio_queue.put((samples, sample_rate))
-        await client.subscribe(topic_reply)
-
-        async for message in client.messages:
-            assistant_reply = message.payload.decode()
-            samples, sample_rate = kokoro.create(
-                assistant_reply,
-                voice="af_heart",
-                speed=0.8,
-                lang="en-us",
-            )
-            audio_queue.put((samples, sample_rate))
+def submit_reply(synthesizer: OrderedSynthesizer, text: str, interaction: str | None = None):
+    timing = ReplyTiming(text)
+    # The first clause is rendered on its own, so playback starts before the rest is done
+    pieces = split_first_clause(text)
+    for i, piece in enumerate(pieces):
+        synthesizer.submit(piece, tag=(timing, i == len(pieces) - 1, interaction))
+
+
+async def play_in_order(synthesizer: OrderedSynthesizer, ring: SharedAudioRing, bus):
+    heard = None
+    async for piece, samples, sample_rate in synthesizer.results():
+        timing, last, interaction = piece.tag
+        if samples is not None:
+            timing.chunk(samples, sample_rate)
+            if interaction is not None and interaction != heard:
+                heard = interaction
+                # Audio still buffered ahead of this reply delays when it is actually heard
+                tracer.mark(bus, interaction, "first_audio", buffered_ms=round(ring.available() * 1000 / AUDIO_RATE))
+            # Wait for room while the ring is full, without blocking the event loop
+            written = ring.write(samples)
+            while written < len(samples):
+                await asyncio.sleep(BLOCK_SIZE / AUDIO_RATE)
+                written += ring.write(samples[written:])
+            continue
+        # The piece is complete
+        if last:
+            print(timing.report())
+            # Lets benchmarks relate the synthesized audio to the CPU time spent on it
+            tracer.mark(bus, interaction, "sentence_synthesized", audio_s=timing.audio_seconds,
+                        characters=len(timing.text))
+        if synthesizer.pending.empty():
+            ring.idle()
+
+
+async def text_to_speech(ring_name: str):
+    startup = StartupTimer("text-to-speech")
+    ring = SharedAudioRing.attach(ring_name)
+    intra_op_threads = int(os.environ.get("TTS_INTRA_OP_THREADS", "2"))
+    workers = int(os.environ.get("TTS_WORKERS", "0")) or default_workers(intra_op_threads)
+    print(f"Starting {workers} synthesis workers with {intra_op_threads} ONNX Runtime threads each.")
+    # model = "kokoro-v1.0.onnx"
+    model = os.path.join(HERE, "kokoro-v1.0.int8.onnx")
+    # model = "kokoro-v1.0.fp16.onnx"
+    pool = SynthesisPool(model, os.path.join(HERE, "voices-v1.0.bin"), workers, intra_op_threads)
+    with startup.phase("load_model"):
+        await pool.warm_up(VOICE, SPEED, LANG)
+    # Fixed prompts and frequent short replies are played from the cache without synthesis
+    with startup.phase("phrase_cache"):
+        cache = PhraseCache(os.environ.get("TTS_CACHE_DIR", os.path.join(HERE, "phrase-cache")), model, AUDIO_RATE,
+                            int(os.environ.get("TTS_CACHE_MEMORY_MB", "64")) << 20)
+        print(f"Preloaded {cache.preload()} cached phrases.")
+    synthesizer = OrderedSynthesizer(pool, VOICE, SPEED, LANG, cache)
+
+    # Bus callbacks run on the bus thread; the messages are handled on the event loop
+    loop = asyncio.get_running_loop()
+    messages = asyncio.Queue()
+    bus = connect_bus(broker, port, will=startup.will())
+    bus.subscribe([topic_reply, topic_device_reply, topic_reply_cancel, topic_device_reply_cancel],
+                  lambda topic, payload: loop.call_soon_threadsafe(messages.put_nowait, (topic, payload)))
+    bus.start()
+    bus.publish(*startup.ready(), retain=True, qos=1)
+    # None ends the loop once the bus is stopped, e.g. by the single-process launcher
+    threading.Thread(target=lambda: bus.stopped.wait() or loop.call_soon_threadsafe(messages.put_nowait, None),
+                     daemon=True, name="bus-stopped").start()
+    try:
+        submit_reply(synthesizer, WELCOME_MESSAGE)
+        player = asyncio.create_task(play_in_order(synthesizer, ring, bus))
+        received = None
+
+        while (message := await messages.get()) is not None:
+            topic, payload = message
+            if topic.endswith("/cancel"):
+                synthesizer.cancel()
+                player.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await player
+                print("Dropping audio of a cancelled reply.")
+                ring.flush()
+                player = asyncio.create_task(play_in_order(synthesizer, ring, bus))
+                continue
+            text, interaction = unwrap_text(payload)
+            if interaction is not None and interaction != received:
+                received = interaction
+                tracer.mark(bus, interaction, "reply_received", characters=len(text))
+            submit_reply(synthesizer, text, interaction)
+    finally:
+        pool.shutdown()
 
 
 # --------------------------------------------------------
 # PROCESS WRAPPER (sync)
 # --------------------------------------------------------
-def tts_process_main(audio_queue: mp.Queue):
-    asyncio.run(text_to_speech(audio_queue))
-
-def audio_playback_process_main(audio_queue: mp.Queue, stop_flag: mp.Event):
-    asyncio.run(audio_playback_process(audio_queue, stop_flag))
+def tts_process_main(ring_name: str):
+    asyncio.run(text_to_speech(ring_name))
+
+def audio_playback_process_main(ring_name: str, stop_flag: mp.Event):
+    audio_playback_process(ring_name, stop_flag)
+
+def run_in_process():
+    """In the single-process launcher, synthesis runs on this thread and playback on another."""
+    ring = SharedAudioRing.create(AUDIO_RATE * RING_SECONDS)
+    stop_flag = threading.Event()
+    playback = threading.Thread(target=audio_playback_process, args=(ring.name, stop_flag),
+                                daemon=True, name="audio-playback")
+    playback.start()
+    try:
+        asyncio.run(text_to_speech(ring.name))
+    finally:
+        stop_flag.set()
+        playback.join()
+        ring.close()
+        ring.unlink()
 
 # --------------------------------------------------------
-if __name__ == "__main__":
+if __name__ == "__main__" and in_process():
+    run_in_process()
+elif __name__ == "__main__":
     mp.set_start_method("spawn")
 
-    audio_queue = mp.Queue(maxsize=10)
+    ring = SharedAudioRing.create(AUDIO_RATE * RING_SECONDS)
     stop_flag = mp.Event()
 
-    tts_p = mp.Process(target=tts_process_main, args=(audio_queue,))
+    tts_p = mp.Process(target=tts_process_main, args=(ring.name,))
     audio_p = mp.Process(target=audio_playback_process_main,
-                         args=(audio_queue, stop_flag))
+                         args=(ring.name, stop_flag))
 
     tts_p.start()
     audio_p.start()
 
     tts_p.join()
     stop_flag.set()
-    audio_queue.put((None, None))
     audio_p.join()
+    ring.close()
+    ring.unlink()
@@ -0,0 +1,141 @@
+"""
+Batched openWakeWord inference for many audio streams sharing one model.
+
+`openwakeword.model.Model` keeps its streaming buffers (raw audio, melspectrogram,
+embeddings, predictions) inside the model object, so serving several microphones
+with it means one model copy per microphone. `BatchedWakeWordModel` keeps those
+buffers per device instead and runs the melspectrogram and embedding models once per
+batch of 80 ms steps from all devices, mirroring what `Model.predict` does for a
+single stream.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict, deque
+from functools import partial
+
+import numpy as np
+import openwakeword
+from openwakeword.model import Model
+
+STEP_SAMPLES = 1280             # 80 ms @ 16 kHz, one embedding frame per step
+MELSPEC_CONTEXT_SAMPLES = 160 * 3
+MELSPEC_WINDOW = 76             # melspectrogram frames per embedding
+MELSPEC_MAX_FRAMES = 10 * 97
+FEATURE_MAX_FRAMES = 120
+WARMUP_FRAMES = 5               # predictions are zeroed until this many frames were seen
+
+
+class DeviceState:
+    """Streaming buffers of one audio source."""
+
+    def __init__(self, initial_features: np.ndarray, vad: openwakeword.VAD | None):
+        # Silence before the first chunk. Like the ones/random starting buffers of
+        # `AudioFeatures` this only influences the scores of the first ~2 seconds.
+        self.context = np.zeros(MELSPEC_CONTEXT_SAMPLES, dtype=np.int16)
+        self.pending = np.zeros(0, dtype=np.int16)
+        self.melspectrogram_buffer = np.ones((MELSPEC_WINDOW, 32), dtype=np.float32)
+        self.feature_buffer = initial_features.copy()
+        self.prediction_buffer = defaultdict(partial(deque, maxlen=30))
+        self.vad = vad
+
+    def push(self, samples: np.ndarray) -> None:
+        self.pending = np.concatenate((self.pending, samples)) if len(self.pending) else samples
+
+    def has_step(self) -> bool:
+        return len(self.pending) >= STEP_SAMPLES
+
+    def pop_step(self) -> np.ndarray:
+        step = self.pending[:STEP_SAMPLES]
+        self.pending = self.pending[STEP_SAMPLES:]
+        return step
+
+
+class BatchedWakeWordModel:
+    """Runs one loaded openWakeWord `Model` over the audio of many devices."""
+
+    def __init__(self, model: Model):
+        self.model = model
+        self.preprocessor = model.preprocessor
+        # Set when the melspectrogram model runs on onnxruntime, which accepts a batch dimension
+        self.batch_melspectrogram = hasattr(self.preprocessor, "onnx_execution_provider")
+        # Embeddings of random audio, the same starting point `AudioFeatures` uses
+        self.initial_features = self.preprocessor.feature_buffer.copy()
+        self.devices: dict[str, DeviceState] = {}
+
+    def device(self, device_id: str) -> DeviceState:
+        state = self.devices.get(device_id)
+        if state is None:
+            vad = openwakeword.VAD() if self.model.vad_threshold > 0 else None
+            state = DeviceState(self.initial_features, vad)
+            self.devices[device_id] = state
+        return state
+
+    def remove_device(self, device_id: str) -> None:
+        self.devices.pop(device_id, None)
+
+    def warm_up(self, steps: int = 3) -> None:
+        """Run the models on silence, so the first real chunk does not pay for ONNX Runtime's first run."""
+        for _ in range(steps):
+            self.predict_batch({"__warm_up__": np.zeros(STEP_SAMPLES, dtype=np.int16)})
+        self.remove_device("__warm_up__")
+
+    def _melspectrograms(self, audio: np.ndarray) -> np.ndarray:
+        """Melspectrograms of shape (batch, frames, 32) for int16 audio of shape (batch, samples)."""
+        if self.batch_melspectrogram:
+            spec = self.preprocessor.melspec_model_predict(audio.astype(np.float32))[0]
+            spec = spec.reshape(audio.shape[0], -1, 32)
+            return spec / 10 + 2
+        return np.stack([self.preprocessor._get_melspectrogram(x) for x in audio])
+
+    def predict_batch(self, steps: dict[str, np.ndarray]) -> dict[str, dict[str, float]]:
+        """
+        Predict on one 80 ms step (1280 int16 samples) per device.
+        Returns the scores of every wake word label per device.
+        """
+        device_ids = list(steps.keys())
+        states = [self.device(device_id) for device_id in device_ids]
+
+        audio = np.stack([np.concatenate((s.context, steps[d])) for d, s in zip(device_ids, states)])
+        spectrograms = self._melspectrograms(audio)
+
+        windows = []
+        for state, spec, x in zip(states, spectrograms, audio):
+            state.context = x[-MELSPEC_CONTEXT_SAMPLES:]
+            state.melspectrogram_buffer = np.vstack((state.melspectrogram_buffer, spec))[-MELSPEC_MAX_FRAMES:]
+            windows.append(state.melspectrogram_buffer[-MELSPEC_WINDOW:])
+
+        batch = np.stack(windows).astype(np.float32)[:, :, :, None]
+        embeddings = np.asarray(self.preprocessor.embedding_model_predict(batch)).reshape(len(states), -1)
+
+        results = {}
+        for device_id, state, embedding, x in zip(device_ids, states, embeddings, audio):
+            state.feature_buffer = np.vstack((state.feature_buffer, embedding))[-FEATURE_MAX_FRAMES:]
+            results[device_id] = self._classify(state, x[MELSPEC_CONTEXT_SAMPLES:])
+        return results
+
+    def _classify(self, state: DeviceState, step: np.ndarray) -> dict[str, float]:
+        predictions = {}
+        for mdl, predict in self.model.model_prediction_function.items():
+            n_inputs = self.model.model_inputs[mdl]
+            features = state.feature_buffer[-n_inputs:][None, ].astype(np.float32)
+            prediction = predict(features)
+            if self.model.model_outputs[mdl] == 1:
+                predictions[mdl] = float(prediction[0][0][0])
+            else:
+                for int_label, cls in self.model.class_mapping[mdl].items():
+                    predictions[cls] = float(prediction[0][0][int(int_label)])
+
+        for cls in predictions:
+            if len(state.prediction_buffer[cls]) < WARMUP_FRAMES:
+                predictions[cls] = 0.0
+            state.prediction_buffer[cls].append(predictions[cls])
+
+        if state.vad is not None:
+            state.vad(step)
+            # Same window `Model.predict` uses: 0.4 to 0.56 seconds before the current frame
+            vad_frames = list(state.vad.prediction_buffer)[-7:-4]
+            vad_max_score = np.max(vad_frames) if len(vad_frames) > 0 else 0
+            if vad_max_score < self.model.vad_threshold:
+                predictions = {cls: 0.0 for cls in predictions}
+        return predictions
@@ -13,12 +13,23 @@
 # limitations under the License.
 
 # Imports
-import numpy as np
-from openwakeword.model import Model
+from service_status import StartupTimer
+startup = StartupTimer("wake-word-detection")
+
+with startup.phase("import"):
+    import numpy as np
+    from openwakeword.model import Model
 import argparse
-import paho.mqtt.client as mqtt
-import paho.mqtt.publish as mqtt_publish
-import base64
+import json
+import time
+from collections import deque
+from threading import Condition, Thread
+
+from audio_frame import FrameDecoder, FrameError, SequenceTracker
+from batched_wake_word import BatchedWakeWordModel
+from energy_gate import EnergyGate
+from message_bus import connect_bus
+from tracing import Tracer, new_interaction_id
 
 # Parse input arguments
 parser=argparse.ArgumentParser()
@@ -36,42 +47,335 @@ parser.add_argument(
     default='tflite',
     required=False
 )
+parser.add_argument(
+    "--batch_window_ms",
+    help="How long to wait for chunks of other microphones before running a batch",
+    type=float,
+    default=20.0,
+    required=False
+)
+parser.add_argument(
+    "--queue_size",
+    help="How many chunks may wait for inference before the oldest ones are dropped",
+    type=int,
+    default=100,
+    required=False
+)
+parser.add_argument(
+    "--refractory_ms",
+    help="Minimum quiet time between two detections of the same wake word on one device",
+    type=int,
+    default=2000,
+    required=False
+)
+parser.add_argument(
+    "--gate_threshold_db",
+    help="How far above the noise floor a chunk has to be to run the models, 0 disables the energy gate",
+    type=float,
+    default=9.0,
+    required=False
+)
+parser.add_argument(
+    "--gate_preroll_ms",
+    help="Audio before the gate opened that is fed to the models first",
+    type=int,
+    default=1280,
+    required=False
+)
+parser.add_argument(
+    "--gate_hangover_ms",
+    help="How long the gate stays open after the audio got quiet again",
+    type=int,
+    default=1500,
+    required=False
+)
 
 args=parser.parse_args()
 
 # Load pre-trained openwakeword models
-if args.model_path != "":
-    wake_word_model = Model(wakeword_models=[args.model_path], inference_framework=args.inference_framework, enable_speex_noise_suppression=False, vad_threshold=0.5)
-else:
-    wake_word_model = Model(inference_framework=args.inference_framework, enable_speex_noise_suppression=False, vad_threshold=0.5)
+with startup.phase("load_model"):
+    if args.model_path != "":
+        wake_word_model = Model(wakeword_models=[args.model_path], inference_framework=args.inference_framework, enable_speex_noise_suppression=False, vad_threshold=0.5)
+    else:
+        wake_word_model = Model(inference_framework=args.inference_framework, enable_speex_noise_suppression=False, vad_threshold=0.5)
 
 n_models = len(wake_word_model.models.keys())
+wake_word_engine = BatchedWakeWordModel(wake_word_model)
+with startup.phase("warm_up"):
+    wake_word_engine.warm_up()
 
 broker = "localhost"
 port = 1883
-topic_wakeword = "wakeword/detected"
-topic_audio = "audio/stream"
+# Microphones publish on "audio/<device>/stream", the single microphone setup on "audio/stream"
+topic_audio = "audio/+/stream"
+topic_audio_legacy = "audio/stream"
+# Retained codec and chunk size of every stream
+topic_audio_meta = "audio/+/meta"
+topic_audio_meta_legacy = "audio/meta"
+topic_wakeword = "wakeword/{device}/detected"
+topic_wakeword_legacy = "wakeword/detected"
+LEGACY_DEVICE = "default"
 SCORE_THRESHOLD = 0.5
+# Devices without audio for this long are not waited for when batching
+DEVICE_IDLE_TIME = 1.0
+# Devices without audio for this long have their streaming state dropped
+DEVICE_EXPIRY_TIME = 60.0
+STATS_INTERVAL = 60.0
+
+
+def device_from_topic(topic):
+    levels = topic.split("/")
+    return levels[1] if len(levels) == 3 else LEGACY_DEVICE
+
+
+def wakeword_topic(device):
+    return topic_wakeword_legacy if device == LEGACY_DEVICE else topic_wakeword.format(device=device)
+
+
+class ChunkBatcher:
+    """
+    Collects the chunks of all microphones and runs one batched inference per time window.
+    Every full 80 ms step first passes the device's energy gate. A batch runs as soon as
+    every active device delivered a step, or when the window since the first waiting
+    chunk has passed.
+    """
+
+    def __init__(self, engine, window, gate_factory=None):
+        self.engine = engine
+        self.window = window
+        self.gate_factory = gate_factory
+        self.window_start = None
+        self.arrived = set()
+        self.gates = {}
+        # Per device, the waiting steps with the frame that completed each of them
+        self.queued = {}
+        self.last_seen = {}
+        self.sequence_trackers = {}
+        self.batches = 0
+        self.steps = 0
+        self.inference_time = 0.0
+        self.stats_start = time.monotonic()
+
+    def add(self, device, frame):
+        """Buffer a chunk and return the (device, label, score, frame) detections of any batch that ran."""
+        now = time.monotonic()
+        tracker = self.sequence_trackers.setdefault(device, SequenceTracker())
+        missed = tracker.update(frame)
+        if missed:
+            print(f"Missed {missed} audio chunk(s) of '{device}', {tracker.dropped} in total.")
+
+        state = self.engine.device(device)
+        state.push(frame.samples)
+        self.last_seen[device] = now
+        if self.window_start is None:
+            self.window_start = now
+
+        queue = self.queued.setdefault(device, deque())
+        if device not in self.gates and self.gate_factory is not None:
+            self.gates[device] = self.gate_factory()
+        gate = self.gates.get(device)
+        # Every step popped here ends in this frame, which is reported if the step scores
+        while state.has_step():
+            step = state.pop_step()
+            queue.extend(gate.process(step, (step, frame)) if gate is not None else [(step, frame)])
+            self.arrived.add(device)
+
+        active = {d for d, seen in self.last_seen.items() if now - seen < DEVICE_IDLE_TIME}
+        if not active <= self.arrived:
+            return self.poll(now)
+        return self._flush(now)
+
+    def poll(self, now=None):
+        """Run the waiting steps once the batch window has passed."""
+        now = time.monotonic() if now is None else now
+        if self.window_start is None or now - self.window_start < self.window:
+            return []
+        return self._flush(now)
+
+    def time_until_flush(self):
+        """Seconds until the current batch window closes, None if nothing is waiting."""
+        if self.window_start is None:
+            return None
+        return max(0.0, self.window_start + self.window - time.monotonic())
+
+    def _flush(self, now):
+        self.arrived.clear()
+        self.window_start = None
+        ready = {d for d, q in self.queued.items() if q}
+        detections = self._run(ready)
+        self._expire(now)
+        self._report(now)
+        return detections
+
+    def _run(self, ready):
+        detections = []
+        while ready:
+            items = {d: self.queued[d].popleft() for d in ready}
+            steps = {d: step for d, (step, _) in items.items()}
+            start = time.monotonic()
+            results = self.engine.predict_batch(steps)
+            self.inference_time += time.monotonic() - start
+            self.batches += 1
+            self.steps += len(steps)
+            for device, scores in results.items():
+                for label, score in scores.items():
+                    if score > SCORE_THRESHOLD:
+                        detections.append((device, label, score, items[device][1]))
+            ready = {d for d in ready if self.queued[d]}
+        return detections
+
+    def _expire(self, now):
+        for device in [d for d, seen in self.last_seen.items() if now - seen > DEVICE_EXPIRY_TIME]:
+            print(f"No audio from '{device}' since {DEVICE_EXPIRY_TIME}s, dropping its state.")
+            self.engine.remove_device(device)
+            for state in (self.last_seen, self.sequence_trackers, self.gates, self.queued):
+                state.pop(device, None)
+
+    def _report(self, now):
+        elapsed = now - self.stats_start
+        if elapsed < STATS_INTERVAL:
+            return
+        audio_time = self.steps * 0.08
+        print(f"Processed {self.steps} steps of {len(self.engine.devices)} device(s) in {self.batches} batches, "
+              f"inference took {self.inference_time:.2f}s for {audio_time:.1f}s of audio "
+              f"({self.inference_time / elapsed:.1%} of wall time).")
+        if self.gates:
+            gated = sum(gate.gated for gate in self.gates.values())
+            processed = sum(gate.processed for gate in self.gates.values())
+            print(f"Energy gate skipped {gated} of {gated + processed} steps since start, "
+                  f"{processed} were passed to the models.")
+        self.batches = 0
+        self.steps = 0
+        self.inference_time = 0.0
+        self.stats_start = now
+
+
+def create_energy_gate():
+    return EnergyGate(
+        threshold_db=args.gate_threshold_db,
+        preroll_steps=max(1, round(args.gate_preroll_ms / 80)),
+        hangover_steps=max(1, round(args.gate_hangover_ms / 80)),
+    )
+
+
+chunk_batcher = ChunkBatcher(
+    wake_word_engine,
+    args.batch_window_ms / 1000,
+    gate_factory=create_energy_gate if args.gate_threshold_db > 0 else None,
+)
+
+class ChunkQueue:
+    """
+    Bounded hand-over of audio chunks from the MQTT network thread to the inference worker.
+    When inference falls behind, the oldest chunks are dropped so `put` never blocks.
+    """
+
+    def __init__(self, maxsize):
+        self.items = deque(maxlen=maxsize)
+        self.condition = Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        with self.condition:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """Return the oldest chunk, or None if none arrived within `timeout` seconds."""
+        with self.condition:
+            if not self.items:
+                self.condition.wait(timeout)
+            return self.items.popleft() if self.items else None
+
+
+class DetectionDebouncer:
+    """Turns the run of above-threshold steps of one utterance into a single detection."""
+
+    def __init__(self, refractory_time):
+        self.refractory_time = refractory_time
+        self.last_above = {}
+
+    def accept(self, device, label, now):
+        # Every above-threshold step extends the quiet time required before the next event
+        last = self.last_above.get((device, label))
+        self.last_above[(device, label)] = now
+        return last is None or now - last >= self.refractory_time
+
+
+tracer = Tracer("wake-word-detection")
+chunk_queue = ChunkQueue(args.queue_size)
+debouncer = DetectionDebouncer(args.refractory_ms / 1000)
+
+def publish_detections(bus, detections):
+    now = time.monotonic()
+    for device, label, score, frame in detections:
+        if not debouncer.accept(device, label, now):
+            continue
+        print(f"Wake word '{label}' detected on '{device}'!")
+        # Starts the interaction that the following stages trace
+        interaction = new_interaction_id()
+        detection = {
+            "device": device,
+            "wakeword": label,
+            "score": score,
+            "sequence": frame.sequence,
+            "timestamp_ns": frame.timestamp_ns,
+            "interaction": interaction,
+        }
+        bus.publish(wakeword_topic(device), json.dumps(detection))
+        # The capture time is the microphone's wall clock, the only clock both sides share
+        capture_lag_ms = (time.time_ns() - frame.timestamp_ns) / 1e6 if frame.timestamp_ns else None
+        tracer.mark(bus, interaction, "wake_detected", device=device, wakeword=label,
+                    capture_lag_ms=capture_lag_ms)
+
+
+def run_inference(bus):
+    reported_dropped = 0
+    while True:
+        item = chunk_queue.get(timeout=chunk_batcher.time_until_flush())
+        if chunk_queue.dropped > reported_dropped:
+            print(f"Inference fell behind, dropped {chunk_queue.dropped - reported_dropped} oldest chunk(s), "
+                  f"{chunk_queue.dropped} in total.")
+            reported_dropped = chunk_queue.dropped
+        # A failing batch must not end the thread, detection would stop while the service looks ready
+        try:
+            publish_detections(bus, chunk_batcher.add(*item) if item is not None else chunk_batcher.poll())
+        except Exception as e:
+            print(f"Wake word inference failed: {e!r}")
 
-def on_message(client, userdata, msg):
-    decoded_chunk = base64.b64decode(msg.payload)
-    # Get audio
-    audio = np.frombuffer(decoded_chunk, dtype=np.int16)
 
-    # Feed to openWakeWord model
-    prediction = wake_word_model.predict(audio)
+# One decoder per device, used on the bus thread only. Frames are queued for the inference
+# thread and kept in the energy gate's pre-roll, so they are not decoded into a reused buffer
+frame_decoders = {}
 
-    for mdl in wake_word_model.prediction_buffer.keys():
-        # Add scores in formatted table
-        scores = list(wake_word_model.prediction_buffer[mdl])
-        if scores[-1] > SCORE_THRESHOLD:
-            print("Wake word detected!")
-            mqtt_publish.single(topic_wakeword, True, hostname=broker, port=port)
 
+def on_message(topic, payload):
+    device = device_from_topic(topic)
+    # setdefault would build a throwaway decoder for every frame
+    decoder = frame_decoders.get(device)
+    if decoder is None:
+        decoder = frame_decoders[device] = FrameDecoder()
+    if topic.endswith("/meta"):
+        try:
+            meta = decoder.configure(payload)
+        except FrameError as e:
+            print(f"Ignoring audio metadata of '{device}': {e}")
+            return
+        print(f"Audio of '{device}': {meta['codec']}, {meta['sample_rate']} Hz, {meta['channels']} channel(s).")
+        return
+    try:
+        frame = decoder.decode(payload)
+    except FrameError as e:
+        print(f"Ignoring invalid audio payload from '{device}': {e}")
+        return
+    chunk_queue.put((device, frame))
 
-client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
-client.on_message = on_message
-client.connect(broker, port, 60)
-client.subscribe(topic_audio)
-client.loop_forever()
 
+bus = connect_bus(broker, port, will=startup.will())
+bus.subscribe([topic_audio, topic_audio_legacy, topic_audio_meta, topic_audio_meta_legacy], on_message)
+inference_thread = Thread(target=run_inference, args=(bus,), daemon=True, name="inference-thread")
+inference_thread.start()
+bus.publish(*startup.ready(), retain=True, qos=1)
+bus.loop_forever()
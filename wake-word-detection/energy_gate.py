@@ -0,0 +1,79 @@
+"""
+Cheap energy gate in front of the wake word models.
+
+Most of the day the microphones record a silent room, yet the melspectrogram,
+embedding and classifier models would run on every 80 ms step. The gate compares the
+RMS energy of each step against an adaptive noise floor and only lets steps through
+that are clearly louder. When it opens, the steps recorded just before are released
+first (pre-roll), so the models see the start of a wake word that began in silence
+and their feature window is filled with current audio rather than audio from before
+the silence. After the energy drops the gate stays open for a hangover period so
+pauses inside a phrase do not close it.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+
+import numpy as np
+
+# Below this RMS (about -70 dBFS) the noise floor is not tracked any lower, so digital
+# silence does not make the gate open on the faintest noise
+MIN_NOISE_FLOOR = 10.0
+# Noise floor smoothing per step: fast when the level falls, slow when it rises, so
+# speech does not pull the floor up but a louder fridge eventually does
+FLOOR_FALL_RATE = 0.2
+FLOOR_RISE_RATE = 0.005
+
+
+class EnergyGate:
+    """Decides per 80 ms step whether the wake word models have to run."""
+
+    def __init__(self, threshold_db: float = 9.0, preroll_steps: int = 16, hangover_steps: int = 19):
+        self.ratio = 10 ** (threshold_db / 20)
+        self.preroll = deque(maxlen=preroll_steps)
+        self.hangover_steps = hangover_steps
+        self.noise_floor: float | None = None
+        self.open_steps = 0
+        self.gated = 0
+        self.processed = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self.open_steps > 0
+
+    def process(self, step: np.ndarray, item=None) -> list:
+        """Return the steps to run inference on for this step: none, the step itself, or pre-roll and step.
+
+        With `item`, e.g. the step together with the frame it came from, the items of
+        those steps are returned instead of the steps.
+        """
+        if item is None:
+            item = step
+        x = step.astype(np.float32)
+        rms = float(np.sqrt(np.dot(x, x) / len(x))) if len(x) else 0.0
+
+        if self.noise_floor is None:
+            self.noise_floor = max(rms, MIN_NOISE_FLOOR)
+        loud = rms > self.noise_floor * self.ratio
+        if not loud:
+            rate = FLOOR_FALL_RATE if rms < self.noise_floor else FLOOR_RISE_RATE
+            self.noise_floor = max(self.noise_floor + rate * (rms - self.noise_floor), MIN_NOISE_FLOOR)
+
+        if loud:
+            # The pre-roll is only filled while the gate is closed
+            steps = list(self.preroll)
+            self.preroll.clear()
+            self.gated -= len(steps)
+            self.open_steps = self.hangover_steps
+        elif self.is_open:
+            steps = []
+            self.open_steps -= 1
+        else:
+            self.preroll.append(item)
+            self.gated += 1
+            return []
+
+        steps.append(item)
+        self.processed += len(steps)
+        return steps
@@ -0,0 +1,82 @@
+"""
+Startup timings and readiness of a service.
+
+A service times its startup phases (imports, loading and warming up its models) and,
+once it subscribed to its topics and can answer right away, publishes a retained
+message on `service/<name>/ready`:
+
+    {"service": "speech-to-text", "ready": true, "pid": 42, "startup_ms": 5230,
+     "phases_ms": {"import": 310, "load_model": 4100, "warm_up": 820}}
+
+`startup_ms` counts from the start of the process. Retained, the message also reaches
+subscribers that connect later, like the benchmark waiting for the pipeline. The
+last will of the MQTT connection replaces it with `"ready": false` when the service
+goes away. With SERVICE_READY_FILE set, as in the Docker images, that file is created
+too, for the container health check.
+
+Keep this file identical in every service that uses it.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Tuple
+
+READY_TOPIC = "service/{name}/ready"
+
+
+def process_age() -> float:
+    """Seconds since this process started, 0 where /proc is not available."""
+    try:
+        with open("/proc/self/stat") as f:
+            stat = f.read()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        # starttime, field 22, in clock ticks since boot; the command name may contain spaces
+        start_ticks = int(stat[stat.rindex(")") + 2:].split()[19])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class StartupTimer:
+    def __init__(self, service: str):
+        self.service = service
+        self.topic = READY_TOPIC.format(name=service)
+        self.process_started = time.monotonic() - process_age()
+        self.phases: Dict[str, int] = {}
+        self.ready_file = os.environ.get("SERVICE_READY_FILE", "")
+        # Left over from before a container restart
+        if self.ready_file and os.path.exists(self.ready_file):
+            os.remove(self.ready_file)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = round((time.monotonic() - started) * 1000)
+            print(f"Startup phase '{name}' took {self.phases[name]} ms.")
+
+    def will(self) -> Tuple[str, str]:
+        """Topic and payload of the last will, telling that the service is gone."""
+        return self.topic, json.dumps({"service": self.service, "ready": False, "pid": os.getpid()})
+
+    def ready(self) -> Tuple[str, str]:
+        """Topic and payload of the ready message; publish it retained."""
+        startup_ms = round((time.monotonic() - self.process_started) * 1000)
+        if self.ready_file:
+            with open(self.ready_file, "w") as f:
+                f.write(f"{os.getpid()}\n")
+        print(f"Service '{self.service}' ready after {startup_ms} ms: {self.phases}")
+        return self.topic, json.dumps({
+            "service": self.service,
+            "ready": True,
+            "pid": os.getpid(),
+            "startup_ms": startup_ms,
+            "phases_ms": self.phases,
+        })